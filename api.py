@@ -4,17 +4,40 @@ FastAPI WebSocket API для Claude Admin Bot
 """
 
 import asyncio
+import hmac
 import logging
 import os
-import base64
-import subprocess
-import signal
-from typing import Dict, Set
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+import json
+import mimetypes
+import uuid
+from typing import AsyncIterator, Optional
+from urllib.parse import quote
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, PlainTextResponse, Response, StreamingResponse
 from dotenv import load_dotenv
 
+from config import (
+    WORK_DIR, FILES_DIR, CLAUDE_STREAM, UPLOAD_CHUNK_SIZE, OUTPUT_PAGE_SIZE, OUTPUT_PREVIEW_CHARS,
+    HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE, WS_DEFLATE, TELEGRAM_WEBHOOK_URL, TELEGRAM_WEBHOOK_PATH,
+    JOB_STORE, API_WORKERS, CLAUDE_PERSISTENT, FILE_ARCHIVE_FORMAT,
+)
+from claude_pool import pool
+from job_queue import JobCancelled, QueueFull, scheduler
+from claude_runner import JobLimits, parse_limits
+from sessions import SESSION_NAME_RE, registry
+from uploads import UploadManager, UploadError
+from blob_store import blob_store
+from output_spool import output_path, read_page
+from response_parser import Segment, parse_response, plain_text
+from history import history
+from outbox import create_registry
+from connections import ConnectionManager
+from file_index import file_index
+from prompt_cache import cached_note, prompt_cache
+from archives import ARCHIVE_FORMATS, archive_name, parse_range, stream_archive, stream_file
+from static_assets import StaticAssets, etag_matches
+from metrics import DOWNLOAD_BYTES, metrics, monitor_event_loop
+
 load_dotenv()
 
 logging.basicConfig(
@@ -27,186 +50,281 @@ logger = logging.getLogger(__name__)
 app = FastAPI(title="Claude Admin API")
 
 # Директории
-WORK_DIR = "/root"
-FILES_DIR = "/root/claude-admin-bot/files"
 WEBAPP_DIR = "/root/claude-admin-bot/webapp"
 
 os.makedirs(FILES_DIR, exist_ok=True)
 
-# Активные WebSocket соединения
-active_connections: Set[WebSocket] = set()
-
-# Блокировка для предотвращения множественных запросов
-claude_busy = False
-
-
-class ConnectionManager:
-    """Менеджер WebSocket соединений"""
+# Страница, стили и скрипт интерфейса: в памяти, сжатые, с хешем в URL
+static_assets = StaticAssets(WEBAPP_DIR)
 
-    def __init__(self):
-        self.active_connections: Dict[WebSocket, bool] = {}
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections[websocket] = True
-        logger.info(f"WebSocket connected. Total: {len(self.active_connections)}")
-
-    def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            del self.active_connections[websocket]
-        logger.info(f"WebSocket disconnected. Total: {len(self.active_connections)}")
-
-    async def send_message(self, websocket: WebSocket, message: dict):
-        """Отправка сообщения конкретному клиенту"""
-        if websocket in self.active_connections:
-            try:
-                await websocket.send_json(message)
-            except Exception as e:
-                logger.error(f"Error sending message: {e}")
-
-    async def broadcast(self, message: dict):
-        """Отправка сообщения всем подключенным клиентам"""
-        for connection in list(self.active_connections.keys()):
-            try:
-                await connection.send_json(message)
-            except Exception as e:
-                logger.error(f"Error broadcasting: {e}")
+# HTTP без авторизации видит только загруженные файлы: в WORK_DIR (/root) лежат
+# ключи, .env и токен бота. Весь WORK_DIR доступен через Telegram (проверка ADMIN_ID)
+PUBLIC_ROOTS = [os.path.realpath(FILES_DIR)]
 
+# Незавершённые загрузки (готовые файлы — в blob_store, по содержимому)
+uploads = UploadManager(blob_store)
 
+# Соединения: своя очередь отправки у каждого
 manager = ConnectionManager()
 
+# Кадры ответов каждого браузера с досылкой после переподключения
+# (при JOB_STORE=1 — через общее хранилище, вкладка может попасть в любой процесс)
+outboxes = create_registry(manager.send_message)
+
 
-async def execute_claude_command(text: str, websocket: WebSocket):
+async def execute_claude_command(text: str, client: str, limits: JobLimits):
     """
     Выполнение команды Claude с отправкой статусов
     """
-    global claude_busy
+    session = registry.active(client)
+    outbox = outboxes.get(client)
+    job_id = uuid.uuid4().hex[:12]
+    streamed = 0
+    status_shown = False
+
+    async def send_frame(frame: dict):
+        # Через outbox: кадры нумеруются и дойдут даже после переподключения браузера
+        await outbox.publish({"id": job_id, **frame})
+
+    async def send_delta(chunk: str):
+        # Огромный ответ не льём в браузер целиком — дальше он доступен постранично
+        nonlocal streamed
+        if streamed >= OUTPUT_PREVIEW_CHARS:
+            return
+        chunk = chunk[:OUTPUT_PREVIEW_CHARS - streamed]
+        streamed += len(chunk)
+        await send_frame({"type": "delta", "content": chunk})
+
+    async def show_position(position: int):
+        await send_frame({"type": "queued", "position": position})
+
+    async def show_status(elapsed: int):
+        # Без потокового режима: процесс идёт дольше 10 секунд — показываем статус
+        nonlocal status_shown
+        content = f"⏳ Обрабатываю... ({elapsed}с)" if status_shown else "⏳ Обрабатываю..."
+        status_shown = True
+        await send_frame({
+            "type": "status",
+            "content": content
+        })
 
-    if claude_busy:
-        await manager.send_message(websocket, {
-            "type": "response",
-            "content": "⏳ Предыдущий запрос ещё обрабатывается, подожди...",
+    async def job():
+        # Повторный вопрос — ответ из кэша, без запуска Claude.
+        # Смотрим здесь, в очереди беседы: предыдущий запрос мог её уже начать
+        fresh = (registry.get(session.name) or session).fresh
+        cache_key, result = await prompt_cache.get(text, WORK_DIR, fresh, bypass=not limits.cache)
+        if result is not None:
+            # CLI ответа не видел — беседа передаст его Claude со следующим ходом
+            registry.remember_cached(session.name, text, result.stdout)
+        else:
+            limit_args = {"timeout": limits.timeout, "max_output": limits.max_output}
+            if CLAUDE_STREAM:
+                result = await registry.ask(session.name, text, cwd=WORK_DIR, on_delta=send_delta, **limit_args)
+            else:
+                result = await registry.ask(session.name, text, cwd=WORK_DIR, on_status=show_status, **limit_args)
+            await prompt_cache.put(cache_key, text, WORK_DIR, result)
+
+        if result.timed_out:
+            content = f"⏱ Claude не ответил за {limits.timeout_text} (процесс завершён)"
+            history.record_response(session.name, client, result, [Segment("text", content)], status="timeout")
+            await send_frame({
+                "type": "done",
+                "content": content,
+                "has_code": False
+            })
+            return
+
+        # Без служебных строк CLI, со всеми блоками кода
+        segments = parse_response(result.text)
+        if result.truncated:
+            segments.append(Segment("text", f"✂️ Ответ длиннее {limits.max_output} символов — Claude остановлен"))
+        if result.cached is not None:
+            segments.append(Segment("text", f"♻️ {cached_note(result.cached)}"))
+        history.record_response(session.name, client, result, segments,
+                                status="truncated" if result.truncated else "cached" if result.cached is not None
+                                else "ok")
+        code_blocks = [s for s in segments if s.kind == "code"]
+
+        frame = {
+            "type": "done",
+            "content": plain_text(segments),
+            "segments": [s.to_dict() for s in segments],
+            "has_code": bool(code_blocks),
+            "code_snippet": code_blocks[0].content if code_blocks else None
+        }
+        if result.spilled:
+            # Огромный ответ: начало сразу, остальное клиент дочитает через /outputs
+            frame["output"] = {
+                "id": result.output_id,
+                "size": result.output_size,
+                "bytes": os.path.getsize(result.output_path)
+            }
+
+        # Финальный кадр с полным ответом
+        await send_frame(frame)
+
+    history.record_prompt(session.name, client, text)
+    outbox.begin(job_id)
+
+    try:
+        # Запросы одной беседы идут по очереди, разных — параллельно
+        await scheduler.run(session.name, job, on_position=show_position, job_id=job_id)
+    except QueueFull:
+        await send_frame({
+            "type": "done",
+            "content": "⏳ Очередь заполнена, попробуй чуть позже",
             "has_code": False
         })
+    except JobCancelled:
+        history.record_response(session.name, client, None, [Segment("text", "⛔ Запрос отменён")],
+                                status="cancelled")
+        await send_frame({
+            "type": "done",
+            "content": "⛔ Запрос отменён",
+            "has_code": False,
+            "cancelled": True
+        })
+    except Exception as e:
+        logger.error(f"Ошибка выполнения Claude: {e}")
+        history.record_response(session.name, client, None, [Segment("text", f"❌ Ошибка: {e}")], status="error")
+        await send_frame({
+            "type": "done",
+            "content": f"❌ Ошибка: {str(e)}",
+            "has_code": False
+        })
+    finally:
+        outbox.end(job_id)
+
+
+async def handle_session_command(data: dict, websocket: WebSocket, client: str):
+    """Список, переключение, создание и форк бесед"""
+    action = data.get("action", "list")
+    name = (data.get("name") or "").strip()
+    error = None
+
+    if action in ("switch", "new", "fork"):
+        if not SESSION_NAME_RE.match(name):
+            error = "Имя беседы: буквы, цифры, _, -, ., до 40 символов"
+        else:
+            try:
+                if action == "new":
+                    registry.create(client, name)
+                elif action == "fork":
+                    registry.fork(client, name)
+                else:
+                    registry.switch(client, name)
+            except ValueError as e:
+                error = str(e)
+
+    await manager.send_message(websocket, {
+        "type": "sessions",
+        "active": registry.active(client).name,
+        "sessions": [
+            {"name": s.name, "started": s.started or bool(s.cached), "created": s.created}
+            for s in registry.list()
+        ],
+        "error": error
+    })
+
+
+async def handle_upload_init(data: dict, websocket: WebSocket):
+    """Начало (или продолжение после реконнекта) загрузки файла"""
+    upload_id = data.get("upload_id")
+    kind = data.get("kind", "file")
+    try:
+        # Клиент прислал хеш — если содержимое уже есть, загружать нечего
+        file_path = await asyncio.to_thread(uploads.dedupe, data.get("filename"), data.get("sha256"))
+        if file_path:
+            await send_upload_done(websocket, upload_id, kind, file_path, data["sha256"].lower(), deduplicated=True)
+            return
+
+        # Продолжение после рестарта дочитывает .part в хеш — не на event loop
+        upload = await asyncio.to_thread(uploads.init, upload_id, data.get("filename"), int(data.get("size", -1)),
+                                         kind)
+    except (UploadError, ValueError, TypeError) as e:
+        # TypeError — "size": null или объект вместо числа
+        await manager.send_message(websocket, {"type": "upload_error", "upload_id": upload_id, "error": str(e)})
         return
 
-    claude_busy = True
-    claude_process = None
+    await manager.send_message(websocket, {
+        "type": "upload_ready",
+        "upload_id": upload.id,
+        "offset": upload.received,
+        "chunk_size": UPLOAD_CHUNK_SIZE
+    })
+
 
+async def handle_upload_chunk(frame: bytes, websocket: WebSocket):
+    """Бинарный кусок: пишем сразу в файл и подтверждаем смещение"""
     try:
-        # Экранируем специальные символы для bash
-        escaped_text = text.replace("'", "'\\''")
-
-        # Формируем команду для Claude
-        claude_command = f"echo '{escaped_text}' | claude -p --continue --model haiku --input-format text"
-
-        # Запускаем процесс
-        claude_process = subprocess.Popen(
-            claude_command,
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            cwd=WORK_DIR,
-            preexec_fn=os.setsid
-        )
-
-        # Первые 10 секунд ждём без статуса
-        try:
-            stdout, stderr = claude_process.communicate(timeout=10)
-            response = stdout.strip() or stderr.strip() or "Нет ответа"
-        except subprocess.TimeoutExpired:
-            # Процесс идёт дольше 10 секунд — показываем статус
-            await manager.send_message(websocket, {
-                "type": "status",
-                "content": "⏳ Обрабатываю..."
-            })
+        upload, offset, accepted = uploads.chunk(frame)
+    except UploadError as e:
+        await manager.send_message(websocket, {"type": "upload_error", "error": str(e)})
+        return
 
-            elapsed = 10
-            poll_interval = 30
-
-            while elapsed < 300:  # Максимум 5 минут
-                try:
-                    stdout, stderr = claude_process.communicate(timeout=poll_interval)
-                    response = stdout.strip() or stderr.strip() or "Нет ответа"
-                    break
-                except subprocess.TimeoutExpired:
-                    elapsed += poll_interval
-                    await manager.send_message(websocket, {
-                        "type": "status",
-                        "content": f"⏳ Обрабатываю... ({elapsed}с)"
-                    })
-                    continue
-            else:
-                # Таймаут 5 минут истёк
-                os.killpg(os.getpgid(claude_process.pid), signal.SIGTERM)
-                claude_process.wait(timeout=5)
-                await manager.send_message(websocket, {
-                    "type": "response",
-                    "content": "⏱ Claude не ответил за 5 минут (процесс завершён)",
-                    "has_code": False
-                })
-                return
-
-        # Очищаем от служебных сообщений
-        lines = response.split('\n')
-        clean_lines = [l for l in lines if not l.startswith('[') and not l.startswith('Using model')]
-        response = '\n'.join(clean_lines).strip() or response
-
-        # Проверяем, есть ли в ответе код (простая эвристика)
-        has_code = False
-        code_snippet = None
-
-        # Если в ответе есть блоки кода между ```
-        if '```' in response:
-            # Извлекаем первый блок кода
-            parts = response.split('```')
-            if len(parts) >= 3:
-                code_snippet = parts[1]
-                # Убираем язык если указан (bash, python и тд)
-                if '\n' in code_snippet:
-                    lines = code_snippet.split('\n')
-                    if lines[0].strip() in ['bash', 'sh', 'python', 'js', 'json']:
-                        code_snippet = '\n'.join(lines[1:])
-                code_snippet = code_snippet.strip()
-                has_code = True
-                # Убираем блок кода из основного текста
-                response = parts[0] + (parts[2] if len(parts) > 2 else '')
-                response = response.strip()
-
-        # Отправляем ответ
+    if accepted:
         await manager.send_message(websocket, {
-            "type": "response",
-            "content": response,
-            "has_code": has_code,
-            "code_snippet": code_snippet
+            "type": "upload_progress",
+            "upload_id": upload.id,
+            "offset": upload.received,
+            "size": upload.size
         })
-
-    except Exception as e:
-        logger.error(f"Ошибка выполнения Claude: {e}")
+    elif offset >= upload.received:
+        # Пропуск или битый кусок — клиент продолжит с нашего смещения
         await manager.send_message(websocket, {
-            "type": "response",
-            "content": f"❌ Ошибка: {str(e)}",
-            "has_code": False
+            "type": "upload_ready",
+            "upload_id": upload.id,
+            "offset": upload.received,
+            "chunk_size": UPLOAD_CHUNK_SIZE
         })
 
-        # Убеждаемся что процесс завершён
-        if claude_process and claude_process.poll() is None:
-            try:
-                os.killpg(os.getpgid(claude_process.pid), signal.SIGTERM)
-                claude_process.wait(timeout=5)
-            except:
-                pass
-    finally:
-        # Освобождаем блокировку
-        claude_busy = False
 
-        # Финальная проверка что процесс точно завершён
-        if claude_process and claude_process.poll() is None:
-            try:
-                os.killpg(os.getpgid(claude_process.pid), signal.SIGKILL)
-            except:
-                pass
+async def handle_upload_commit(data: dict, websocket: WebSocket):
+    """Завершение загрузки: проверка хеша и перенос файла на место"""
+    upload_id = data.get("upload_id")
+    upload = uploads.uploads.get(upload_id) if isinstance(upload_id, str) else None
+    kind = upload.kind if upload else "file"
+
+    try:
+        # Перенос в хранилище может перечитать блоб и скопировать файл — не на event loop
+        file_path, _, digest = await asyncio.to_thread(uploads.commit, upload_id, data.get("sha256"))
+    except UploadError as e:
+        await manager.send_message(websocket, {"type": "upload_error", "upload_id": upload_id, "error": str(e)})
+        return
+
+    await send_upload_done(websocket, upload_id, kind, file_path, digest)
+
+
+async def send_upload_done(websocket: WebSocket, upload_id: str, kind: str, file_path: str,
+                           digest: str, deduplicated: bool = False):
+    label = "Изображение сохранено" if kind == "image" else "Файл сохранён"
+    note = " — уже было на сервере, загрузка пропущена" if deduplicated else ""
+    file_size = os.path.getsize(file_path)
+    await manager.send_message(websocket, {
+        "type": "upload_done",
+        "upload_id": upload_id,
+        "sha256": digest,
+        "deduplicated": deduplicated,
+        "content": f"✅ {label}{note}:\n{file_path}\n({file_size / 1024:.1f} КБ)",
+        "has_code": True,
+        "code_snippet": file_path
+    })
+
+
+def number(value) -> Optional[float]:
+    """Число из JSON-кадра (строки и bool не принимаем)"""
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+async def handle_cancel(data: dict, websocket: WebSocket, client: str):
+    """Отмена запросов активной беседы клиента (или одного — по id из кадров ответа)"""
+    session = registry.active(client)
+    job_id = data.get("id") or None
+    cancelled = await scheduler.cancel_jobs(session.name, job_id)
+    await manager.send_message(websocket, {
+        "type": "status",
+        "content": f"⛔ Отменено запросов: {cancelled}" if cancelled else f"Нечего отменять в беседе {session.name}"
+    })
 
 
 @app.websocket("/ws")
@@ -214,98 +332,278 @@ async def websocket_endpoint(websocket: WebSocket):
     """WebSocket endpoint для чата"""
     await manager.connect(websocket)
 
+    # Браузер присылает постоянный client_id — по нему находим его беседу
+    client = f"ws:{websocket.query_params.get('client') or uuid.uuid4().hex[:12]}"
+    await handle_session_command({"action": "list"}, websocket, client)
+
+    # После переподключения досылаем кадры, пропущенные с last_seq
+    last_seq = websocket.query_params.get("last_seq")
+    await outboxes.attach(
+        client, websocket,
+        websocket.query_params.get("epoch"),
+        int(last_seq) if last_seq and last_seq.isdigit() else None,
+    )
+
     try:
         while True:
-            # Получаем сообщение от клиента
-            data = await websocket.receive_json()
+            # Получаем сообщение от клиента: JSON или бинарный кусок загрузки
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+
+            if message.get("bytes") is not None:
+                await handle_upload_chunk(message["bytes"], websocket)
+                continue
 
+            data = json.loads(message["text"])
             message_type = data.get("type")
 
             if message_type == "text":
-                # Текстовое сообщение
-                content = data.get("content", "").strip()
+                # Текстовое сообщение; лимиты — полями кадра или в начале текста
+                limits, content = parse_limits(data.get("content", "").strip())
+                limits = limits.update(number(data.get("timeout")), number(data.get("max_output")))
+                if data.get("cache") is False:
+                    limits.cache = False
                 if content:
                     logger.info(f"Received text: {content[:50]}...")
                     # Выполняем команду Claude в фоне
-                    asyncio.create_task(execute_claude_command(content, websocket))
-
-            elif message_type == "file":
-                # Загрузка файла
-                filename = data.get("filename")
-                file_content = data.get("content")  # base64
-
-                if filename and file_content:
-                    try:
-                        file_data = base64.b64decode(file_content)
-                        file_path = os.path.join(FILES_DIR, filename)
-
-                        with open(file_path, 'wb') as f:
-                            f.write(file_data)
-
-                        file_size = os.path.getsize(file_path)
-
-                        await manager.send_message(websocket, {
-                            "type": "response",
-                            "content": f"✅ Файл сохранён:\n{file_path}\n({file_size / 1024:.1f} КБ)",
-                            "has_code": True,
-                            "code_snippet": file_path
-                        })
-
-                        logger.info(f"File saved: {filename} ({file_size} bytes)")
-                    except Exception as e:
-                        await manager.send_message(websocket, {
-                            "type": "response",
-                            "content": f"❌ Ошибка сохранения файла: {str(e)}",
-                            "has_code": False
-                        })
-
-            elif message_type == "image":
-                # Загрузка изображения (аналогично файлу)
-                filename = data.get("filename")
-                file_content = data.get("content")
-
-                if filename and file_content:
-                    try:
-                        file_data = base64.b64decode(file_content)
-                        file_path = os.path.join(FILES_DIR, filename)
-
-                        with open(file_path, 'wb') as f:
-                            f.write(file_data)
-
-                        file_size = os.path.getsize(file_path)
-
-                        await manager.send_message(websocket, {
-                            "type": "response",
-                            "content": f"✅ Изображение сохранено:\n{file_path}\n({file_size / 1024:.1f} КБ)",
-                            "has_code": True,
-                            "code_snippet": file_path
-                        })
-
-                        logger.info(f"Image saved: {filename} ({file_size} bytes)")
-                    except Exception as e:
-                        await manager.send_message(websocket, {
-                            "type": "response",
-                            "content": f"❌ Ошибка сохранения изображения: {str(e)}",
-                            "has_code": False
-                        })
+                    asyncio.create_task(execute_claude_command(content, client, limits))
+
+            elif message_type == "cancel":
+                await handle_cancel(data, websocket, client)
+
+            elif message_type == "session":
+                await handle_session_command(data, websocket, client)
+
+            elif message_type == "upload_init":
+                await handle_upload_init(data, websocket)
+
+            elif message_type == "upload_commit":
+                await handle_upload_commit(data, websocket)
 
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
+        pass
     except Exception as e:
         logger.error(f"WebSocket error: {e}")
+    finally:
+        outboxes.detach(client, websocket)
         manager.disconnect(websocket)
 
 
+@app.get("/history")
+async def read_history(session: str, before: Optional[int] = None, limit: int = HISTORY_PAGE_SIZE):
+    """Страница истории беседы от новых к старым; next_before — курсор следующей страницы"""
+    limit = max(1, min(limit, HISTORY_MAX_PAGE))
+    messages, next_before = await asyncio.to_thread(history.page, session, before, limit)
+    return {"session": session, "messages": messages, "next_before": next_before}
+
+
+@app.get("/history/search")
+async def search_history(q: str, session: Optional[str] = None, before: Optional[int] = None,
+                         limit: int = HISTORY_PAGE_SIZE):
+    """Полнотекстовый поиск по истории (всех бесед или одной)"""
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Пустой запрос")
+    limit = max(1, min(limit, HISTORY_MAX_PAGE))
+    messages, next_before = await asyncio.to_thread(history.search, q, session, before, limit)
+    return {"query": q, "messages": messages, "next_before": next_before}
+
+
+@app.get("/outputs/{output_id}")
+async def read_output(output_id: str, offset: int = 0, limit: int = OUTPUT_PAGE_SIZE):
+    """Страница огромного ответа Claude: с байта offset, не больше limit байт"""
+    path = output_path(output_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Ответ не найден")
+
+    size = os.path.getsize(path)
+    offset = max(0, min(offset, size))
+    limit = max(1, min(limit, OUTPUT_PAGE_SIZE))
+    content, next_offset = await asyncio.to_thread(read_page, path, offset, limit)
+    return {
+        "id": output_id,
+        "offset": offset,
+        "next_offset": next_offset,
+        "size": size,
+        "eof": next_offset >= size,
+        "content": content
+    }
+
+
+@app.get("/outputs/{output_id}/download")
+async def download_output(output_id: str):
+    """Огромный ответ Claude целиком файлом"""
+    path = output_path(output_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Ответ не найден")
+    return FileResponse(path, media_type="text/plain; charset=utf-8", filename=f"claude-{output_id[:8]}.txt")
+
+
+@app.get("/files/search")
+async def search_files(q: str, limit: int = 20):
+    """Нечёткий поиск по именам файлов FILES_DIR"""
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Пустой запрос")
+    limit = max(1, min(limit, HISTORY_MAX_PAGE))
+    entries = await file_index.search(q, limit, roots=PUBLIC_ROOTS)
+    return {
+        "query": q,
+        "files": [
+            {"path": e.path, "name": os.path.basename(e.path), "size": e.size, "mtime": e.mtime, "dir": e.is_dir}
+            for e in entries
+        ],
+    }
+
+
+def attachment(filename: str) -> str:
+    """Content-Disposition с именем в UTF-8 (RFC 6266)"""
+    return f"attachment; filename*=utf-8''{quote(filename)}"
+
+
+async def counted(chunks: AsyncIterator[bytes], kind: str) -> AsyncIterator[bytes]:
+    async for chunk in chunks:
+        DOWNLOAD_BYTES.inc(len(chunk), kind=kind)
+        yield chunk
+
+
+@app.api_route("/files/download", methods=["GET", "HEAD"])
+async def download_file(request: Request, path: str, format: str = FILE_ARCHIVE_FORMAT):
+    """
+    Файл из FILES_DIR с поддержкой Range (докачка, перемотка),
+    каталог — архивом zip или tar, который собирается во время отдачи
+    """
+    real = file_index.resolve(path, PUBLIC_ROOTS)
+    if real is None:
+        raise HTTPException(status_code=404, detail="Файл не найден")
+
+    if os.path.isdir(real):
+        if format not in ARCHIVE_FORMATS:
+            raise HTTPException(status_code=400, detail="Формат архива: zip или tar")
+        # Размер архива заранее неизвестен: без Content-Length и без Range
+        headers = {"Content-Disposition": attachment(archive_name(real, format))}
+        media_type = "application/zip" if format == "zip" else "application/x-tar"
+        if request.method == "HEAD":
+            return Response(media_type=media_type, headers=headers)
+        return StreamingResponse(counted(stream_archive(real, format), "archive"), media_type=media_type,
+                                 headers=headers)
+
+    try:
+        st = os.stat(real)
+    except OSError:
+        raise HTTPException(status_code=404, detail="Файл не найден")
+    etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Content-Disposition": attachment(os.path.basename(real)),
+    }
+    media_type = mimetypes.guess_type(real)[0] or "application/octet-stream"
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    # If-Range: файл изменился с прошлой докачки — отдаём целиком
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    if if_range is None or if_range == etag:
+        try:
+            byte_range = parse_range(request.headers.get("range"), st.st_size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{st.st_size}"})
+
+    status = 200
+    start, end = 0, st.st_size
+    if byte_range is not None:
+        start, end = byte_range
+        status = 206
+        headers["Content-Range"] = f"bytes {start}-{end - 1}/{st.st_size}"
+    headers["Content-Length"] = str(end - start)
+    if request.method == "HEAD":
+        return Response(status_code=status, media_type=media_type, headers=headers)
+    return StreamingResponse(counted(stream_file(real, start, end), "file"), status_code=status,
+                             media_type=media_type, headers=headers)
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Метрики в формате Prometheus"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+if TELEGRAM_WEBHOOK_URL:
+    # Бот в этом же процессе: общие event loop, очередь Claude и реестр бесед
+    import bot as telegram
+
+    @app.post(TELEGRAM_WEBHOOK_PATH)
+    async def telegram_webhook(request: Request):
+        """Апдейты Telegram (webhook)"""
+        secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(secret, telegram.WEBHOOK_SECRET):
+            raise HTTPException(status_code=403, detail="Forbidden")
+        telegram.feed_webhook(await request.json())
+        return {"ok": True}
+
+
+@app.on_event("startup")
+async def startup():
+    """Сборка статики; замер опоздания event loop и памяти для /metrics; индекс файлов; webhook бота"""
+    await asyncio.to_thread(static_assets.build)
+    app.state.loop_monitor = asyncio.create_task(monitor_event_loop())
+    file_index.start()
+    if TELEGRAM_WEBHOOK_URL:
+        await telegram.start_webhook()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Закрываем постоянные процессы Claude и дописываем историю"""
+    if TELEGRAM_WEBHOOK_URL:
+        await telegram.stop_webhook()
+    await pool.close()
+    await file_index.close()
+    await asyncio.to_thread(history.close)
+
+
 # Статические файлы и главная страница
-app.mount("/static", StaticFiles(directory=WEBAPP_DIR), name="static")
+
+def static_response(request: Request, url: str) -> Response:
+    """Файл интерфейса в лучшем сжатии, которое принимает браузер; 304, если у браузера он уже есть"""
+    asset = static_assets.get(url)
+    if asset is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    encoding, body = asset.select(request.headers.get("accept-encoding"))
+    etag = asset.etag(encoding)
+    headers = {"ETag": etag, "Cache-Control": asset.cache_control, "Vary": "Accept-Encoding"}
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type=asset.media_type, headers=headers)
+
+
+@app.api_route("/static/{name:path}", methods=["GET", "HEAD"])
+async def read_static(request: Request, name: str):
+    """Стили и скрипт; по адресу с хешем — кэш навсегда"""
+    return static_response(request, f"/static/{name}")
+
+
+@app.api_route("/sw.js", methods=["GET", "HEAD"])
+async def read_service_worker(request: Request):
+    """Service worker: оболочка интерфейса из кэша браузера"""
+    return static_response(request, "/sw.js")
 
 
-@app.get("/")
-async def read_index():
+@app.api_route("/", methods=["GET", "HEAD"])
+async def read_index(request: Request):
     """Главная страница"""
-    return FileResponse(os.path.join(WEBAPP_DIR, "index.html"))
+    return static_response(request, "/")
 
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8005, log_level="info")
+    if API_WORKERS > 1 and not JOB_STORE:
+        raise SystemExit("API_WORKERS > 1 требует JOB_STORE=1: иначе у каждого процесса своя очередь и свои кадры")
+    if JOB_STORE and CLAUDE_PERSISTENT:
+        logger.warning("JOB_STORE=1 с CLAUDE_PERSISTENT=1: процесс беседы живёт в одном воркере "
+                       "и не видит ответов, данных в других")
+    uvicorn.run("api:app" if API_WORKERS > 1 else app, host="0.0.0.0", port=8005, log_level="info",
+                workers=API_WORKERS, ws="websockets", ws_per_message_deflate=WS_DEFLATE)
@@ -0,0 +1,223 @@
+"""
+Отдача файлов и каталогов потоком: архивы на лету, диапазоны байт, тома
+Каталог упаковывается в zip или tar во время отправки, без готового архива
+на диске: упаковка идёт в отдельном потоке, наружу выходят куски по CHUNK
+байт, очередь между ними ограничена — медленный получатель притормаживает
+упаковку. Те же куски режутся на тома для Telegram.
+"""
+
+import asyncio
+import io
+import logging
+import os
+import queue
+import re
+import shutil
+import tarfile
+import tempfile
+import threading
+import zipfile
+from typing import AsyncIterator, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CHUNK = 256 * 1024  # Кусок потока
+QUEUE_CHUNKS = 8  # Кусков в очереди между упаковкой и отправкой
+ARCHIVE_FORMATS = {"zip": ".zip", "tar": ".tar"}
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class ArchiveStopped(Exception):
+    """Получатель ушёл — упаковку пора прекращать"""
+
+
+class _QueueWriter(io.RawIOBase):
+    """Файл только на запись: всё записанное уходит в очередь кусками по CHUNK"""
+
+    def __init__(self, chunks: queue.Queue, stop: threading.Event):
+        super().__init__()
+        self._chunks = chunks
+        self._stop = stop
+        self._buffer = bytearray()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        if self._stop.is_set():
+            raise ArchiveStopped()
+        self._buffer += data
+        if len(self._buffer) >= CHUNK:
+            self.put(bytes(self._buffer))
+            self._buffer.clear()
+        return len(data)
+
+    def put(self, item: Optional[bytes]):
+        while True:
+            try:
+                self._chunks.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                if self._stop.is_set():
+                    raise ArchiveStopped()
+
+    def finish(self):
+        if self._buffer:
+            self.put(bytes(self._buffer))
+            self._buffer.clear()
+
+
+def archive_name(path: str, fmt: str) -> str:
+    return (os.path.basename(path.rstrip(os.sep)) or "root") + ARCHIVE_FORMATS[fmt]
+
+
+def _walk(path: str) -> Iterator[Tuple[str, str]]:
+    """(путь, имя в архиве) для каталога и всего под ним; по ссылкам на каталоги не ходим"""
+    base = os.path.basename(path.rstrip(os.sep)) or "root"
+    for directory, dirs, files in os.walk(path, followlinks=False):
+        dirs.sort()
+        relative = os.path.relpath(directory, path)
+        prefix = base if relative == "." else os.path.join(base, relative)
+        yield directory, prefix
+        for name in sorted(files):
+            yield os.path.join(directory, name), os.path.join(prefix, name)
+
+
+def _pack(path: str, fmt: str, writer: _QueueWriter):
+    """Упаковка в потоке; нечитаемые файлы пропускаются"""
+    if fmt == "zip":
+        # Быстрое сжатие: узкое место — сеть, а не размер
+        archive = zipfile.ZipFile(writer, "w", zipfile.ZIP_DEFLATED, compresslevel=1)
+        add = archive.write
+    else:
+        archive = tarfile.open(fileobj=writer, mode="w|", format=tarfile.PAX_FORMAT)
+
+        def add(name, arcname):
+            archive.add(name, arcname, recursive=False)
+
+    with archive:
+        for name, arcname in _walk(path):
+            try:
+                add(name, arcname)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipped {name} in archive: {e}")
+    writer.finish()
+
+
+async def stream_archive(path: str, fmt: str) -> AsyncIterator[bytes]:
+    """Каталог архивом fmt (zip | tar) по кускам"""
+    chunks: queue.Queue = queue.Queue(maxsize=QUEUE_CHUNKS)
+    stop = threading.Event()
+    writer = _QueueWriter(chunks, stop)
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+
+    def run():
+        error = None
+        try:
+            _pack(path, fmt, writer)
+        except ArchiveStopped:
+            pass
+        except BaseException as e:
+            error = e
+        try:
+            writer.put(None)
+        except ArchiveStopped:
+            pass
+        loop.call_soon_threadsafe(lambda: done.done() or done.set_result(error))
+
+    # Свой поток, а не общий пул to_thread: упаковка может идти долго
+    threading.Thread(target=run, name=f"archive {path}", daemon=True).start()
+    try:
+        while True:
+            chunk = await asyncio.to_thread(chunks.get)
+            if chunk is None:
+                break
+            yield chunk
+        error = await done
+        if error is not None:
+            raise error
+    finally:
+        stop.set()
+
+
+async def stream_file(path: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+    """Байты файла [start, end) по кускам (end=None — до конца)"""
+    f = await asyncio.to_thread(open, path, "rb")
+    try:
+        await asyncio.to_thread(f.seek, start)
+        left = None if end is None else end - start
+        while left is None or left > 0:
+            chunk = await asyncio.to_thread(f.read, CHUNK if left is None else min(CHUNK, left))
+            if not chunk:
+                break
+            if left is not None:
+                left -= len(chunk)
+            yield chunk
+    finally:
+        await asyncio.to_thread(f.close)
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Заголовок Range → [start, end) или None (отдать файл целиком)
+    Несколько диапазонов не поддерживаем — тогда тоже весь файл.
+    ValueError — диапазон вне файла (ответ 416).
+    """
+    match = RANGE_RE.match((header or "").strip())
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    first, last = match.groups()
+    if first == "":
+        # bytes=-500 — последние 500 байт
+        start, end = max(size - int(last), 0), size
+    else:
+        start = int(first)
+        end = min(int(last) + 1, size) if last else size
+    if start >= size or start >= end:
+        raise ValueError(f"range {header} outside of {size} bytes")
+    return start, end
+
+
+async def spool_volumes(chunks: AsyncIterator[bytes], directory: str, name: str,
+                        volume_size: int) -> AsyncIterator[Tuple[str, str]]:
+    """
+    Поток кусками-файлами по volume_size байт: (путь, имя тома)
+    Имя тома — name, если поток уместился в один, иначе name.001, name.002…
+    (склеиваются `cat name.0* > name`). Следующий том пишется после того,
+    как получатель забрал предыдущий: на диске не больше одного тома.
+    """
+    os.makedirs(directory, exist_ok=True)
+    spool = await asyncio.to_thread(tempfile.mkdtemp, dir=directory)
+    iterator = chunks.__aiter__()
+    pending = b""
+    finished = False
+    index = 0
+    try:
+        while not finished:
+            index += 1
+            path = os.path.join(spool, f"{index:03d}")
+            written = 0
+            with open(path, "wb") as f:
+                while written < volume_size:
+                    if not pending:
+                        try:
+                            pending = await iterator.__anext__()
+                        except StopAsyncIteration:
+                            finished = True
+                            break
+                    piece, pending = pending[:volume_size - written], pending[volume_size - written:]
+                    await asyncio.to_thread(f.write, piece)
+                    written += len(piece)
+            if not finished and not pending:
+                # Том заполнен ровно — есть ли что-то дальше?
+                try:
+                    pending = await iterator.__anext__()
+                except StopAsyncIteration:
+                    finished = True
+            yield path, name if finished and index == 1 else f"{name}.{index:03d}"
+            await asyncio.to_thread(os.remove, path)
+    finally:
+        if hasattr(iterator, "aclose"):
+            await iterator.aclose()
+        await asyncio.to_thread(shutil.rmtree, spool, True)
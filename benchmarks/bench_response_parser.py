@@ -0,0 +1,102 @@
+"""
+Разбор больших ответов: старая обработка (фильтр строк + split по ```) vs ResponseParser
+
+Запуск:
+    python benchmarks/bench_response_parser.py
+    BENCH_SIZE_MB=20 python benchmarks/bench_response_parser.py
+"""
+
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from response_parser import ResponseParser, parse_response, render_markdown  # noqa: E402
+
+SIZE_MB = float(os.getenv("BENCH_SIZE_MB", "5"))
+ROUNDS = int(os.getenv("BENCH_ROUNDS", "5"))
+DELTA_SIZE = 40  # Примерный размер одной дельты stream-json
+
+
+def make_markdown(size: int) -> str:
+    """Ответ в духе Claude: короткие абзацы, служебные строки и много блоков кода"""
+    block = (
+        "Using model haiku\n"
+        "Вот что нужно сделать на сервере, чтобы перезапустить сервис и проверить логи.\n"
+        "Сначала посмотрим состояние:\n\n"
+        "```bash\nsystemctl status nginx\njournalctl -u nginx --since '1 hour ago' | tail -n 50\n```\n\n"
+        "[tool] Bash: systemctl status nginx\n"
+        "Если конфиг сломан, поправь его:\n\n"
+        "```python\nimport subprocess\n\nsubprocess.run(['nginx', '-t'], check=True)\nprint('ok')\n```\n\n"
+    )
+    return block * (size // len(block) + 1)
+
+
+def make_log(size: int) -> str:
+    """Огромный вывод команды: пара абзацев и длинный блок лога"""
+    line = "2024-05-01 12:00:00 INFO nginx: 127.0.0.1 - - \"GET /api/v1/items HTTP/1.1\" 200 512\n"
+    return (
+        "Вот последние записи лога:\n\n```log\n"
+        + line * (size // len(line) + 1)
+        + "```\n\nОшибок не видно, сервис отвечает 200.\n"
+    )
+
+
+def legacy(response: str):
+    """Обработка из api.py до ResponseParser"""
+    lines = response.split('\n')
+    clean_lines = [l for l in lines if not l.startswith('[') and not l.startswith('Using model')]
+    response = '\n'.join(clean_lines).strip() or response
+
+    code_snippet = None
+    if '```' in response:
+        parts = response.split('```')
+        if len(parts) >= 3:
+            code_snippet = parts[1]
+            if '\n' in code_snippet:
+                lines = code_snippet.split('\n')
+                if lines[0].strip() in ['bash', 'sh', 'python', 'js', 'json']:
+                    code_snippet = '\n'.join(lines[1:])
+            code_snippet = code_snippet.strip()
+            response = parts[0] + (parts[2] if len(parts) > 2 else '')
+            response = response.strip()
+    return response, code_snippet
+
+
+def streamed(response: str):
+    """Те же данные, поданные дельтами по мере генерации"""
+    parser = ResponseParser()
+    for i in range(0, len(response), DELTA_SIZE):
+        parser.feed(response[i:i + DELTA_SIZE])
+    return parser.close()
+
+
+def bench(name: str, func, response: str):
+    timings = []
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        func(response)
+        timings.append(time.perf_counter() - started)
+    mb_s = len(response) / 1024 / 1024 / statistics.median(timings)
+    print(f"{name:<36} p50 {statistics.median(timings) * 1000:8.1f} ms  {mb_s:7.1f} MB/s")
+
+
+def main():
+    size = int(SIZE_MB * 1024 * 1024)
+    for title, response in (("Markdown с кодом", make_markdown(size)), ("Длинный лог", make_log(size))):
+        segments = parse_response(response)
+        code = sum(1 for s in segments if s.kind == "code")
+        print(f"{title}: {len(response) / 1024 / 1024:.1f} M символов, блоков кода: {code}, раундов: {ROUNDS}")
+
+        bench("старая обработка (1 блок кода)", legacy, response)
+        bench("ResponseParser целиком", parse_response, response)
+        bench(f"ResponseParser дельтами по {DELTA_SIZE}", streamed, response)
+        bench("разбор + сообщения Telegram", lambda text: render_markdown(parse_response(text)), response)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Задержка ответа: новый процесс на каждое сообщение vs постоянный процесс беседы
+
+Запуск (по умолчанию с заглушкой benchmarks/fake_claude.py):
+    python benchmarks/bench_warm_sessions.py
+    CLAUDE_BIN=claude python benchmarks/bench_warm_sessions.py  # настоящий CLI
+"""
+
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault("CLAUDE_BIN", os.path.join(ROOT, "benchmarks", "fake_claude.py"))
+os.environ.setdefault("CLAUDE_WORK_DIR", tempfile.mkdtemp(prefix="claude-bench-"))
+os.environ.setdefault("CLAUDE_FILES_DIR", os.environ["CLAUDE_WORK_DIR"])
+
+from claude_runner import run_claude  # noqa: E402
+from claude_pool import ClaudePool  # noqa: E402
+
+MESSAGES = int(os.getenv("BENCH_MESSAGES", "10"))
+
+
+def report(name: str, latencies):
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{name:<28} mean {statistics.mean(latencies) * 1000:7.0f} ms"
+          f"  p50 {p50 * 1000:7.0f} ms  p99 {p99 * 1000:7.0f} ms")
+
+
+async def bench_spawn():
+    latencies = []
+    for i in range(MESSAGES):
+        started = time.monotonic()
+        await run_claude(f"сообщение {i}")
+        latencies.append(time.monotonic() - started)
+    return latencies
+
+
+async def bench_persistent(pool: ClaudePool, session: str, session_args):
+    latencies = []
+    for i in range(MESSAGES):
+        started = time.monotonic()
+        await pool.ask(session, f"сообщение {i}", session_args=session_args)
+        latencies.append(time.monotonic() - started)
+    return latencies
+
+
+async def main():
+    print(f"CLAUDE_BIN={os.environ['CLAUDE_BIN']}, {MESSAGES} сообщений подряд\n")
+
+    report("spawn на каждое сообщение", await bench_spawn())
+
+    pool = ClaudePool(warm_size=1)
+    try:
+        # Первое сообщение беседы платит за запуск, дальше процесс уже живой
+        report("persistent (--continue)", await bench_persistent(pool, "continue", ("--continue",)))
+
+        # Новая беседа: процесс берётся из тёплого пула
+        await pool._fill_warm()
+        started = time.monotonic()
+        await pool.ask("new", "первое сообщение")
+        print(f"{'новая беседа из тёплого пула':<28} {(time.monotonic() - started) * 1000:7.0f} ms")
+    finally:
+        await pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
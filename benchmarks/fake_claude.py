@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Заглушка Claude CLI для бенчмарков
+Понимает те же флаги, что использует бот: -p, --input-format text|stream-json,
+--output-format stream-json. Поведение задаётся переменными окружения:
+
+FAKE_CLAUDE_STARTUP  — задержка запуска процесса, сек (по умолчанию 0.5)
+FAKE_CLAUDE_LATENCY  — задержка до первого текста, сек (по умолчанию 0.2)
+FAKE_CLAUDE_OUTPUT   — длина ответа в символах (по умолчанию 0 — короткое "Ответ на: ...")
+FAKE_CLAUDE_CHUNK    — символов в одной дельте stream-json (по умолчанию 200)
+FAKE_CLAUDE_CADENCE  — пауза между дельтами, сек (по умолчанию 0)
+"""
+
+import json
+import os
+import sys
+import time
+import uuid
+
+STARTUP = float(os.getenv("FAKE_CLAUDE_STARTUP", "0.5"))
+LATENCY = float(os.getenv("FAKE_CLAUDE_LATENCY", "0.2"))
+OUTPUT = int(os.getenv("FAKE_CLAUDE_OUTPUT", "0"))
+CHUNK = max(1, int(os.getenv("FAKE_CLAUDE_CHUNK", "200")))
+CADENCE = float(os.getenv("FAKE_CLAUDE_CADENCE", "0"))
+
+FILLER = "Строка ответа с кодом `ls -la` и пояснением.\n"
+
+
+def answer(prompt: str) -> str:
+    text = f"Ответ на: {prompt}"
+    if OUTPUT > len(text):
+        text += "\n" + FILLER * ((OUTPUT - len(text)) // len(FILLER) + 1)
+        text = text[:OUTPUT]
+    return text
+
+
+def chunks(text: str):
+    """Ответ кусками по CHUNK символов с паузой CADENCE между ними"""
+    for start in range(0, len(text), CHUNK):
+        if start and CADENCE:
+            time.sleep(CADENCE)
+        yield text[start:start + CHUNK]
+
+
+def emit(event: dict):
+    sys.stdout.write(json.dumps(event, ensure_ascii=False) + "\n")
+    sys.stdout.flush()
+
+
+def stream_turn(prompt: str, session_id: str):
+    time.sleep(LATENCY)
+    text = answer(prompt)
+    for chunk in chunks(text):
+        emit({"type": "stream_event", "session_id": session_id,
+              "event": {"type": "content_block_delta", "delta": {"type": "text_delta", "text": chunk}}})
+    emit({"type": "result", "subtype": "success", "result": text, "session_id": session_id, "is_error": False})
+
+
+def main():
+    args = sys.argv[1:]
+    input_format = args[args.index("--input-format") + 1] if "--input-format" in args else "text"
+    output_format = args[args.index("--output-format") + 1] if "--output-format" in args else "text"
+    session_id = args[args.index("--session-id") + 1] if "--session-id" in args else str(uuid.uuid4())
+
+    # Имитация загрузки CLI и истории беседы
+    time.sleep(STARTUP)
+
+    if input_format == "stream-json":
+        emit({"type": "system", "subtype": "init", "session_id": session_id})
+        for line in sys.stdin:
+            if not line.strip():
+                continue
+            message = json.loads(line)
+            content = message["message"]["content"]
+            prompt = "".join(block.get("text", "") for block in content) if isinstance(content, list) else content
+            stream_turn(prompt, session_id)
+        return
+
+    prompt = sys.stdin.read().strip()
+    if output_format == "stream-json":
+        emit({"type": "system", "subtype": "init", "session_id": session_id})
+        stream_turn(prompt, session_id)
+    else:
+        time.sleep(LATENCY)
+        for chunk in chunks(answer(prompt)):
+            sys.stdout.write(chunk)
+            sys.stdout.flush()
+        sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
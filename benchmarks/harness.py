@@ -0,0 +1,112 @@
+"""
+Общая часть нагрузочных тестов: заглушка claude в PATH, отчёт, память
+
+Заглушка — benchmarks/fake_claude.py под именем claude во временном каталоге,
+который ставится первым в PATH: бот и API запускают её так же, как настоящий
+CLI. Параметры заглушки — переменные FAKE_CLAUDE_* (см. fake_claude.py).
+"""
+
+import os
+import re
+import statistics
+import sys
+import tempfile
+from typing import Dict, List, Optional, Sequence
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_CLAUDE = os.path.join(ROOT, "benchmarks", "fake_claude.py")
+
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from metrics import Histogram, HistogramData, LAG_BUCKETS, resident_memory  # noqa: E402
+
+
+def fake_claude_env(**fake: str) -> Dict[str, str]:
+    """
+    Окружение с заглушкой claude первой в PATH и временными каталогами бота
+    fake — параметры заглушки: latency="0.5" → FAKE_CLAUDE_LATENCY=0.5
+    """
+    base = tempfile.mkdtemp(prefix="claude-load-")
+    bin_dir = os.path.join(base, "bin")
+    os.makedirs(bin_dir)
+    wrapper = os.path.join(bin_dir, "claude")
+    with open(wrapper, "w") as f:
+        f.write(f'#!/bin/sh\nexec "{sys.executable}" "{FAKE_CLAUDE}" "$@"\n')
+    os.chmod(wrapper, 0o755)
+
+    env = {
+        "PATH": f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}",
+        "CLAUDE_BIN": "claude",
+        "CLAUDE_WORK_DIR": os.path.join(base, "work"),
+        "CLAUDE_FILES_DIR": os.path.join(base, "files"),
+        "CLAUDE_DATA_DIR": os.path.join(base, "data"),
+    }
+    for name in ("work", "files", "data"):
+        os.makedirs(os.path.join(base, name))
+    for key, value in fake.items():
+        env[f"FAKE_CLAUDE_{key.upper()}"] = str(value)
+    # Заданное снаружи важнее значений по умолчанию
+    for key in list(env):
+        if key.startswith(("FAKE_CLAUDE_", "CLAUDE_")) and key in os.environ:
+            env[key] = os.environ[key]
+    return env
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def ms(value: Optional[float]) -> str:
+    return "—" if value is None or value != value else f"{value * 1000:.0f} ms"
+
+
+def report_latency(title: str, values: List[float]):
+    print(f"{title:<28} n={len(values):<6} p50 {ms(statistics.median(values) if values else None):>8}"
+          f"  p99 {ms(percentile(values, 0.99)):>8}  max {ms(max(values) if values else None):>8}")
+
+
+def report_lag(histogram: Histogram, data: Optional[HistogramData] = None):
+    data = data or histogram.merged()
+    print(f"{'Опоздание event loop':<28} n={data.count:<6} p50 {ms(histogram.quantile(0.5, data)):>8}"
+          f"  p99 {ms(histogram.quantile(0.99, data)):>8}")
+
+
+def report_memory(title: str, rss: int, peak: Optional[int] = None):
+    line = f"{title:<28} RSS {rss / 1024 ** 2:.0f} МБ"
+    if peak:
+        line += f", пик {peak / 1024 ** 2:.0f} МБ"
+    print(line)
+
+
+def peak_memory(pid: int) -> Optional[int]:
+    """Пиковый RSS процесса (VmHWM) в байтах, если есть /proc"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def process_memory(pid: int) -> int:
+    return resident_memory(str(pid))
+
+
+BUCKET_RE = re.compile(r'^event_loop_lag_seconds_bucket\{le="([^"]+)"\} (\d+)$', re.M)
+
+
+def lag_from_metrics(text: str) -> HistogramData:
+    """Гистограмма опоздания event loop из ответа /metrics"""
+    data = HistogramData(len(LAG_BUCKETS) + 1)
+    previous = 0
+    for i, (_, cumulative) in enumerate(BUCKET_RE.findall(text)):
+        data.counts[i] = int(cumulative) - previous
+        previous = int(cumulative)
+    data.count = previous
+    return data
@@ -0,0 +1,125 @@
+"""
+Нагрузочный тест api.py: много клиентов /ws, заглушка claude в PATH
+
+API запускается настоящим uvicorn в отдельном процессе. Каждый клиент — свой
+браузер (client=...), то есть своя беседа: отправляет LOAD_MESSAGES промптов
+подряд и ждёт кадр done на каждый. Опоздание event loop и память сервера —
+из GET /metrics и /proc.
+
+Запуск:
+    python benchmarks/load_api.py
+    LOAD_CLIENTS=200 CLAUDE_WORKERS=16 FAKE_CLAUDE_OUTPUT=20000 FAKE_CLAUDE_CADENCE=0.01 \\
+        python benchmarks/load_api.py
+    JOB_STORE=1 API_WORKERS=4 python benchmarks/load_api.py  # несколько процессов uvicorn
+    (опоздание loop и память — тогда только одного процесса, того, что ответил на /metrics)
+"""
+
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from harness import (  # noqa: E402
+    ROOT, fake_claude_env, lag_from_metrics, peak_memory, process_memory,
+    report_lag, report_latency, report_memory,
+)
+from metrics import LOOP_LAG  # noqa: E402
+
+CLIENTS = int(os.getenv("LOAD_CLIENTS", "50"))
+MESSAGES = int(os.getenv("LOAD_MESSAGES", "5"))
+PORT = int(os.getenv("LOAD_PORT", "8767"))
+
+
+def start_server() -> subprocess.Popen:
+    env = {
+        **os.environ,
+        **fake_claude_env(startup="0.05", latency="0.2", output="2000", chunk="200", cadence="0.01"),
+    }
+    env.setdefault("CLAUDE_WORKERS", "8")
+    env.setdefault("CLAUDE_QUEUE_SIZE", str(CLIENTS * 2))
+    # Лог сервера — в файл, чтобы не мешал отчёту
+    log = open(os.path.join(env["CLAUDE_DATA_DIR"], "api.log"), "w")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api:app", "--port", str(PORT), "--ws", "websockets",
+         "--log-level", "warning", "--workers", env.get("API_WORKERS", "1")],
+        cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    deadline = time.monotonic() + 20
+    while True:
+        try:
+            with socket.create_connection(("127.0.0.1", PORT), timeout=0.5):
+                return server
+        except OSError:
+            if server.poll() is not None or time.monotonic() > deadline:
+                server.kill()
+                raise RuntimeError("api.py did not start")
+            time.sleep(0.1)
+
+
+async def client(number: int, latencies: list, first_delta: list, failures: list):
+    import websockets
+
+    url = f"ws://127.0.0.1:{PORT}/ws?client=load{number}-{uuid.uuid4().hex[:6]}"
+    async with websockets.connect(url, max_size=None) as ws:
+        for i in range(MESSAGES):
+            started = time.perf_counter()
+            first = None
+            await ws.send(json.dumps({"type": "text", "content": f"клиент {number}, сообщение {i}"}))
+            while True:
+                frame = json.loads(await ws.recv())
+                if frame.get("type") == "delta" and first is None:
+                    first = time.perf_counter() - started
+                elif frame.get("type") == "done":
+                    break
+            if "segments" not in frame:
+                # Очередь заполнена или ошибка — в done только текст
+                failures.append(frame.get("content"))
+                continue
+            latencies.append(time.perf_counter() - started)
+            if first is not None:
+                first_delta.append(first)
+
+
+async def run() -> dict:
+    latencies: list = []
+    first_delta: list = []
+    failures: list = []
+    started = time.perf_counter()
+    await asyncio.gather(*(client(i, latencies, first_delta, failures) for i in range(CLIENTS)))
+    return {"elapsed": time.perf_counter() - started, "latencies": latencies,
+            "first_delta": first_delta, "failures": failures}
+
+
+def main():
+    server = start_server()
+    try:
+        rss_before = process_memory(server.pid)
+        result = asyncio.run(run())
+        metrics_text = urllib.request.urlopen(f"http://127.0.0.1:{PORT}/metrics").read().decode()
+        rss_after = process_memory(server.pid)
+        peak = peak_memory(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+
+    done = len(result["latencies"])
+    print(f"api.py: {CLIENTS} клиентов × {MESSAGES} сообщений, "
+          f"CLAUDE_WORKERS={os.getenv('CLAUDE_WORKERS', '8')}\n")
+    print(f"{'Пропускная способность':<28} {done / result['elapsed']:.1f} ответов/с "
+          f"({done} за {result['elapsed']:.1f} с, отказов {len(result['failures'])})")
+    report_latency("До первой дельты", result["first_delta"])
+    report_latency("До done", result["latencies"])
+    report_lag(LOOP_LAG, lag_from_metrics(metrics_text))
+    report_memory("Память сервера", rss_after, peak)
+    print(f"{'':<28} до нагрузки {rss_before / 1024 ** 2:.0f} МБ")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Нагрузочный тест bot.py: синтетические Update в диспетчер aiogram
+
+Бот импортируется в этот же процесс, апдейты идут через dp.feed_update —
+тот же путь, что при polling. Запросы к Telegram не уходят в сеть: их
+принимает заглушка make_request сессии бота с задержкой LOAD_TELEGRAM_LATENCY,
+а SendScheduler (лимиты, схлопывание правок) работает как обычно.
+Claude — заглушка в PATH.
+
+Запуск:
+    python benchmarks/load_bot.py
+    LOAD_CHATS=100 TELEGRAM_GLOBAL_RATE=30 python benchmarks/load_bot.py  # настоящие лимиты
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from harness import fake_claude_env, peak_memory, report_lag, report_latency, report_memory  # noqa: E402
+
+CHATS = int(os.getenv("LOAD_CHATS", "30"))
+MESSAGES = int(os.getenv("LOAD_MESSAGES", "3"))
+TELEGRAM_LATENCY = float(os.getenv("LOAD_TELEGRAM_LATENCY", "0.05"))
+ADMIN_ID = 1000
+
+# До импорта бота: окружение читается при импорте config и bot
+os.environ.update(fake_claude_env(startup="0.05", latency="0.2", output="2000", chunk="200", cadence="0.01"))
+os.environ["CLAUDE_BOT_TOKEN"] = "123456:load-test-token"
+os.environ["ADMIN_TELEGRAM_ID"] = str(ADMIN_ID)
+os.environ.setdefault("CLAUDE_WORKERS", "8")
+os.environ.setdefault("CLAUDE_QUEUE_SIZE", str(CHATS * 2))
+# Лимиты Telegram по умолчанию не ограничивают тест — меряем сам бот
+os.environ.setdefault("TELEGRAM_CHAT_RATE", "1000")
+os.environ.setdefault("TELEGRAM_GLOBAL_RATE", "1000")
+os.environ.setdefault("TELEGRAM_EDIT_INTERVAL", "0.2")
+
+from aiogram.methods import TelegramMethod  # noqa: E402
+from aiogram.types import Chat, Message, Update, User  # noqa: E402
+
+import bot as bot_module  # noqa: E402
+from metrics import LOOP_LAG, monitor_event_loop, resident_memory  # noqa: E402
+
+requests = Counter()
+message_ids = iter(range(1, 10 ** 9))
+
+
+async def fake_make_request(bot, method: TelegramMethod, timeout=None):
+    """Ответ Telegram без сети: bool-методам — True, остальным — сообщение"""
+    requests[type(method).__name__] += 1
+    await asyncio.sleep(TELEGRAM_LATENCY)
+    if method.__returning__ is bool:
+        return True
+    chat_id = getattr(method, "chat_id", 0)
+    return Message(
+        message_id=getattr(method, "message_id", None) or next(message_ids),
+        date=datetime.now(),
+        chat=Chat(id=chat_id, type="private"),
+        text=getattr(method, "text", None),
+    ).as_(bot)
+
+
+def make_update(update_id: int, chat_id: int, text: str) -> Update:
+    return Update(
+        update_id=update_id,
+        message=Message(
+            message_id=update_id,
+            date=datetime.now(),
+            chat=Chat(id=chat_id, type="private"),
+            from_user=User(id=ADMIN_ID, is_bot=False, first_name="Load"),
+            text=text,
+        ),
+    )
+
+
+async def chat(number: int, latencies: list):
+    """Один чат: сообщения по очереди, каждое — до конца обработки"""
+    chat_id = 10_000 + number
+    for i in range(MESSAGES):
+        update = make_update(number * 1000 + i, chat_id, f"чат {number}, сообщение {i}")
+        started = time.perf_counter()
+        await bot_module.dp.feed_update(bot_module.bot, update)
+        latencies.append(time.perf_counter() - started)
+
+
+async def main():
+    logging.getLogger().setLevel(logging.WARNING)  # Логи каждого запроса мешают отчёту
+    bot_module.bot.session.make_request = fake_make_request
+    monitor = asyncio.create_task(monitor_event_loop())
+
+    latencies: list = []
+    rss_before = resident_memory()
+    started = time.perf_counter()
+    await asyncio.gather(*(chat(i, latencies) for i in range(CHATS)))
+    elapsed = time.perf_counter() - started
+
+    monitor.cancel()
+    await bot_module.pool.close()
+    await asyncio.to_thread(bot_module.history.close)
+
+    print(f"\nbot.py: {CHATS} чатов × {MESSAGES} сообщений, CLAUDE_WORKERS={os.environ['CLAUDE_WORKERS']}, "
+          f"задержка Telegram {TELEGRAM_LATENCY * 1000:.0f} ms\n")
+    print(f"{'Пропускная способность':<28} {len(latencies) / elapsed:.1f} ответов/с "
+          f"({len(latencies)} за {elapsed:.1f} с)")
+    report_latency("Обработка сообщения", latencies)
+    report_lag(LOOP_LAG)
+    report_memory("Память", resident_memory(), peak_memory(os.getpid()))
+    print(f"{'':<28} до нагрузки {rss_before / 1024 ** 2:.0f} МБ")
+    print(f"{'Запросы к Telegram':<28} " + ", ".join(f"{name} {count}" for name, count in requests.most_common()))
+    scheduler = next(m for m in bot_module.bot.session.middleware if hasattr(m, "merged"))
+    print(f"{'':<28} правок схлопнуто {scheduler.merged}, повторов после 429 {scheduler.retried}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
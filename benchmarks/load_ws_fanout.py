@@ -0,0 +1,189 @@
+"""
+Нагрузочный тест рассылки по WebSocket: сотни клиентов, часть из них не читает
+
+Сравнивает старый ConnectionManager (send_json по очереди каждому клиенту)
+с connections.ConnectionManager (своя очередь и писатель у соединения,
+сериализация один раз). Сервер — настоящий uvicorn в отдельном процессе,
+клиенты — websockets. Задержка рассылки — от момента, когда кадр должен был
+уйти по расписанию, до получения клиентом: если рассылка тормозит генератор
+кадров, это тоже задержка.
+
+Запуск:
+    python benchmarks/load_ws_fanout.py
+    LOAD_CLIENTS=500 LOAD_SLOW=20 LOAD_DEFLATE=1 python benchmarks/load_ws_fanout.py
+"""
+
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+CLIENTS = int(os.getenv("LOAD_CLIENTS", "200"))
+SLOW = int(os.getenv("LOAD_SLOW", "5"))  # Клиенты, которые подключились и не читают
+FRAMES = int(os.getenv("LOAD_FRAMES", "500"))
+INTERVAL = float(os.getenv("LOAD_INTERVAL", "0.01"))  # Пауза между кадрами (темп дельт Claude)
+FRAME_SIZE = int(os.getenv("LOAD_FRAME_SIZE", "1000"))
+DEFLATE = os.getenv("LOAD_DEFLATE", "0") == "1"
+PORT = int(os.getenv("LOAD_PORT", "8766"))
+
+
+def make_app(mode: str):
+    from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+
+    if mode == "legacy":
+        class ConnectionManager:
+            """Как было до очередей: send_json каждому клиенту по очереди"""
+
+            def __init__(self):
+                self.active_connections = {}
+
+            async def connect(self, websocket: WebSocket):
+                await websocket.accept()
+                self.active_connections[websocket] = True
+
+            def disconnect(self, websocket: WebSocket):
+                self.active_connections.pop(websocket, None)
+
+            async def broadcast(self, message: dict):
+                for connection in list(self.active_connections):
+                    try:
+                        await connection.send_json(message)
+                    except Exception:
+                        pass
+    else:
+        from connections import ConnectionManager
+
+    app = FastAPI()
+    manager = ConnectionManager()
+
+    async def fire(count: int):
+        text = "x" * FRAME_SIZE
+        started = time.time()
+        for i in range(count):
+            scheduled = started + i * INTERVAL
+            await asyncio.sleep(max(0.0, scheduled - time.time()))
+            await manager.broadcast({"type": "delta", "id": "0123456789ab", "seq": i + 1,
+                                     "ts": scheduled, "content": text})
+
+    @app.websocket("/ws")
+    async def ws_endpoint(websocket: WebSocket):
+        await manager.connect(websocket)
+        try:
+            while True:
+                data = await websocket.receive_json()
+                if "go" in data:
+                    asyncio.create_task(fire(data["go"]))
+        except WebSocketDisconnect:
+            pass
+        finally:
+            manager.disconnect(websocket)
+
+    return app
+
+
+def serve(mode: str):
+    import uvicorn
+    uvicorn.run(make_app(mode), host="127.0.0.1", port=PORT, log_level="warning",
+                ws="websockets", ws_per_message_deflate=DEFLATE)
+
+
+async def reader(url: str, latencies: list, done: asyncio.Event, received: list):
+    import websockets
+    async with websockets.connect(url, compression="deflate" if DEFLATE else None, max_size=None) as ws:
+        done.set()
+        count = 0
+        while count < FRAMES:
+            frame = json.loads(await ws.recv())
+            latencies.append(time.time() - frame["ts"])
+            count += 1
+        received.append(count)
+
+
+async def slow_client(url: str, ready: asyncio.Event, stop: asyncio.Event):
+    """Подключается и не читает: после заполнения буферов TCP сервер упирается в него"""
+    import websockets
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)  # Маленький буфер заполнится быстро
+    sock.connect(("127.0.0.1", PORT))
+    async with websockets.connect(url, sock=sock, max_queue=1, read_limit=2 ** 10,
+                                  compression="deflate" if DEFLATE else None) as ws:
+        ready.set()
+        ws.transport.pause_reading()
+        await stop.wait()
+
+
+async def run_clients() -> dict:
+    import websockets
+
+    url = f"ws://127.0.0.1:{PORT}/ws"
+    latencies: list = []
+    received: list = []
+    stop = asyncio.Event()
+
+    ready = [asyncio.Event() for _ in range(CLIENTS + SLOW)]
+    tasks = [asyncio.create_task(reader(url, latencies, ready[i], received)) for i in range(CLIENTS)]
+    tasks += [asyncio.create_task(slow_client(url, ready[CLIENTS + i], stop)) for i in range(SLOW)]
+    await asyncio.wait_for(asyncio.gather(*(event.wait() for event in ready)), timeout=60)
+
+    started = time.perf_counter()
+    async with websockets.connect(url) as control:
+        await control.send(json.dumps({"go": FRAMES}))
+        readers = tasks[:CLIENTS]
+        _, pending = await asyncio.wait(readers, timeout=120)
+        elapsed = time.perf_counter() - started
+    for task in pending:
+        task.cancel()
+    stop.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    latencies.sort()
+    return {
+        "frames": len(latencies),
+        "complete": len(received),
+        "elapsed": elapsed,
+        "p50": statistics.median(latencies) if latencies else float("nan"),
+        "p99": latencies[int(len(latencies) * 0.99) - 1] if latencies else float("nan"),
+        "max": latencies[-1] if latencies else float("nan"),
+    }
+
+
+def run(mode: str) -> dict:
+    server = subprocess.Popen([sys.executable, __file__, "serve", mode], cwd=ROOT)
+    try:
+        deadline = time.monotonic() + 15
+        while True:
+            try:
+                with socket.create_connection(("127.0.0.1", PORT), timeout=0.5):
+                    break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("server did not start")
+                time.sleep(0.1)
+        return asyncio.run(run_clients())
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    print(f"{CLIENTS} клиентов + {SLOW} не читающих, {FRAMES} кадров по {FRAME_SIZE} байт, "
+          f"deflate={'да' if DEFLATE else 'нет'}")
+    print(f"{'режим':<10} {'дошло':>14} {'время, с':>9} {'p50, мс':>9} {'p99, мс':>9} {'max, мс':>9}")
+    for mode in ("legacy", "queued"):
+        r = run(mode)
+        print(f"{mode:<10} {r['complete']:>5}/{CLIENTS:<4} кл. {r['elapsed']:>9.2f} "
+              f"{r['p50'] * 1000:>9.1f} {r['p99'] * 1000:>9.1f} {r['max'] * 1000:>9.1f}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "serve":
+        serve(sys.argv[2])
+    else:
+        main()
@@ -0,0 +1,263 @@
+"""
+Хранилище файлов по содержимому для FILES_DIR
+Содержимое лежит один раз в .blobs/<sha256>, а файлы с человеческими именами
+в FILES_DIR — reflink-копии блоба там, где ФС умеет copy-on-write (btrfs, xfs),
+иначе жёсткие ссылки на него: второй копии на диске нет ни в каком случае.
+Бот работает от root, и правка жёсткой ссылки на месте меняет блоб. Поэтому
+манифест помнит размер и время изменения блоба на момент, когда мы сами
+посчитали его хеш: изменились — блоб перечитывается, а не совпавший с хешем
+отвязывается от хранилища (правленый файл остаётся под своим именем).
+Манифест помнит и имя → хеш, и file_unique_id из Telegram → хеш, чтобы не
+скачивать повторно.
+"""
+
+import errno
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+from config import FILES_DIR
+
+logger = logging.getLogger(__name__)
+
+HASH_BLOCK = 1024 * 1024
+SHA256_RE = re.compile(r"^[0-9a-fA-F]{64}$")
+FICLONE = 0x40049409  # ioctl reflink-копии (Linux)
+# Так ioctl отвечает ФС без reflink (ext4, tmpfs)
+NO_REFLINK = {errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EXDEV, errno.ENOSYS}
+
+
+def file_sha256(path: str) -> str:
+    """SHA-256 файла (блокирующее чтение — из async кода звать через to_thread)"""
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(HASH_BLOCK)
+            if not block:
+                return hasher.hexdigest()
+            hasher.update(block)
+
+
+def reflink(src_path: str, dst_path: str):
+    """Copy-on-write копия; OSError с errno из NO_REFLINK — ФС так не умеет"""
+    with open(src_path, "rb") as src, open(dst_path, "xb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(dst_path)
+            raise
+
+
+def blob_stamp(stat: os.stat_result) -> list:
+    """Размер и время изменения: пока они те же, хеш блоба пересчитывать незачем"""
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class BlobStore:
+    """Дедуплицированное хранилище: блобы по хешу + имена-ссылки"""
+
+    def __init__(self, directory: str = FILES_DIR):
+        self.directory = directory
+        self.blobs_dir = os.path.join(directory, ".blobs")
+        self.tmp_dir = os.path.join(self.blobs_dir, "tmp")
+        self.manifest_path = os.path.join(self.blobs_dir, "manifest.json")
+        self.names: Dict[str, dict] = {}  # Имя файла в FILES_DIR -> {sha256, size, mtime} копии
+        self.telegram: Dict[str, str] = {}  # file_unique_id -> sha256
+        self.blobs: Dict[str, list] = {}  # sha256 -> blob_stamp() блоба, когда его хеш был проверен
+        self.reflink: Optional[bool] = None  # Умеет ли ФС reflink (выясняется при первой копии)
+        self._stamp = None  # (mtime_ns, inode) прочитанного манифеста
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        """Перечитываем манифест, если его изменил другой процесс"""
+        try:
+            stat = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            return
+        # Запись идёт через rename — новый файл виден по inode, даже если mtime совпал
+        stamp = (stat.st_mtime_ns, stat.st_ino)
+        if stamp == self._stamp:
+            return
+
+        try:
+            with open(self.manifest_path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Error loading blob manifest: {e}")
+            return
+
+        self.names = data.get("names", {})
+        self.telegram = data.get("telegram", {})
+        self.blobs = data.get("blobs", {})
+        self._stamp = stamp
+
+    @contextmanager
+    def _locked(self):
+        """
+        Чтение-изменение-запись манифеста под блокировкой файла
+        Манифест меняют бот и все процессы API — без неё одна запись затёрла бы другую
+        """
+        with open(f"{self.manifest_path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self._load()
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _save(self):
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"  # Запись только под _locked
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"names": self.names, "telegram": self.telegram, "blobs": self.blobs}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.manifest_path)
+        stat = os.stat(self.manifest_path)
+        self._stamp = (stat.st_mtime_ns, stat.st_ino)
+
+    def blob_path(self, sha256: str) -> str:
+        return os.path.join(self.blobs_dir, sha256[:2], sha256)
+
+    def has(self, sha256: Optional[str]) -> bool:
+        return bool(SHA256_RE.match(sha256 or "")) and os.path.exists(self.blob_path(sha256.lower()))
+
+    def temp_path(self, name: str) -> str:
+        """Временный файл на той же ФС, что и блобы (для атомарного rename)"""
+        return os.path.join(self.tmp_dir, name)
+
+    def verified(self, sha256: Optional[str]) -> bool:
+        """
+        Блоб есть и его содержимое действительно даёт sha256 (блокирующее — через to_thread)
+        Хеш пересчитывается, только если размер или время изменения блоба не те,
+        что были при прошлой проверке. Не совпавший блоб отвязывается от хранилища.
+        """
+        if not self.has(sha256):
+            return False
+        sha256 = sha256.lower()
+        blob = self.blob_path(sha256)
+        self._load()
+        try:
+            current = blob_stamp(os.stat(blob))
+        except OSError:
+            return False
+        if self.blobs.get(sha256) == current:
+            return True
+
+        if file_sha256(blob) == sha256:
+            with self._locked():
+                self.blobs[sha256] = current
+                self._save()
+            return True
+        logger.error(f"Blob {blob} does not match its hash (edited in place?), detaching it")
+        with self._locked():
+            # Имена-ссылки сохраняют правленое содержимое, хранилище о нём забывает
+            try:
+                os.remove(blob)
+            except OSError:
+                pass
+            self.blobs.pop(sha256, None)
+            self._save()
+        return False
+
+    def put_file(self, src_path: str, filename: str, sha256: Optional[str] = None) -> Tuple[str, str, bool]:
+        """
+        Кладёт файл src_path в хранилище (src_path перемещается) и даёт ему имя
+
+        Возвращает (путь в FILES_DIR, sha256, было ли такое содержимое раньше).
+        """
+        sha256 = (sha256 or file_sha256(src_path)).lower()
+        blob = self.blob_path(sha256)
+        # Испорченный блоб verified() убирает — его место займёт новое содержимое
+        existed = self.verified(sha256)
+
+        if existed:
+            os.remove(src_path)
+        else:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.replace(src_path, blob)
+            os.chmod(blob, 0o644)
+            with self._locked():
+                # Хеш только что посчитан нами по этому содержимому
+                self.blobs[sha256] = blob_stamp(os.stat(blob))
+                self._save()
+
+        return self.link(sha256, filename), sha256, existed
+
+    def link(self, sha256: str, filename: str) -> str:
+        """
+        Блоб под именем filename в FILES_DIR (блокирующее — из async кода через to_thread)
+        Одноимённый файл с другим содержимым не затирается: имя с ним занято,
+        новое получает номер — существующий файл на месте не переписывается никогда.
+        """
+        sha256 = sha256.lower()
+        blob = self.blob_path(sha256)
+        stem, ext = os.path.splitext(os.path.basename(filename))
+
+        with self._locked():
+            counter = 0
+            while True:
+                name = f"{stem}{ext}" if counter == 0 else f"{stem} ({counter}){ext}"
+                path = os.path.join(self.directory, name)
+
+                if not os.path.lexists(path):
+                    break
+                if self._unchanged(name, path, sha256):
+                    # То же имя и то же содержимое, копию с тех пор не меняли — уже на месте
+                    return path
+                counter += 1
+
+            self._place(blob, path)
+            stat = os.stat(path)
+            self.names[name] = {"sha256": sha256, "size": stat.st_size, "mtime": stat.st_mtime_ns}
+            self._save()
+        return path
+
+    def _place(self, blob: str, path: str):
+        """reflink, если ФС умеет, иначе жёсткая ссылка — без второй копии на диске"""
+        if self.reflink is not False:
+            try:
+                reflink(blob, path)
+                self.reflink = True
+                return
+            except OSError as e:
+                if e.errno not in NO_REFLINK:
+                    raise
+                self.reflink = False
+        try:
+            os.link(blob, path)
+        except OSError as e:
+            if e.errno != errno.EMLINK:
+                raise
+            # У блоба предельное число ссылок (65000 на ext4) — этому имени своя копия
+            shutil.copyfile(blob, path)
+
+    def _unchanged(self, name: str, path: str, sha256: str) -> bool:
+        """Файл name — нетронутая копия блоба sha256 (размер и время изменения как при создании)"""
+        entry = self.names.get(name)
+        if not isinstance(entry, dict) or entry.get("sha256") != sha256:
+            return False
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        return stat.st_size == entry.get("size") and stat.st_mtime_ns == entry.get("mtime")
+
+    def lookup_telegram(self, file_unique_id: str) -> Optional[str]:
+        """Хеш уже сохранённого файла Telegram, если блоб цел (блокирующее — через to_thread)"""
+        self._load()
+        sha256 = self.telegram.get(file_unique_id)
+        return sha256 if sha256 and self.verified(sha256) else None
+
+    def remember_telegram(self, file_unique_id: str, sha256: str):
+        with self._locked():
+            self.telegram[file_unique_id] = sha256.lower()
+            self._save()
+
+
+blob_store = BlobStore()
@@ -4,17 +4,39 @@ Claude Admin Bot - Прямое общение с Claude Code через Telegra
 """
 
 import asyncio
+import hashlib
 import logging
 import os
-import subprocess
-import signal
+import re
+from collections import OrderedDict
+from contextlib import aclosing
+from typing import AsyncIterator, List, Optional, Set
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import CommandStart
+from aiogram.filters import Command, CommandObject, CommandStart
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
-from aiogram.types import FSInputFile
+from aiogram.types import FSInputFile, InlineKeyboardButton, InlineKeyboardMarkup, InputFile
 from dotenv import load_dotenv
 
+from config import (
+    WORK_DIR, FILES_DIR, VOLUMES_DIR, CLAUDE_STREAM, TELEGRAM_MESSAGE_LIMIT, TELEGRAM_UPLOAD_LIMIT,
+    TELEGRAM_WEBHOOK_URL, TELEGRAM_WEBHOOK_PATH, TELEGRAM_WEBHOOK_SECRET,
+    FILE_ARCHIVE_FORMAT, FILE_VOLUME_SIZE, FILE_MAX_VOLUMES,
+)
+from claude_pool import pool
+from live_message import LiveMessage
+from job_queue import JobCancelled, QueueFull, scheduler
+from claude_runner import parse_limits
+from sessions import SESSION_NAME_RE, registry
+from blob_store import blob_store
+from response_parser import Segment, parse_response, render_markdown
+from send_scheduler import SendScheduler
+from history import history
+from prompt_cache import cached_note, prompt_cache
+from file_index import Entry, file_index
+from archives import ARCHIVE_FORMATS, CHUNK, archive_name, spool_volumes, stream_archive, stream_file
+from metrics import monitor_event_loop, summary as metrics_summary
+
 load_dotenv()
 
 logging.basicConfig(
@@ -26,8 +48,6 @@ logger = logging.getLogger(__name__)
 
 ADMIN_ID = int(os.getenv("ADMIN_TELEGRAM_ID", "372886754"))
 TELEGRAM_TOKEN = os.getenv("CLAUDE_BOT_TOKEN")
-WORK_DIR = "/root"
-FILES_DIR = "/root/claude-admin-bot/files"
 
 if not TELEGRAM_TOKEN:
     raise ValueError("CLAUDE_BOT_TOKEN не задан в .env")
@@ -35,11 +55,10 @@ if not TELEGRAM_TOKEN:
 os.makedirs(FILES_DIR, exist_ok=True)
 
 bot = Bot(token=TELEGRAM_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN))
+# Все отправки и правки — в темпе, который допускает Telegram, с повтором после 429
+bot.session.middleware(SendScheduler())
 dp = Dispatcher()
 
-# Блокировка для предотвращения множественных запросов от бота
-bot_busy = False
-
 
 def is_admin(user_id: int) -> bool:
     return user_id == ADMIN_ID
@@ -59,12 +78,307 @@ async def cmd_start(message: types.Message):
 
 *Файлы:*
 📤 Отправь файл → сохраню в `{0}`
-📥 Отправь путь к файлу → отправлю его тебе
+📥 Отправь путь к файлу → отправлю его тебе (каталог — архивом)
+/find `запрос` — найти файл по имени
+/get `путь или имя` `[zip|tar]` — скачать (большое — томами)
+
+*Беседы:*
+/sessions — список бесед
+/session `имя` — переключиться (или создать)
+/new `имя` — новая пустая беседа
+/fork `имя` — копия текущей беседы
+
+/cancel — остановить запросы текущей беседы
+/stats — время в очереди, запуска и ответа
+/cache — кэш ответов (`/cache clear` — очистить)
+
+*Лимиты запроса* — в начале сообщения:
+`--timeout=10m --max-output=50k текст`
+`--no-cache текст` — не брать ответ из кэша
 
 Просто общайся естественно! 💬
 """.format(FILES_DIR))
 
 
+def client_key(message: types.Message) -> str:
+    """Клиент в реестре бесед — чат Telegram"""
+    return f"tg:{message.chat.id}"
+
+
+def session_name(command: CommandObject) -> Optional[str]:
+    """Имя беседы из аргумента команды (None, если не задано или некорректно)"""
+    name = (command.args or "").strip()
+    return name if SESSION_NAME_RE.match(name) else None
+
+
+@dp.message(Command("sessions"))
+async def cmd_sessions(message: types.Message):
+    """Список бесед"""
+    if not is_admin(message.from_user.id):
+        return
+
+    active = registry.active(client_key(message))
+    lines = []
+    for session in registry.list():
+        mark = "▶️" if session.name == active.name else "•"
+        state = "" if session.started or session.cached else " (пустая)"
+        lines.append(f"{mark} `{session.name}`{state}")
+
+    await message.answer("💬 *Беседы:*\n\n" + "\n".join(lines))
+
+
+@dp.message(Command("session", "new", "fork"))
+async def cmd_session(message: types.Message, command: CommandObject):
+    """Переключение, создание и форк беседы"""
+    if not is_admin(message.from_user.id):
+        return
+
+    client = client_key(message)
+    if not command.args:
+        await message.answer(f"▶️ Текущая беседа: `{registry.active(client).name}`")
+        return
+
+    name = session_name(command)
+    if name is None:
+        await message.answer("❌ Имя беседы: буквы, цифры, `_`, `-`, `.`, до 40 символов")
+        return
+
+    try:
+        if command.command == "new":
+            session = registry.create(client, name)
+            await message.answer(f"🆕 Новая беседа `{session.name}`")
+        elif command.command == "fork":
+            source = registry.active(client)
+            session = registry.fork(client, name)
+            await message.answer(f"🍴 `{session.name}` — копия `{source.name}`")
+        else:
+            session = registry.switch(client, name)
+            await message.answer(f"▶️ Беседа `{session.name}`")
+    except ValueError as e:
+        await message.answer(f"❌ {e}")
+
+
+@dp.message(Command("stats"))
+async def cmd_stats(message: types.Message):
+    """Метрики запросов к Claude (с запуска бота)"""
+    if not is_admin(message.from_user.id):
+        return
+
+    await message.answer(f"📊 *Статистика:*\n\n```\n{metrics_summary()}\n```")
+
+
+@dp.message(Command("cancel"))
+async def cmd_cancel(message: types.Message):
+    """Остановка выполняющегося и ожидающих запросов текущей беседы"""
+    if not is_admin(message.from_user.id):
+        return
+
+    session = registry.active(client_key(message))
+    cancelled = await scheduler.cancel_jobs(session.name)
+    if cancelled:
+        await message.answer(f"⛔ Отменено запросов: {cancelled}")
+    else:
+        await message.answer(f"Нечего отменять в беседе `{session.name}`")
+
+
+# Файлы: поиск по индексу и отправка
+
+FIND_LIMIT = 10  # Результатов /find
+FOUND_KEEP = 1000  # Сколько путей помнить для кнопок «скачать»
+PATH_LIKE_RE = re.compile(r"^/\S*[./]\S*$")  # «/nginx.conf», «/sites-enabled/default», но не «/help»
+
+# Путь в callback_data не влезает (64 байта) — кнопка несёт короткий токен
+_found: "OrderedDict[str, str]" = OrderedDict()
+
+
+def human_size(size: int) -> str:
+    if size >= 1024 ** 2:
+        return f"{size / 1024 ** 2:.1f} МБ"
+    if size >= 1024:
+        return f"{size / 1024:.1f} КБ"
+    return f"{size} Б"
+
+
+def remember_path(path: str) -> str:
+    token = hashlib.sha1(path.encode()).hexdigest()[:16]
+    _found[token] = path
+    _found.move_to_end(token)
+    while len(_found) > FOUND_KEEP:
+        _found.popitem(last=False)
+    return token
+
+
+async def answer_found(message: types.Message, entries: List[Entry], title: str):
+    """Список найденного с кнопкой «скачать» у каждого"""
+    lines = []
+    buttons = []
+    for number, entry in enumerate(entries, 1):
+        icon = "📁" if entry.is_dir else "📄"
+        size = "" if entry.is_dir else f" ({human_size(entry.size)})"
+        lines.append(f"{number}. {icon} `{entry.path}`{size}")
+        label = f"{number}. {os.path.basename(entry.path)}"[:60]
+        buttons.append([InlineKeyboardButton(text=label, callback_data=f"get:{remember_path(entry.path)}")])
+    await message.answer(f"{title}\n\n" + "\n".join(lines), reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons))
+
+
+class FileRange(InputFile):
+    """Кусок файла [start, end) — том большого файла без копии на диске"""
+
+    def __init__(self, path: str, start: int, end: int, filename: str):
+        super().__init__(filename=filename, chunk_size=CHUNK)
+        self.path = path
+        self.start = start
+        self.end = end
+
+    async def read(self, bot: Bot) -> AsyncIterator[bytes]:
+        async for chunk in stream_file(self.path, self.start, self.end):
+            yield chunk
+
+
+async def file_volumes(path: str, size: int, name: str) -> AsyncIterator[InputFile]:
+    for number, start in enumerate(range(0, size, FILE_VOLUME_SIZE), 1):
+        yield FileRange(path, start, min(start + FILE_VOLUME_SIZE, size), f"{name}.{number:03d}")
+
+
+async def archive_volumes(path: str, fmt: str, name: str) -> AsyncIterator[InputFile]:
+    """Архив каталога, собираемый на лету, томами; том удаляется после отправки"""
+    async with aclosing(spool_volumes(stream_archive(path, fmt), VOLUMES_DIR, name, FILE_VOLUME_SIZE)) as volumes:
+        async for volume, volume_name in volumes:
+            yield FSInputFile(volume, filename=volume_name)
+
+
+async def send_path(message: types.Message, path: str, fmt: str = FILE_ARCHIVE_FORMAT,
+                    filename: Optional[str] = None, caption: Optional[str] = None):
+    """
+    Файл документом; больше лимита Telegram — томами name.001, name.002…
+    Каталог — архивом fmt, который собирается во время отправки (тоже томами)
+    """
+    limit = FILE_VOLUME_SIZE * FILE_MAX_VOLUMES
+    if os.path.isdir(path):
+        # Оценка по индексу (без сжатия) — чтобы не паковать заведомо неподъёмное
+        if file_index.resolve(path):
+            size, _ = file_index.tree_size(path)
+            if size > limit:
+                await message.answer(f"❌ Слишком большой каталог: {human_size(size)}, "
+                                     f"в Telegram — не больше {human_size(limit)}")
+                return
+        name = filename or archive_name(path, fmt)
+        volumes = archive_volumes(path, fmt, name)
+    else:
+        size = os.path.getsize(path)
+        name = filename or os.path.basename(path)
+        if size <= TELEGRAM_UPLOAD_LIMIT:
+            await message.answer_document(FSInputFile(path, filename=name), caption=caption)
+            return
+        if size > limit:
+            await message.answer(f"❌ Слишком большой: {human_size(size)}, "
+                                 f"в Telegram — не больше {human_size(limit)} ({FILE_MAX_VOLUMES} томов)")
+            return
+        volumes = file_volumes(path, size, name)
+
+    status_msg = await message.answer("📦 Упаковываю и отправляю..." if os.path.isdir(path) else "📤 Отправляю...")
+    sent = 0
+    async with aclosing(volumes):
+        async for document in volumes:
+            if sent == FILE_MAX_VOLUMES:
+                await message.answer(f"❌ Больше {FILE_MAX_VOLUMES} томов — остальное не отправлено")
+                break
+            await message.answer_document(document, caption=caption if sent == 0 else None)
+            sent += 1
+    if sent > 1:
+        await message.answer(f"🧩 Томов: {sent}. Склеить: `cat {name}.* > {name}`")
+    await status_msg.delete()
+
+
+async def find_paths(text: str) -> List[Entry]:
+    """Путь как есть или, если такого нет, файлы индекса, чей путь им кончается"""
+    if os.path.isabs(text) and os.path.exists(text):
+        return [Entry(text, os.path.basename(text).lower(), 0, 0, os.path.isdir(text))]
+    return await file_index.lookup(text)
+
+
+@dp.message(Command("find"))
+async def cmd_find(message: types.Message, command: CommandObject):
+    """Нечёткий поиск файла по имени в WORK_DIR и FILES_DIR"""
+    if not is_admin(message.from_user.id):
+        return
+
+    query = (command.args or "").strip()
+    if not query:
+        await message.answer("🔎 `/find запрос` — например `/find nginx conf`")
+        return
+    entries = await file_index.search(query, FIND_LIMIT)
+    if not entries:
+        await message.answer(f"🔎 Ничего не нашлось по `{query}`")
+        return
+    await answer_found(message, entries, f"🔎 *{query}*:")
+
+
+@dp.message(Command("get"))
+async def cmd_get(message: types.Message, command: CommandObject):
+    """Файл или каталог по пути или имени; формат архива — последним словом"""
+    if not is_admin(message.from_user.id):
+        return
+
+    args = (command.args or "").split()
+    fmt = args.pop() if len(args) > 1 and args[-1] in ARCHIVE_FORMATS else FILE_ARCHIVE_FORMAT
+    target = " ".join(args)
+    if not target:
+        await message.answer("📥 `/get путь или имя [zip|tar]`")
+        return
+
+    entries = await find_paths(target)
+    if not entries:
+        similar = await file_index.search(target, FIND_LIMIT)
+        if similar:
+            await answer_found(message, similar, f"Точно `{target}` нет, похожие:")
+        else:
+            await message.answer(f"❌ Не найдено: `{target}`")
+        return
+    if len(entries) > 1:
+        await answer_found(message, entries[:FIND_LIMIT], f"Несколько совпадений с `{target}`:")
+        return
+    try:
+        await send_path(message, entries[0].path, fmt, caption=f"`{entries[0].path}`")
+    except Exception as e:
+        await message.answer(f"❌ {e}")
+
+
+@dp.callback_query(F.data.startswith("get:"))
+async def get_found(callback: types.CallbackQuery):
+    """Кнопка «скачать» под результатами /find"""
+    if not is_admin(callback.from_user.id):
+        return
+
+    path = _found.get(callback.data[len("get:"):])
+    if path is None or not os.path.exists(path):
+        await callback.answer("Файла уже нет или список устарел — повтори /find", show_alert=True)
+        return
+    await callback.answer()
+    try:
+        await send_path(callback.message, path, caption=f"`{path}`")
+    except Exception as e:
+        await callback.message.answer(f"❌ {e}")
+
+
+@dp.message(Command("cache"))
+async def cmd_cache(message: types.Message, command: CommandObject):
+    """Кэш ответов: сколько в нём и сколько сэкономил; /cache clear — очистить"""
+    if not is_admin(message.from_user.id):
+        return
+
+    if not prompt_cache.enabled:
+        await message.answer("Кэш ответов выключен (`PROMPT_CACHE=1` включает)")
+        return
+    if (command.args or "").strip() == "clear":
+        removed = await asyncio.to_thread(prompt_cache.clear)
+        await message.answer(f"🧹 Кэш очищен, удалено ответов: {removed}")
+        return
+    entries, size = await asyncio.to_thread(prompt_cache.stats)
+    await message.answer(f"♻️ В кэше {entries} ответов ({human_size(size)}), "
+                         f"хранятся {prompt_cache.ttl // 60:.0f} мин\n\n```\n{metrics_summary()}\n```")
+
+
 @dp.message(F.document)
 async def handle_document(message: types.Message):
     """Загрузка файлов на сервер"""
@@ -73,178 +387,215 @@ async def handle_document(message: types.Message):
 
     try:
         document = message.document
-        file_name = document.file_name
+        file_name = os.path.basename(document.file_name or document.file_unique_id)
+
+        # Этот файл уже присылали — не скачиваем повторно
+        sha256 = await asyncio.to_thread(blob_store.lookup_telegram, document.file_unique_id)
+        if sha256:
+            file_path = await asyncio.to_thread(blob_store.link, sha256, file_name)
+            file_size = os.path.getsize(file_path)
+            await message.answer(
+                f"✅ Уже есть на сервере:\n`{file_path}`\n({file_size / 1024:.1f} КБ)"
+            )
+            return
 
         status_msg = await message.answer(f"📥 Загружаю...")
 
         file = await bot.get_file(document.file_id)
-        file_path = os.path.join(FILES_DIR, file_name)
+        tmp_path = blob_store.temp_path(document.file_unique_id)
 
-        await bot.download_file(file.file_path, file_path)
+        await bot.download_file(file.file_path, tmp_path)
+
+        # Хеш и перенос в хранилище — в отдельном потоке, файл может быть большим
+        file_path, sha256, existed = await asyncio.to_thread(blob_store.put_file, tmp_path, file_name)
+        await asyncio.to_thread(blob_store.remember_telegram, document.file_unique_id, sha256)
 
         file_size = os.path.getsize(file_path)
+        note = " (такое содержимое уже было)" if existed else ""
 
         await status_msg.edit_text(
-            f"✅ Сохранено:\n`{file_path}`\n({file_size / 1024:.1f} КБ)"
+            f"✅ Сохранено{note}:\n`{file_path}`\n({file_size / 1024:.1f} КБ)"
         )
 
     except Exception as e:
         await message.answer(f"❌ {e}")
 
 
+def preview_text(segments: List[Segment], full_size: int) -> str:
+    """Начало огромного ответа (в одно сообщение) с пометкой о файле"""
+    note = f"\n\n✂️ Показано начало, весь ответ ({full_size // 1024} К символов) — файлом ниже"
+    return render_markdown(segments, TELEGRAM_MESSAGE_LIMIT - len(note))[0] + note
+
+
+async def send_output(message: types.Message, path: str, output_id: str):
+    """Полный ответ Claude документом (файл уже лежит на диске), огромный — томами"""
+    await send_path(message, path, filename=f"claude-{output_id[:8]}.txt")
+
+
 @dp.message(F.text)
 async def handle_message(message: types.Message):
     """Основной обработчик - всё идёт в Claude"""
-    global bot_busy
 
     if not is_admin(message.from_user.id):
         return
 
     user_text = message.text.strip()
 
-    # Проверка на путь к файлу для скачивания
-    if user_text.startswith("/") and os.path.exists(user_text):
-        try:
-            if os.path.isdir(user_text):
-                await message.answer("❌ Это директория. Укажи файл.")
-                return
-
-            file_size = os.path.getsize(user_text)
-
-            if file_size > 50 * 1024 * 1024:
-                await message.answer(f"❌ Слишком большой: {file_size / 1024 / 1024:.1f} МБ")
-                return
-
-            status_msg = await message.answer("📤 Отправляю...")
-
-            file = FSInputFile(user_text)
-            await message.answer_document(file, caption=f"`{user_text}`")
-            await status_msg.delete()
-
-        except Exception as e:
-            await message.answer(f"❌ {e}")
-
-        return
-
-    # Проверка: уже обрабатывается другой запрос от бота?
-    if bot_busy:
-        await message.answer("⏳ Предыдущий запрос ещё обрабатывается, подожди...")
+    # Проверка на путь к файлу для скачивания (или конец пути — тогда ищем в индексе)
+    if user_text.startswith("/") and (os.path.exists(user_text) or PATH_LIKE_RE.match(user_text)):
+        entries = await find_paths(user_text)
+        if len(entries) > 1:
+            await answer_found(message, entries[:FIND_LIMIT], f"Несколько совпадений с `{user_text}`:")
+            return
+        if entries:
+            try:
+                await send_path(message, entries[0].path, caption=f"`{entries[0].path}`")
+            except Exception as e:
+                await message.answer(f"❌ {e}")
+            return
+
+    # Дедлайн и лимит ответа можно задать в начале сообщения
+    limits, user_text = parse_limits(user_text)
+    if not user_text:
+        await message.answer("❌ После лимитов нужен текст запроса")
         return
 
-    # Блокируем новые запросы
-    bot_busy = True
-    status_msg = None
+    client = client_key(message)
+    session = registry.active(client)
+    live = LiveMessage(message)
+    history.record_prompt(session.name, client, user_text)
+
+    async def show_position(position: int):
+        await live.status(f"🕐 В очереди: {position}")
+
+    async def show_status(elapsed: int):
+        # Без потокового режима: обновляем плейсхолдер, пока ждём ответ
+        dots = "." * (elapsed // 10 % 4)
+        await live.status(f"⏳ Обрабатываю{dots} ({elapsed}с)")
+
+    async def job():
+        # Повторный вопрос — ответ из кэша, без запуска Claude.
+        # Смотрим здесь, в очереди беседы: предыдущий запрос мог её уже начать
+        fresh = (registry.get(session.name) or session).fresh
+        cache_key, result = await prompt_cache.get(user_text, WORK_DIR, fresh, bypass=not limits.cache)
+        if result is not None:
+            # CLI ответа не видел — беседа передаст его Claude со следующим ходом
+            registry.remember_cached(session.name, user_text, result.stdout)
+        else:
+            await live.status("⏳ Обрабатываю...")
 
-    claude_process = None
+            limit_args = {"timeout": limits.timeout, "max_output": limits.max_output}
+            if CLAUDE_STREAM:
+                result = await registry.ask(session.name, user_text, cwd=WORK_DIR, on_delta=live.feed, **limit_args)
+            else:
+                result = await registry.ask(session.name, user_text, cwd=WORK_DIR, on_status=show_status,
+                                            **limit_args)
+            await prompt_cache.put(cache_key, user_text, WORK_DIR, result)
+
+        if result.timed_out:
+            partial = result.stdout.strip()
+            text = f"⏱ Claude не ответил за {limits.timeout_text} (процесс завершён)"
+            text = f"{partial}\n\n{text}" if partial else text
+            history.record_response(session.name, client, result, [Segment("text", text)], status="timeout")
+            await live.finish(text)
+            return
+
+        # Без служебных строк CLI, блоки кода не разрезаются между сообщениями
+        segments = parse_response(result.text)
+        if result.truncated:
+            segments.append(Segment("text", f"✂️ Ответ длиннее {limits.max_output} символов — Claude остановлен"))
+        if result.cached is not None:
+            segments.append(Segment("text", f"♻️ {cached_note(result.cached)}"))
+        history.record_response(session.name, client, result, segments,
+                                status="truncated" if result.truncated else "cached" if result.cached is not None
+                                else "ok")
+
+        if result.spilled:
+            # Огромный ответ: в чат — начало, целиком — файлом
+            await live.finish(preview_text(segments, result.output_size))
+            await send_output(message, result.output_path, result.output_id)
+            return
+
+        await live.finish_parts(render_markdown(segments))
 
     try:
-        # Экранируем специальные символы для bash
-        escaped_text = user_text.replace("'", "'\\''")
-
-        # Формируем команду для Claude через stdin (чтобы не зависал)
-        # --continue сохраняет контекст между сообщениями
-        # --model haiku для быстрых ответов
-        # echo передаёт промпт через pipe в claude -p
-        claude_command = f"echo '{escaped_text}' | claude -p --continue --model haiku --input-format text"
-
-        # Запускаем процесс с возможностью его убить по таймауту
-        claude_process = subprocess.Popen(
-            claude_command,
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            cwd=WORK_DIR,
-            preexec_fn=os.setsid  # Создаём новую группу процессов
-        )
-
-        # Первые 10 секунд ждём без статуса (для быстрых ответов)
+        await live.start("⏳ Обрабатываю...")
+        # Запросы одной беседы идут по очереди, разных — параллельно
+        await scheduler.run(session.name, job, on_position=show_position)
+    except QueueFull:
+        await live.finish("⏳ Очередь заполнена, попробуй чуть позже")
+    except JobCancelled:
+        partial = live.text.strip()
+        text = f"{partial}\n\n⛔ Запрос отменён" if partial else "⛔ Запрос отменён"
+        history.record_response(session.name, client, None, [Segment("text", text)], status="cancelled")
+        await live.finish(text)
+    except Exception as e:
+        logger.error(f"Ошибка: {e}")
+        history.record_response(session.name, client, None, [Segment("text", f"❌ Ошибка: {e}")], status="error")
         try:
-            stdout, stderr = claude_process.communicate(timeout=10)
-            response = stdout.strip() or stderr.strip() or "Нет ответа"
-        except subprocess.TimeoutExpired:
-            # Процесс идёт дольше 10 секунд — показываем статус
-            status_msg = await message.answer("⏳ Обрабатываю...")
-            elapsed = 10
-            poll_interval = 30
-
-            while elapsed < 300:  # Максимум 5 минут
-                try:
-                    stdout, stderr = claude_process.communicate(timeout=poll_interval)
-                    # Процесс завершился
-                    response = stdout.strip() or stderr.strip() or "Нет ответа"
-                    await status_msg.delete()
-                    break
-                except subprocess.TimeoutExpired:
-                    # Процесс ещё работает, обновляем статус
-                    elapsed += poll_interval
-                    dots = "." * (elapsed // 10 % 4)
-                    await status_msg.edit_text(f"⏳ Обрабатываю{dots} ({elapsed}с)")
-                    continue
-            else:
-                # Таймаут 5 минут истёк
-                os.killpg(os.getpgid(claude_process.pid), signal.SIGTERM)
-                claude_process.wait(timeout=5)
-                await status_msg.edit_text("⏱ Claude не ответил за 5 минут (процесс завершён)")
-                return
+            # Ошибка — на место плейсхолдера, а не рядом с висящим «Обрабатываю»
+            await live.finish(f"❌ Ошибка: {e}")
+        except Exception:
+            await message.answer(f"❌ Ошибка: {e}")
 
-        # Очищаем от служебных сообщений
-        lines = response.split('\n')
-        clean_lines = [l for l in lines if not l.startswith('[') and not l.startswith('Using model')]
-        response = '\n'.join(clean_lines).strip() or response
 
-        # Разбиваем длинные ответы
-        if len(response) > 4000:
-            parts = []
-            current_part = ""
+# Режим webhook: api.py принимает апдейты и передаёт их сюда
 
-            for line in response.split('\n'):
-                if len(current_part) + len(line) + 1 > 4000:
-                    parts.append(current_part)
-                    current_part = line + '\n'
-                else:
-                    current_part += line + '\n'
+WEBHOOK_SECRET = TELEGRAM_WEBHOOK_SECRET or hashlib.sha256(TELEGRAM_TOKEN.encode()).hexdigest()
+_webhook_tasks: Set[asyncio.Task] = set()
 
-            if current_part:
-                parts.append(current_part)
 
-            await message.answer(f"💡 *Claude (1/{len(parts)}):*\n\n{parts[0]}")
+async def start_webhook():
+    """Регистрация webhook в Telegram (при старте api.py)"""
+    url = f"{TELEGRAM_WEBHOOK_URL}{TELEGRAM_WEBHOOK_PATH}"
+    try:
+        await bot.set_webhook(url, secret_token=WEBHOOK_SECRET, allowed_updates=dp.resolve_used_update_types())
+    except Exception as e:
+        # Веб-интерфейс работает и без Telegram; webhook мог остаться с прошлого запуска
+        logger.error(f"Не удалось зарегистрировать webhook {url}: {e}")
+        return
+    logger.info(f"🚀 Claude Admin Bot запущен (webhook {url})")
 
-            for i, part in enumerate(parts[1:], 2):
-                await message.answer(f"💡 *Claude ({i}/{len(parts)}):*\n\n{part}")
-        else:
-            await message.answer(response)
 
+async def _process_update(update: types.Update):
+    try:
+        await dp.feed_update(bot, update)
     except Exception as e:
-        logger.error(f"Ошибка: {e}")
-        await message.answer(f"❌ Ошибка: {e}")
+        logger.error(f"Ошибка обработки апдейта {update.update_id}: {e}")
 
-        # Убеждаемся что процесс завершён
-        if claude_process and claude_process.poll() is None:
-            try:
-                os.killpg(os.getpgid(claude_process.pid), signal.SIGTERM)
-                claude_process.wait(timeout=5)
-            except:
-                pass
-    finally:
-        # Освобождаем блокировку
-        bot_busy = False
 
-        # Финальная проверка что процесс точно завершён
-        if claude_process and claude_process.poll() is None:
-            try:
-                os.killpg(os.getpgid(claude_process.pid), signal.SIGKILL)
-            except:
-                pass
+def feed_webhook(data: dict):
+    """Апдейт из webhook обрабатывается в фоне: Telegram ждёт ответа быстро, а Claude думает минутами"""
+    update = types.Update.model_validate(data, context={"bot": bot})
+    task = asyncio.create_task(_process_update(update))
+    _webhook_tasks.add(task)
+    task.add_done_callback(_webhook_tasks.discard)
+
+
+async def stop_webhook():
+    """Webhook не снимаем: апдейты, пришедшие за время перезапуска, Telegram дошлёт"""
+    for task in list(_webhook_tasks):
+        task.cancel()
+    await bot.session.close()
 
 
 async def main():
+    if TELEGRAM_WEBHOOK_URL:
+        logger.error("Задан TELEGRAM_WEBHOOK_URL: бот работает внутри api.py, запускай python api.py")
+        return
+
     logger.info("🚀 Claude Admin Bot запущен")
+    monitor = asyncio.create_task(monitor_event_loop())
+    file_index.start()
 
     try:
         await bot.delete_webhook(drop_pending_updates=True)
         await dp.start_polling(bot)
     finally:
+        monitor.cancel()
+        await pool.close()
+        await file_index.close()
+        await asyncio.to_thread(history.close)
         await bot.session.close()
 
 
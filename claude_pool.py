@@ -0,0 +1,305 @@
+"""
+Постоянные процессы Claude
+Один долгоживущий CLI на беседу (stream-json через stdin) + тёплый пул для новых бесед
+"""
+
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Sequence
+
+from config import (
+    CLAUDE_BIN, CLAUDE_MODEL, CLAUDE_TIMEOUT, CLAUDE_MAX_OUTPUT, CLAUDE_MAX_RESIDENT,
+    CLAUDE_WARM_POOL, CLAUDE_IDLE_TIMEOUT, WORK_DIR,
+)
+from claude_runner import (
+    ClaudeResult, DeltaCallback, OutputLimitExceeded, StatusCallback, StreamJsonParser,
+    STREAM_LINE_LIMIT, check_output, read_event, supervise, terminate,
+)
+from metrics import SPAWN
+
+logger = logging.getLogger(__name__)
+
+EVICT_INTERVAL = 30  # Как часто проверять простаивающие процессы
+
+
+class PersistentClaude:
+    """Один долгоживущий процесс Claude: ходы беседы идут через stdin"""
+
+    def __init__(self, model: str, cwd: str, session_args: Sequence[str] = ()):
+        self.model = model
+        self.cwd = cwd
+        self.session_args = tuple(session_args)
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.last_used = time.monotonic()
+        self.lock = asyncio.Lock()
+        self.pending = 0  # Запросы, которые получили процесс из пула и ещё не закончили ход
+        self._stderr = deque(maxlen=50)  # Последние строки stderr для диагностики
+        self._stderr_task: Optional[asyncio.Task] = None
+
+    def command(self) -> List[str]:
+        return [
+            CLAUDE_BIN, "-p", *self.session_args, "--model", self.model,
+            "--input-format", "stream-json", "--output-format", "stream-json",
+            "--verbose", "--include-partial-messages",
+        ]
+
+    async def start(self):
+        started = time.monotonic()
+        self.process = await asyncio.create_subprocess_exec(
+            *self.command(),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=self.cwd,
+            start_new_session=True,
+            limit=STREAM_LINE_LIMIT,
+        )
+        SPAWN.observe(time.monotonic() - started, mode="persistent")
+        self._stderr_task = asyncio.create_task(self._drain_stderr())
+        logger.info(f"Persistent Claude started, pid={self.process.pid}")
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    @property
+    def busy(self) -> bool:
+        return self.lock.locked() or self.pending > 0
+
+    async def ask(
+        self,
+        prompt: str,
+        timeout: float = CLAUDE_TIMEOUT,
+        max_output: int = CLAUDE_MAX_OUTPUT,
+        on_status: Optional[StatusCallback] = None,
+        on_delta: Optional[DeltaCallback] = None,
+    ) -> ClaudeResult:
+        """Один ход беседы"""
+        async with self.lock:
+            started = time.monotonic()
+            parser = StreamJsonParser()
+            task = asyncio.ensure_future(self._turn(prompt, parser, on_delta, max_output))
+            truncated = False
+
+            try:
+                timed_out = await supervise(task, started, timeout, on_status)
+                if timed_out:
+                    logger.warning(f"Persistent Claude timeout, pid={self.process.pid}")
+                else:
+                    task.result()
+            except OutputLimitExceeded:
+                # Ход не дочитан — процесс беседы дальше не годится
+                logger.warning(f"Persistent Claude output limit {max_output} reached, pid={self.process.pid}")
+                truncated = True
+                await self.close()
+            finally:
+                if not task.done():
+                    # Ход прерван посередине — поток событий не восстановить
+                    task.cancel()
+                    await self.close()
+                parser.output.close()
+
+            self.last_used = time.monotonic()
+            return ClaudeResult.from_spool(
+                parser.output,
+                "" if self.alive else "\n".join(self._stderr),
+                None if self.alive else self.process.returncode,
+                timed_out,
+                started,
+                parser.session_id,
+                truncated,
+                parser.tool_use,
+            )
+
+    async def _turn(self, prompt: str, parser: StreamJsonParser, on_delta: Optional[DeltaCallback],
+                    max_output: int = 0):
+        message = {
+            "type": "user",
+            "message": {"role": "user", "content": [{"type": "text", "text": prompt}]},
+        }
+        self.process.stdin.write((json.dumps(message) + "\n").encode())
+        await self.process.stdin.drain()
+
+        while not parser.finished:
+            line = await read_event(self.process.stdout, parser)
+            if line is None:
+                continue
+            if not line:
+                # Процесс завершился — ждём код возврата, ответ берём какой есть
+                await self.process.wait()
+                return
+            text = parser.feed(line)
+            if text and on_delta:
+                await on_delta(text)
+            check_output(parser.output, max_output)
+
+    async def _drain_stderr(self):
+        while True:
+            line = await self.process.stderr.readline()
+            if not line:
+                return
+            self._stderr.append(line.decode(errors="replace").rstrip())
+
+    async def close(self):
+        if self.process is None:
+            return
+        if self.process.stdin and not self.process.stdin.is_closing():
+            self.process.stdin.close()
+        await terminate(self.process)
+        if self._stderr_task:
+            self._stderr_task.cancel()
+        logger.info(f"Persistent Claude closed, pid={self.process.pid}")
+
+
+class ClaudePool:
+    """Живые процессы бесед (LRU с ограничением) и тёплый пул новых"""
+
+    def __init__(
+        self,
+        max_resident: int = CLAUDE_MAX_RESIDENT,
+        warm_size: int = CLAUDE_WARM_POOL,
+        idle_timeout: float = CLAUDE_IDLE_TIMEOUT,
+    ):
+        self.max_resident = max_resident
+        self.warm_size = warm_size
+        self.idle_timeout = idle_timeout
+        self.sessions: Dict[str, PersistentClaude] = OrderedDict()
+        self.warm: List[PersistentClaude] = []
+        self._evictor: Optional[asyncio.Task] = None
+        self._refill: Optional[asyncio.Task] = None
+        self._spawn_lock = asyncio.Lock()  # Проверка места и запуск процесса — по одному
+        self._released = asyncio.Event()  # Ход закончился или процесс убран — может найтись место
+
+    async def ask(
+        self,
+        session: str,
+        prompt: str,
+        *,
+        cwd: str = WORK_DIR,
+        model: str = CLAUDE_MODEL,
+        timeout: float = CLAUDE_TIMEOUT,
+        max_output: int = CLAUDE_MAX_OUTPUT,
+        on_status: Optional[StatusCallback] = None,
+        on_delta: Optional[DeltaCallback] = None,
+        session_args: Sequence[str] = (),
+    ) -> ClaudeResult:
+        """Запрос в процесс беседы session (процесс запускается при необходимости)"""
+        if self._evictor is None:
+            self._evictor = asyncio.create_task(self._evict_idle())
+
+        claude = await self._acquire(session, cwd, model, session_args)
+        try:
+            result = await claude.ask(prompt, timeout=timeout, max_output=max_output,
+                                      on_status=on_status, on_delta=on_delta)
+        finally:
+            claude.pending -= 1
+            if not claude.alive and self.sessions.get(session) is claude:
+                del self.sessions[session]
+            self._released.set()
+        return result
+
+    def _resident(self, session: str, cwd: str, model: str) -> Optional[PersistentClaude]:
+        """Живой процесс беседы с теми же моделью и директорией; он помечается занятым"""
+        claude = self.sessions.get(session)
+        if claude and claude.alive and claude.model == model and claude.cwd == cwd:
+            self.sessions.move_to_end(session)
+            claude.pending += 1
+            return claude
+        return None
+
+    async def _acquire(self, session: str, cwd: str, model: str, session_args: Sequence[str]) -> PersistentClaude:
+        claude = self._resident(session, cwd, model)
+        if claude:
+            return claude
+
+        async with self._spawn_lock:
+            # Пока ждали, процесс этой беседы мог запустить другой запрос
+            claude = self._resident(session, cwd, model)
+            if claude:
+                return claude
+
+            claude = self.sessions.pop(session, None)
+            if claude:
+                await claude.close()
+
+            await self._make_room()
+
+            # Новая беседа — берём готовый процесс из тёплого пула
+            # (его ID беседы вернётся в ClaudeResult.session_id)
+            new_session = not session_args or session_args[0] == "--session-id"
+            claude = self._take_warm(cwd, model) if new_session else None
+            if claude is None:
+                claude = PersistentClaude(model, cwd, session_args)
+                await claude.start()
+
+            claude.pending += 1
+            self.sessions[session] = claude
+        self._schedule_refill()
+        return claude
+
+    def _take_warm(self, cwd: str, model: str) -> Optional[PersistentClaude]:
+        for claude in self.warm:
+            if claude.alive and claude.cwd == cwd and claude.model == model:
+                self.warm.remove(claude)
+                return claude
+        return None
+
+    def _schedule_refill(self):
+        if self.warm_size and (self._refill is None or self._refill.done()):
+            self._refill = asyncio.create_task(self._fill_warm())
+
+    async def _fill_warm(self):
+        """Дозапуск тёплых процессов для беседы по умолчанию"""
+        self.warm = [claude for claude in self.warm if claude.alive]
+        while len(self.warm) < self.warm_size:
+            claude = PersistentClaude(CLAUDE_MODEL, WORK_DIR)
+            try:
+                await claude.start()
+            except Exception as e:
+                logger.error(f"Warm Claude start failed: {e}")
+                return
+            self.warm.append(claude)
+
+    async def _make_room(self):
+        """
+        Место для ещё одного процесса (вызывается под _spawn_lock)
+        Вытесняем самые давно использованные свободные; если заняты все — ждём,
+        пока какой-то ход закончится, а не превышаем max_resident.
+        """
+        while True:
+            self._released.clear()
+            for session, claude in list(self.sessions.items()):
+                if len(self.sessions) < self.max_resident:
+                    return
+                if not claude.busy and self.sessions.get(session) is claude:
+                    del self.sessions[session]
+                    await claude.close()
+            if len(self.sessions) < self.max_resident:
+                return
+            await self._released.wait()
+
+    async def _evict_idle(self):
+        while True:
+            await asyncio.sleep(EVICT_INTERVAL)
+            now = time.monotonic()
+            for session, claude in list(self.sessions.items()):
+                if not claude.alive or (not claude.busy and now - claude.last_used > self.idle_timeout):
+                    logger.info(f"Evicting idle Claude session {session}")
+                    self.sessions.pop(session, None)
+                    await claude.close()
+                    self._released.set()
+
+    async def close(self):
+        """Закрытие всех процессов (при остановке приложения)"""
+        if self._evictor:
+            self._evictor.cancel()
+        for claude in list(self.sessions.values()) + self.warm:
+            await claude.close()
+        self.sessions.clear()
+        self.warm.clear()
+
+
+pool = ClaudePool()
@@ -0,0 +1,459 @@
+"""
+Асинхронный запуск Claude CLI
+Общий исполнитель для bot.py и api.py — не блокирует event loop
+"""
+
+import asyncio
+import codecs
+import json
+import logging
+import os
+import re
+import signal
+import time
+from dataclasses import dataclass, replace
+from typing import Awaitable, Callable, List, Optional, Sequence, Tuple
+
+from config import (
+    CLAUDE_BIN, CLAUDE_MODEL, CLAUDE_TIMEOUT, CLAUDE_STATUS_DELAY,
+    CLAUDE_STATUS_INTERVAL, CLAUDE_KILL_GRACE, CLAUDE_PERSISTENT, WORK_DIR,
+    CLAUDE_TIMEOUT_LIMIT, CLAUDE_MAX_OUTPUT,
+)
+from output_spool import OutputSpool
+from metrics import KILLS, SPAWN, observe_run
+
+logger = logging.getLogger(__name__)
+
+# Колбэк статуса: получает число прошедших секунд
+StatusCallback = Callable[[int], Awaitable[None]]
+# Колбэк потокового вывода: получает очередной кусок текста
+DeltaCallback = Callable[[str], Awaitable[None]]
+
+# Какую беседу продолжать: по умолчанию последнюю в рабочей директории
+DEFAULT_SESSION_ARGS = ("--continue",)
+
+READ_CHUNK = 64 * 1024
+STREAM_LINE_LIMIT = 16 * 1024 * 1024  # Одно событие stream-json может быть большим
+EVENT_HEAD = 4096  # Сколько байт от начала события смотреть, не разбирая его целиком
+STDERR_LIMIT = 64 * 1024  # stderr нужен для диагностики, больше не храним
+
+# Начало события result и его поля — без json.loads всей строки с ответом
+RESULT_HEAD_RE = re.compile(rb'^\s*\{\s*"type"\s*:\s*"result"')
+IS_ERROR_RE = re.compile(rb'"is_error"\s*:\s*true')
+
+
+@dataclass
+class ClaudeResult:
+    """Результат выполнения Claude"""
+    stdout: str
+    stderr: str
+    returncode: Optional[int]
+    timed_out: bool
+    duration: float
+    session_id: Optional[str] = None  # ID беседы из stream-json (если известен)
+    # Ответ длиннее OUTPUT_SPILL_THRESHOLD: в stdout только превью, полностью — в файле
+    output_id: Optional[str] = None
+    output_path: Optional[str] = None
+    output_size: int = 0  # Полная длина ответа в символах
+    first_output: Optional[float] = None  # Секунд от начала запроса до первого текста
+    truncated: bool = False  # Ответ упёрся в max_output, процесс остановлен
+    cached: Optional[float] = None  # Ответ из кэша: сколько секунд назад он получен
+    tool_use: Optional[bool] = None  # Claude вызывал инструменты (None — неизвестно: вывод текстом)
+
+    @property
+    def text(self) -> str:
+        """Ответ в том виде, в каком его показывают пользователю"""
+        return self.stdout.strip() or self.stderr.strip() or "Нет ответа"
+
+    @property
+    def spilled(self) -> bool:
+        return self.output_path is not None
+
+    @classmethod
+    def from_spool(cls, spool: OutputSpool, stderr: str, returncode: Optional[int],
+                   timed_out: bool, started: float, session_id: Optional[str] = None,
+                   truncated: bool = False, tool_use: Optional[bool] = None) -> "ClaudeResult":
+        """Результат из накопителя вывода; started — time.monotonic() начала запроса"""
+        spool.close()
+        return cls(
+            spool.text(), stderr, returncode, timed_out, time.monotonic() - started, session_id,
+            spool.id, spool.path, spool.size,
+            spool.first_write - started if spool.first_write is not None else None,
+            truncated, tool_use=tool_use,
+        )
+
+
+class OutputLimitExceeded(Exception):
+    """Ответ длиннее max_output — дальше не читаем, процесс останавливается"""
+
+
+@dataclass
+class JobLimits:
+    """Ограничения одного запроса: дедлайн, длина ответа (0 — без лимита), можно ли ответить из кэша"""
+    timeout: float = CLAUDE_TIMEOUT
+    max_output: int = CLAUDE_MAX_OUTPUT
+    cache: bool = True
+
+    def update(self, timeout: Optional[float] = None, max_output: Optional[int] = None) -> "JobLimits":
+        """Копия с новыми значениями, приведёнными к допустимым"""
+        limits = replace(
+            self,
+            timeout=self.timeout if timeout is None else timeout,
+            max_output=self.max_output if max_output is None else max_output,
+        )
+        limits.timeout = float(min(max(float(limits.timeout), 1.0), CLAUDE_TIMEOUT_LIMIT))
+        limits.max_output = max(int(limits.max_output), 0)
+        return limits
+
+    @property
+    def timeout_text(self) -> str:
+        """«5 мин» или «90 с» — для сообщений о таймауте"""
+        if self.timeout >= 60 and self.timeout % 60 == 0:
+            return f"{self.timeout / 60:.0f} мин"
+        return f"{self.timeout:.0f} с"
+
+
+LIMIT_RE = re.compile(r"--(timeout|max-output)=(\d+(?:\.\d+)?)([a-zA-Z]?)(?:\s+|$)")
+NO_CACHE_RE = re.compile(r"--no-cache(?:\s+|$)")
+LIMIT_UNITS = {
+    "timeout": {"": 1, "s": 1, "m": 60, "h": 3600},
+    "max-output": {"": 1, "k": 1000, "K": 1000, "m": 1000 ** 2, "M": 1000 ** 2},
+}
+
+
+def parse_limits(text: str, limits: Optional[JobLimits] = None) -> Tuple[JobLimits, str]:
+    """
+    Ограничения из начала сообщения и текст без них
+
+    «--timeout=90 --max-output=50k вопрос»: timeout — секунды (90, 90s, 5m, 1h),
+    max-output — символы ответа (50000, 50k, 1M). Неизвестная единица — не опция.
+    «--no-cache» — спросить Claude, даже если ответ есть в кэше.
+    """
+    limits = limits or JobLimits()
+    values = {}
+    cache = limits.cache
+    while True:
+        flag = NO_CACHE_RE.match(text)
+        if flag:
+            cache = False
+            text = text[flag.end():]
+            continue
+        match = LIMIT_RE.match(text)
+        if match is None or match.group(3) not in LIMIT_UNITS[match.group(1)]:
+            break
+        name, number, unit = match.groups()
+        values[name] = float(number) * LIMIT_UNITS[name][unit]
+        text = text[match.end():]
+    return replace(limits.update(values.get("timeout"), values.get("max-output")), cache=cache), text
+
+
+def build_command(model: str = CLAUDE_MODEL, stream: bool = False,
+                  session_args: Sequence[str] = DEFAULT_SESSION_ARGS) -> List[str]:
+    """Аргументы запуска Claude CLI (промпт передаётся через stdin)"""
+    # --continue сохраняет контекст между сообщениями
+    # --model haiku для быстрых ответов
+    command = [CLAUDE_BIN, "-p", *session_args, "--model", model, "--input-format", "text"]
+    if stream:
+        # stream-json требует --verbose, partial messages дают текст по кусочкам
+        command += ["--output-format", "stream-json", "--verbose", "--include-partial-messages"]
+    return command
+
+
+class StreamJsonParser:
+    """Разбор построчного вывода --output-format stream-json"""
+
+    def __init__(self):
+        self.session_id: Optional[str] = None
+        self.is_error = False
+        self.finished = False  # Пришло событие result — ход завершён
+        self.output = OutputSpool()  # Склеенные дельты (без них — итоговый ответ из result)
+        self.tool_use = False  # Claude вызывал инструменты (Bash, Edit, ...) — ответ не только на чтение
+        self._partial = False  # CLI присылает stream_event с дельтами
+
+    def feed(self, line: bytes) -> str:
+        """Обработка одной строки, возвращает новый текст (или пустую строку)"""
+        if self._partial and RESULT_HEAD_RE.match(line):
+            # Ответ уже в накопителе из дельт, а result повторяет его целиком одной строкой:
+            # не разбираем её и не переписываем (возможно, уже сброшенный на диск) ответ
+            self._finish(line[:EVENT_HEAD])
+            return ""
+
+        try:
+            event = json.loads(line)
+        except ValueError:
+            return ""
+        if not isinstance(event, dict):
+            return ""
+
+        if event.get("session_id"):
+            self.session_id = event["session_id"]
+
+        kind = event.get("type")
+        text = ""
+
+        if kind == "stream_event":
+            inner = event.get("event") or {}
+            delta = inner.get("delta") or {}
+            if inner.get("type") == "content_block_delta" and delta.get("type") == "text_delta":
+                self._partial = True
+                text = delta.get("text", "")
+            elif inner.get("type") == "content_block_start":
+                self._check_tool((inner.get("content_block") or {}).get("type"))
+        elif kind == "assistant":
+            content = (event.get("message") or {}).get("content") or []
+            for block in content:
+                self._check_tool(block.get("type"))
+            if not self._partial:
+                # Старые версии CLI без --include-partial-messages: целое сообщение
+                text = "".join(block.get("text", "") for block in content if block.get("type") == "text")
+        elif kind == "result":
+            self.finished = True
+            self.is_error = bool(event.get("is_error"))
+            if event.get("result") is not None and not self._partial:
+                # Дельт не было: итог из result точнее склеенных сообщений
+                self.output.reset()
+                self.output.write(event["result"])
+
+        self.output.write(text)
+        return text
+
+    def feed_oversized(self, head: bytes):
+        """Событие длиннее STREAM_LINE_LIMIT: есть только его начало, остаток пропущен"""
+        logger.warning(f"stream-json event over {STREAM_LINE_LIMIT} bytes skipped: {head[:80]!r}")
+        if not RESULT_HEAD_RE.match(head):
+            return
+        self._finish(head)
+        if not self._partial and not self.output.size:
+            self.output.write(f"⚠️ Ответ Claude длиннее {STREAM_LINE_LIMIT // 2 ** 20} МБ одним событием — не прочитан")
+
+    def _check_tool(self, block_type: Optional[str]):
+        if block_type in ("tool_use", "server_tool_use"):
+            self.tool_use = True
+
+    def _finish(self, head: bytes):
+        """Событие result по его началу: ход завершён, была ли ошибка"""
+        self.finished = True
+        self.is_error = bool(IS_ERROR_RE.search(head))
+
+
+async def read_event(stream: asyncio.StreamReader, parser: StreamJsonParser) -> Optional[bytes]:
+    """
+    Следующая строка stream-json; b"" — поток закрыт, None — строка длиннее
+    STREAM_LINE_LIMIT (её начало отдано parser.feed_oversized, остаток пропущен)
+    """
+    try:
+        return await stream.readuntil(b"\n")
+    except asyncio.IncompleteReadError as e:
+        return e.partial  # Последняя строка без перевода строки
+    except asyncio.LimitOverrunError:
+        pass
+
+    parser.feed_oversized(await stream.read(EVENT_HEAD))
+    while True:
+        try:
+            await stream.readuntil(b"\n")
+            return None
+        except asyncio.IncompleteReadError:
+            return None
+        except asyncio.LimitOverrunError as e:
+            await stream.readexactly(e.consumed)
+
+
+def _signal_group(process: asyncio.subprocess.Process, sig: int):
+    """Отправка сигнала всей группе процессов Claude"""
+    try:
+        os.killpg(os.getpgid(process.pid), sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+async def terminate(process: asyncio.subprocess.Process, grace: float = CLAUDE_KILL_GRACE):
+    """Мягкое завершение: SIGTERM группе, затем SIGKILL после паузы"""
+    if process.returncode is not None:
+        return
+
+    _signal_group(process, signal.SIGTERM)
+    KILLS.inc(signal="SIGTERM")
+    try:
+        await asyncio.wait_for(process.wait(), timeout=grace)
+    except asyncio.TimeoutError:
+        _signal_group(process, signal.SIGKILL)
+        KILLS.inc(signal="SIGKILL")
+        await process.wait()
+
+
+async def supervise(task: asyncio.Future, started: float, timeout: float,
+                    on_status: Optional[StatusCallback]) -> bool:
+    """Ожидание task со статусами, True — если истёк таймаут"""
+    wait_for = min(CLAUDE_STATUS_DELAY, timeout)
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=wait_for)
+        if done:
+            return False
+
+        elapsed = time.monotonic() - started
+        if elapsed >= timeout:
+            return True
+
+        if on_status:
+            await on_status(int(elapsed))
+        wait_for = min(CLAUDE_STATUS_INTERVAL, timeout - elapsed)
+
+
+async def _read_stream(stream: asyncio.StreamReader, chunks: List[bytes], limit: Optional[int] = None):
+    """Чтение потока без блокировки, пока процесс не закроет его (сверх limit байт — отбрасываем)"""
+    size = 0
+    while True:
+        chunk = await stream.read(READ_CHUNK)
+        if not chunk:
+            return
+        if limit is None or size < limit:
+            chunks.append(chunk)
+            size += len(chunk)
+
+
+def check_output(spool: OutputSpool, max_output: int):
+    """OutputLimitExceeded, если ответ уже достиг max_output символов (0 — без лимита)"""
+    if max_output and spool.size >= max_output:
+        raise OutputLimitExceeded(f"Ответ длиннее {max_output} символов")
+
+
+async def _read_text(stream: asyncio.StreamReader, spool: OutputSpool, max_output: int = 0):
+    """Чтение текстового вывода в накопитель (UTF-8 на границах кусков не рвётся)"""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    while True:
+        chunk = await stream.read(READ_CHUNK)
+        spool.write(decoder.decode(chunk, final=not chunk))
+        if not chunk:
+            return
+        check_output(spool, max_output)
+
+
+async def _read_events(stream: asyncio.StreamReader, parser: StreamJsonParser, on_delta: DeltaCallback,
+                       max_output: int = 0):
+    """Построчное чтение stream-json с передачей текста в on_delta"""
+    while True:
+        line = await read_event(stream, parser)
+        if line is None:
+            continue
+        if not line:
+            return
+        text = parser.feed(line)
+        if text:
+            await on_delta(text)
+        check_output(parser.output, max_output)
+
+
+async def run_claude(
+    prompt: str,
+    *,
+    cwd: str = WORK_DIR,
+    model: str = CLAUDE_MODEL,
+    timeout: float = CLAUDE_TIMEOUT,
+    max_output: int = CLAUDE_MAX_OUTPUT,
+    on_status: Optional[StatusCallback] = None,
+    on_delta: Optional[DeltaCallback] = None,
+    session: Optional[str] = None,
+    session_args: Sequence[str] = DEFAULT_SESSION_ARGS,
+) -> ClaudeResult:
+    """
+    Запуск Claude с промптом через stdin
+
+    on_status вызывается, если ответ не пришёл за первые CLAUDE_STATUS_DELAY
+    секунд, и дальше раз в CLAUDE_STATUS_INTERVAL секунд.
+
+    on_delta включает потоковый режим (stream-json): получает куски текста
+    по мере генерации. stdout результата — собранный итоговый ответ.
+
+    max_output — сколько символов ответа принять: дальше процесс
+    останавливается, а результат помечается truncated.
+
+    Отмена корутины (/cancel) и таймаут завершают всю группу процессов:
+    SIGTERM, через CLAUDE_KILL_GRACE — SIGKILL, event loop при этом не ждёт.
+
+    session — ключ беседы. При CLAUDE_PERSISTENT запрос уходит в
+    долгоживущий процесс этой беседы вместо запуска нового.
+    """
+    if CLAUDE_PERSISTENT and session is not None:
+        # Ленивый импорт: claude_pool сам использует этот модуль
+        from claude_pool import pool
+        result = await pool.ask(
+            session, prompt, cwd=cwd, model=model, timeout=timeout, max_output=max_output,
+            on_status=on_status, on_delta=on_delta, session_args=session_args,
+        )
+        observe_run(result)
+        return result
+
+    started = time.monotonic()
+    parser = StreamJsonParser() if on_delta else None
+
+    # Новая сессия = отдельная группа процессов, чтобы убить всё дерево
+    process = await asyncio.create_subprocess_exec(
+        *build_command(model, stream=parser is not None, session_args=session_args),
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=cwd,
+        start_new_session=True,
+        limit=STREAM_LINE_LIMIT,
+    )
+    SPAWN.observe(time.monotonic() - started, mode="oneshot")
+
+    # Ответ копится в памяти, а если он огромный — в файле
+    output = parser.output if parser else OutputSpool()
+    stderr_chunks: List[bytes] = []
+
+    async def communicate():
+        if parser:
+            stdout_reader = _read_events(process.stdout, parser, on_delta, max_output)
+        else:
+            stdout_reader = _read_text(process.stdout, output, max_output)
+        readers = asyncio.gather(stdout_reader, _read_stream(process.stderr, stderr_chunks, STDERR_LIMIT))
+
+        try:
+            process.stdin.write(prompt.encode())
+            await process.stdin.drain()
+            process.stdin.close()
+        except (BrokenPipeError, ConnectionResetError):
+            # Процесс упал сразу — причина будет в stderr
+            pass
+
+        await readers
+        await process.wait()
+
+    def collect(timed_out: bool, truncated: bool = False) -> ClaudeResult:
+        result = ClaudeResult.from_spool(
+            output,
+            b"".join(stderr_chunks).decode(errors="replace"),
+            process.returncode,
+            timed_out,
+            started,
+            parser.session_id if parser else None,
+            truncated,
+            parser.tool_use if parser else None,
+        )
+        observe_run(result)
+        return result
+
+    task = asyncio.ensure_future(communicate())
+
+    try:
+        if await supervise(task, started, timeout, on_status):
+            logger.warning(f"Claude timeout after {time.monotonic() - started:.0f}s, pid={process.pid}")
+            task.cancel()
+            await terminate(process)
+            return collect(timed_out=True)
+
+        task.result()
+        return collect(timed_out=False)
+    except OutputLimitExceeded:
+        logger.warning(f"Claude output limit {max_output} reached, pid={process.pid}")
+        await terminate(process)
+        return collect(timed_out=False, truncated=True)
+    finally:
+        # Отмена корутины или ошибка — процесс не должен остаться висеть
+        if not task.done():
+            task.cancel()
+        if process.returncode is None:
+            await terminate(process)
+        output.close()
@@ -0,0 +1,111 @@
+"""
+Общие настройки Claude Admin Bot
+Используются и Telegram-ботом (bot.py), и веб-API (api.py)
+"""
+
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Директории
+WORK_DIR = os.getenv("CLAUDE_WORK_DIR", "/root")
+FILES_DIR = os.getenv("CLAUDE_FILES_DIR", "/root/claude-admin-bot/files")
+DATA_DIR = os.getenv("CLAUDE_DATA_DIR", "/root/claude-admin-bot/data")  # Служебные данные бота
+
+SESSIONS_FILE = os.path.join(DATA_DIR, "sessions.json")
+OUTPUTS_DIR = os.path.join(DATA_DIR, "outputs")  # Огромные ответы Claude, сброшенные на диск
+HISTORY_DB = os.path.join(DATA_DIR, "history.db")  # История сообщений (SQLite)
+VOLUMES_DIR = os.path.join(DATA_DIR, "volumes")  # Том архива каталога перед отправкой в Telegram
+
+# Claude CLI
+CLAUDE_BIN = os.getenv("CLAUDE_BIN", "claude")
+CLAUDE_MODEL = os.getenv("CLAUDE_MODEL", "haiku")
+CLAUDE_STREAM = os.getenv("CLAUDE_STREAM", "1") == "1"  # Потоковый вывод ответа
+
+# Огромные ответы
+OUTPUT_SPILL_THRESHOLD = int(os.getenv("OUTPUT_SPILL_THRESHOLD", str(1024 * 1024)))  # С какой длины ответ уходит на диск
+OUTPUT_PREVIEW_CHARS = int(os.getenv("OUTPUT_PREVIEW_CHARS", "8000"))  # Сколько показывать сразу
+OUTPUT_PAGE_SIZE = 256 * 1024  # Страница полного ответа в веб-интерфейсе (байт)
+OUTPUT_RETENTION = 7 * 24 * 3600  # Сохранённые ответы удаляются через неделю
+
+# История сообщений
+HISTORY_PAGE_SIZE = 30  # Сообщений на страницу истории по умолчанию
+HISTORY_MAX_PAGE = 100  # Больше за один запрос не отдаём
+HISTORY_BATCH = 100  # Максимум сообщений в одной транзакции записи
+HISTORY_FLUSH_INTERVAL = 0.5  # Сколько поток записи копит пачку, секунд
+
+# Досылка кадров WebSocket после переподключения
+OUTBOX_SIZE = int(os.getenv("OUTBOX_SIZE", "2000"))  # Кадров в буфере каждого браузера
+OUTBOX_TTL = 3600  # Буфер ушедшего браузера хранится час
+
+# Отправка кадров WebSocket
+WS_SEND_QUEUE = int(os.getenv("WS_SEND_QUEUE", "256"))  # Кадров в очереди одного соединения
+WS_SLOW_CLIENT = os.getenv("WS_SLOW_CLIENT", "coalesce")  # coalesce | disconnect — что делать с медленным клиентом
+WS_DEFLATE = os.getenv("WS_DEFLATE", "1") == "1"  # Сжатие permessage-deflate
+
+# Загрузка файлов через веб-интерфейс
+UPLOAD_CHUNK_SIZE = 256 * 1024  # Размер куска, который сервер предлагает клиенту
+UPLOAD_MAX_SIZE = int(os.getenv("UPLOAD_MAX_SIZE", str(2 * 1024 ** 3)))  # Максимальный размер файла
+UPLOAD_STALE_AFTER = 24 * 3600  # Недокачанные файлы удаляются через сутки
+
+# Индекс файлов (/find, скачивание по имени) и отдача больших файлов
+FILE_INDEX_EXCLUDE = set(filter(None, os.getenv(
+    "FILE_INDEX_EXCLUDE", ".git,node_modules,__pycache__,.venv,venv,.cache,.npm,.mypy_cache,.blobs,.uploads"
+).split(",")))  # Каталоги с такими именами не индексируются
+FILE_INDEX_MAX = int(os.getenv("FILE_INDEX_MAX", "500000"))  # Больше записей индекс не держит
+FILE_INDEX_RESCAN = 3600  # Полный обход для страховки при работающем inotify, сек
+FILE_INDEX_POLL = int(os.getenv("FILE_INDEX_POLL", "60"))  # Полный обход, когда inotify нет или не хватило watch
+FILE_ARCHIVE_FORMAT = os.getenv("FILE_ARCHIVE_FORMAT", "zip")  # zip | tar — как отдавать каталоги
+FILE_VOLUME_SIZE = int(os.getenv("FILE_VOLUME_SIZE", str(48 * 1024 ** 2)))  # Том для Telegram (лимит Bot API — 50 МБ)
+FILE_MAX_VOLUMES = int(os.getenv("FILE_MAX_VOLUMES", "40"))  # Больше томов в Telegram не шлём
+
+# Очередь запросов
+CLAUDE_WORKERS = int(os.getenv("CLAUDE_WORKERS", "2"))  # Одновременно работающих процессов Claude
+CLAUDE_QUEUE_SIZE = int(os.getenv("CLAUDE_QUEUE_SIZE", "20"))  # Максимум ожидающих запросов
+
+# Общая очередь для нескольких процессов (uvicorn --workers, бот и API отдельно)
+JOB_STORE = os.getenv("JOB_STORE", "0") == "1"  # Очередь, беседы и кадры — через SQLite в DATA_DIR
+JOB_STORE_DB = os.path.join(DATA_DIR, "jobs.db")
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.1"))  # Как часто процесс смотрит чужие изменения, сек
+JOB_LEASE = 30  # Процесс, не отмечавшийся столько секунд, считается упавшим
+API_WORKERS = int(os.getenv("API_WORKERS", "1"))  # Процессов uvicorn у python api.py (больше 1 — только с JOB_STORE)
+
+# Кэш ответов на повторяющиеся вопросы (без запуска Claude)
+PROMPT_CACHE = os.getenv("PROMPT_CACHE", "0") == "1"
+PROMPT_CACHE_DB = os.path.join(DATA_DIR, "prompt_cache.db")
+PROMPT_CACHE_TTL = int(os.getenv("PROMPT_CACHE_TTL", "600"))  # Сколько секунд ответ считается свежим
+PROMPT_CACHE_ENTRIES = int(os.getenv("PROMPT_CACHE_ENTRIES", "500"))  # Максимум ответов, лишние — давно не нужные
+PROMPT_CACHE_BYTES = int(os.getenv("PROMPT_CACHE_BYTES", str(32 * 1024 ** 2)))  # Максимум байт ответов всего
+PROMPT_CACHE_PATHS = 20  # Сколько путей из промпта учитывать в ключе
+PROMPT_CACHE_MIN_WORDS = int(os.getenv("PROMPT_CACHE_MIN_WORDS", "3"))  # Короче в идущей беседе — уточнение, не из кэша
+SESSION_CACHED_TURNS = 3  # Сколько ответов из кэша передать Claude в начале следующего хода
+SESSION_CACHED_CHARS = 4000  # Сколько символов каждого такого ответа передать
+
+# Постоянные процессы Claude (один на беседу, без запуска CLI на каждое сообщение)
+CLAUDE_PERSISTENT = os.getenv("CLAUDE_PERSISTENT", "0") == "1"
+CLAUDE_MAX_RESIDENT = int(os.getenv("CLAUDE_MAX_RESIDENT", "4"))  # Максимум живых процессов бесед
+CLAUDE_WARM_POOL = int(os.getenv("CLAUDE_WARM_POOL", "1"))  # Заранее запущенные процессы для новых бесед
+CLAUDE_IDLE_TIMEOUT = int(os.getenv("CLAUDE_IDLE_TIMEOUT", "600"))  # Простой, после которого процесс закрывается
+
+# Таймауты (секунды)
+CLAUDE_TIMEOUT = int(os.getenv("CLAUDE_TIMEOUT", "300"))  # Максимум на один запрос
+CLAUDE_TIMEOUT_LIMIT = int(os.getenv("CLAUDE_TIMEOUT_LIMIT", "3600"))  # Больше --timeout в сообщении не даём
+CLAUDE_MAX_OUTPUT = int(os.getenv("CLAUDE_MAX_OUTPUT", "0"))  # Символов ответа, после которых процесс останавливается (0 — без лимита)
+CLAUDE_STATUS_DELAY = 10  # Первые N секунд ждём без статуса
+CLAUDE_STATUS_INTERVAL = 30  # Дальше обновляем статус раз в N секунд
+CLAUDE_KILL_GRACE = 5  # Ожидание после SIGTERM перед SIGKILL
+
+# Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096  # Максимальная длина сообщения
+TELEGRAM_UPLOAD_LIMIT = 50 * 1024 ** 2  # Максимальный размер файла, который бот может отправить
+TELEGRAM_EDIT_INTERVAL = float(os.getenv("TELEGRAM_EDIT_INTERVAL", "1.5"))  # Минимум между правками ответа
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))  # Запросов в секунду в один личный чат
+TELEGRAM_CHAT_BURST = 3  # Сколько запросов в чат можно отправить подряд без паузы
+TELEGRAM_GROUP_RATE = 20 / 60  # В группах Telegram разрешает 20 сообщений в минуту
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))  # Запросов в секунду на всего бота
+TELEGRAM_RETRY_ATTEMPTS = 3  # Повторов после 429 Too Many Requests
+# Режим webhook: бот работает внутри api.py (общие очередь, беседы и event loop)
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL", "").rstrip("/")  # Публичный https-адрес api.py; пусто — polling
+TELEGRAM_WEBHOOK_PATH = os.getenv("TELEGRAM_WEBHOOK_PATH", "/telegram/webhook")
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET", "")  # Пусто — выводится из токена бота
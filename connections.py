@@ -0,0 +1,229 @@
+"""
+WebSocket соединения веб-интерфейса
+У каждого соединения своя ограниченная очередь и задача-писатель: медленный
+клиент не тормозит остальных. Кадр сериализуется один раз, сколько бы
+соединений его ни получали. Переполненная очередь медленного клиента
+схлопывается (дельты склеиваются, устаревшие кадры выбрасываются), а если
+это не помогло — соединение закрывается и клиент дочитает всё из outbox.
+
+Компактная бинарная кодировка (клиент просит ?encoding=binary) — только для
+дельт, самых частых кадров:
+    [0]     тип кадра (1 — delta)
+    [1:5]   seq (uint32, big-endian)
+    [5:11]  id запроса (6 байт = 12 hex-символов)
+    [11:]   текст в UTF-8
+"""
+
+import asyncio
+import json
+import logging
+import struct
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple, Union
+
+from fastapi import WebSocket
+
+from config import WS_SEND_QUEUE, WS_SLOW_CLIENT
+from metrics import WS_CONNECTIONS, WS_SEND, WS_COALESCED, WS_SLOW_CLOSED
+
+logger = logging.getLogger(__name__)
+
+BINARY_DELTA = 1
+BINARY_HEADER = struct.Struct(">BI6s")
+
+# Кадры, которые устаревают, когда приходит следующий кадр того же запроса
+SUPERSEDED_BY = {
+    "done": {"delta", "queued", "status"},
+    "queued": {"queued", "status"},
+    "status": {"queued", "status"},
+}
+
+CLOSE_TIMEOUT = 5  # Сколько ждать закрытия соединения с зависшим клиентом
+COALESCE_LIMIT = 256 * 1024  # Склеенная дельта не растёт больше этого (символов)
+
+
+class Payload:
+    """Кадр, сериализованный не больше одного раза в каждую кодировку"""
+
+    __slots__ = ("frame", "_text", "_binary")
+
+    def __init__(self, frame: dict):
+        self.frame = frame
+        self._text: Optional[str] = None
+        self._binary: Optional[bytes] = None
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = json.dumps(self.frame, ensure_ascii=False, separators=(",", ":"))
+        return self._text
+
+    @property
+    def binary(self) -> Optional[bytes]:
+        """Компактная форма (только для дельт), иначе None"""
+        if self._binary is None and self.frame.get("type") == "delta":
+            try:
+                job_id = bytes.fromhex(self.frame["id"])
+                seq = self.frame["seq"]
+            except (KeyError, TypeError, ValueError):
+                return None
+            if len(job_id) != 6:
+                return None
+            self._binary = BINARY_HEADER.pack(BINARY_DELTA, seq, job_id) + self.frame["content"].encode()
+        return self._binary
+
+
+class Connection:
+    """Одно соединение: очередь кадров и задача, которая их отправляет"""
+
+    def __init__(self, websocket: WebSocket, binary: bool = False, max_queue: int = WS_SEND_QUEUE,
+                 policy: str = WS_SLOW_CLIENT):
+        self.websocket = websocket
+        self.binary = binary
+        self.max_queue = max_queue
+        self.policy = policy
+        self.pending: Deque[Tuple[Payload, float]] = deque()  # (кадр, когда поставлен в очередь)
+        self.coalesced = 0
+        self.closed = False
+        self._wakeup = asyncio.Event()
+        self._room = asyncio.Event()  # Писатель освободил место в очереди
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def put(self, payload: Payload):
+        """Постановка кадра в очередь (без ожидания)"""
+        if self.closed:
+            return
+        if len(self.pending) >= self.max_queue:
+            if self.policy == "coalesce" and self._merge_delta(payload):
+                return
+            if self.policy != "coalesce" or not self._drop_obsolete(payload):
+                logger.warning(f"Slow WebSocket client: {len(self.pending)} frames queued, closing")
+                self.abort()
+                return
+        self.pending.append((payload, time.monotonic()))
+        self._wakeup.set()
+
+    async def put_wait(self, payload: Payload):
+        """Постановка в очередь с ожиданием места (досылка большого буфера не должна переполнять очередь)"""
+        while not self.closed and len(self.pending) >= self.max_queue:
+            self._room.clear()
+            await self._room.wait()
+        self.put(payload)
+
+    def _merge_delta(self, payload: Payload) -> bool:
+        """Дельта сразу за дельтой того же запроса склеивается с ней в одну"""
+        frame = payload.frame
+        last, queued_at = self.pending[-1]
+        if frame.get("type") != "delta" or last.frame.get("type") != "delta" or last.frame.get("id") != frame.get("id"):
+            return False
+        if len(last.frame["content"]) + len(frame["content"]) > COALESCE_LIMIT:
+            return False
+        # Payload общий для всех соединений (и лежит в outbox) — склеиваем в новый
+        merged = {**last.frame, "content": last.frame["content"] + frame["content"], "seq": frame["seq"]}
+        self.pending[-1] = (Payload(merged), queued_at)
+        self.coalesced += 1
+        WS_COALESCED.inc()
+        return True
+
+    def _drop_obsolete(self, payload: Payload) -> bool:
+        """Итоговый кадр или новый статус делает ненужными прежние кадры запроса; True, если место нашлось"""
+        frame = payload.frame
+        job_id = frame.get("id")
+        if job_id is None:
+            return False
+        obsolete = SUPERSEDED_BY.get(frame.get("type"), set())
+        before = len(self.pending)
+        self.pending = deque(
+            item for item in self.pending
+            if not (item[0].frame.get("id") == job_id and item[0].frame.get("type") in obsolete)
+        )
+        self.coalesced += before - len(self.pending)
+        WS_COALESCED.inc(before - len(self.pending))
+        return len(self.pending) < self.max_queue
+
+    async def _write_loop(self):
+        try:
+            while True:
+                if not self.pending:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+
+                payload, queued_at = self.pending.popleft()
+                self._room.set()
+                data = payload.binary if self.binary else None
+                if data is not None:
+                    await self.websocket.send_bytes(data)
+                else:
+                    await self.websocket.send_text(payload.text)
+                WS_SEND.observe(time.monotonic() - queued_at)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Клиент ушёл — приёмный цикл в api.py увидит разрыв сам
+            logger.debug(f"WebSocket writer stopped: {e}")
+            self.closed = True
+            self._room.set()
+
+    def abort(self):
+        """Закрытие медленного соединения (клиент переподключится и получит досылку)"""
+        if self.closed:
+            return
+        self.closed = True
+        WS_SLOW_CLOSED.inc()
+        self.pending.clear()
+        self._room.set()
+        self._writer.cancel()
+        asyncio.create_task(self._close())
+
+    async def _close(self):
+        try:
+            await asyncio.wait_for(self.websocket.close(code=1013), timeout=CLOSE_TIMEOUT)
+        except Exception:
+            pass
+
+    def stop(self):
+        self.closed = True
+        self._room.set()
+        self._writer.cancel()
+
+
+class ConnectionManager:
+    """Менеджер WebSocket соединений"""
+
+    def __init__(self):
+        self.active_connections: Dict[WebSocket, Connection] = {}
+
+    async def connect(self, websocket: WebSocket):
+        await websocket.accept()
+        binary = websocket.query_params.get("encoding") == "binary"
+        self.active_connections[websocket] = Connection(websocket, binary=binary)
+        WS_CONNECTIONS.set(len(self.active_connections))
+        logger.info(f"WebSocket connected. Total: {len(self.active_connections)}")
+
+    def disconnect(self, websocket: WebSocket):
+        connection = self.active_connections.pop(websocket, None)
+        if connection:
+            connection.stop()
+        WS_CONNECTIONS.set(len(self.active_connections))
+        logger.info(f"WebSocket disconnected. Total: {len(self.active_connections)}")
+
+    async def send_message(self, websocket: WebSocket, message: Union[dict, Payload], wait: bool = False):
+        """
+        Отправка сообщения конкретному клиенту — в очередь соединения, без ожидания сети
+        wait=True — дождаться места в очереди вместо политики медленного клиента
+        """
+        connection = self.active_connections.get(websocket)
+        if connection:
+            payload = message if isinstance(message, Payload) else Payload(message)
+            if wait:
+                await connection.put_wait(payload)
+            else:
+                connection.put(payload)
+
+    async def broadcast(self, message: Union[dict, Payload]):
+        """Отправка сообщения всем подключенным клиентам (сериализуется один раз)"""
+        payload = message if isinstance(message, Payload) else Payload(message)
+        for connection in list(self.active_connections.values()):
+            connection.put(payload)
@@ -0,0 +1,439 @@
+"""
+Индекс имён файлов WORK_DIR и FILES_DIR для /find и скачивания по имени
+Первый обход — в потоке, дальше индекс обновляется по событиям inotify
+(Linux, через ctypes — без зависимостей). Где inotify нет или не хватило
+watch-дескрипторов (fs.inotify.max_user_watches), индекс догоняет
+периодический полный обход раз в FILE_INDEX_POLL секунд.
+"""
+
+import asyncio
+import ctypes
+import ctypes.util
+import errno
+import heapq
+import logging
+import os
+import re
+import stat
+import struct
+import threading
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from config import (
+    WORK_DIR, FILES_DIR, FILE_INDEX_EXCLUDE, FILE_INDEX_MAX, FILE_INDEX_RESCAN, FILE_INDEX_POLL,
+)
+from metrics import FILE_INDEX_ENTRIES, FILE_INDEX_SCAN, FILE_INDEX_EVENTS
+
+logger = logging.getLogger(__name__)
+
+# inotify(7)
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+EVENT = struct.Struct("iIII")  # wd, mask, cookie, len; дальше имя длиной len
+
+
+class Entry(NamedTuple):
+    path: str
+    name: str  # Имя в нижнем регистре — по нему поиск
+    size: int
+    mtime: float
+    is_dir: bool
+
+
+class WatchLimit(Exception):
+    """Кончились watch-дескрипторы inotify"""
+
+
+class Inotify:
+    """Минимальная обёртка над inotify: watch на каталог, разбор событий"""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._libc = libc
+        self.fd = fd
+        self.paths: Dict[int, str] = {}  # wd -> каталог
+        self.watches: Dict[str, int] = {}  # каталог -> wd
+        self._lock = threading.Lock()  # watch добавляет и поток обхода
+
+    def add(self, path: str) -> bool:
+        """Watch на каталог; False — каталога уже нет или нет доступа"""
+        with self._lock:
+            if path in self.watches:
+                return True
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+            if wd < 0:
+                error = ctypes.get_errno()
+                if error == errno.ENOSPC:
+                    raise WatchLimit(path)
+                return False
+            self.paths[wd] = path
+            self.watches[path] = wd
+            return True
+
+    def remove_tree(self, path: str):
+        """Снимаем watch с каталога и всего, что под ним (каталог переехал)"""
+        prefix = path + os.sep
+        with self._lock:
+            for directory, wd in list(self.watches.items()):
+                if directory == path or directory.startswith(prefix):
+                    self._libc.inotify_rm_watch(self.fd, wd)
+                    del self.watches[directory]
+                    self.paths.pop(wd, None)
+
+    def read(self) -> List[Tuple[Optional[str], int, str]]:
+        """Накопившиеся события: (каталог, маска, имя)"""
+        try:
+            data = os.read(self.fd, 256 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        with self._lock:
+            while offset < len(data):
+                wd, mask, _, length = EVENT.unpack_from(data, offset)
+                name = data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b"\0")
+                offset += EVENT.size + length
+                if mask & IN_IGNORED:
+                    # Каталог удалён — ядро сняло watch само
+                    directory = self.paths.pop(wd, None)
+                    if directory is not None and self.watches.get(directory) == wd:
+                        del self.watches[directory]
+                    continue
+                events.append((self.paths.get(wd), mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+def within(path: str, roots: Iterable[str]) -> bool:
+    """Путь — один из корней или лежит под ним"""
+    return any(path == root or path.startswith(root + os.sep) for root in roots)
+
+
+def fuzzy_pattern(word: str) -> "re.Pattern":
+    """Буквы слова по порядку, между ними что угодно: «ngxcf» найдёт nginx.conf"""
+    return re.compile(".*?".join(re.escape(char) for char in word))
+
+
+class FileIndex:
+    """Пути файлов и каталогов под корнями; поиск — по снимку, в потоке"""
+
+    def __init__(self, roots: Iterable[str] = (WORK_DIR, FILES_DIR), exclude: Set[str] = FILE_INDEX_EXCLUDE,
+                 max_entries: int = FILE_INDEX_MAX, rescan: float = FILE_INDEX_RESCAN,
+                 poll: float = FILE_INDEX_POLL):
+        real = sorted({os.path.realpath(root) for root in roots})
+        # Вложенный корень (FILES_DIR внутри WORK_DIR) обходить второй раз не нужно
+        self.roots = [root for root in real if not any(root.startswith(other + os.sep) for other in real)]
+        self.exclude = exclude
+        self.max_entries = max_entries
+        self.rescan_interval = rescan
+        self.poll_interval = poll
+        self.entries: Dict[str, Entry] = {}
+        self.children: Dict[str, Set[str]] = {}  # Каталог -> пути внутри него (удаление поддерева без обхода всех записей)
+        self.inotify: Optional[Inotify] = None
+        self.watching = False  # inotify следит за всеми каталогами индекса
+        self.truncated = False  # Упёрлись в max_entries
+        self.scanned: Optional[float] = None  # Когда закончился последний полный обход
+        self._dirty: Optional[Set[str]] = None  # Изменения, пришедшие во время полного обхода
+        self._task: Optional[asyncio.Task] = None
+        self._rescan_now: Optional[asyncio.Event] = None
+        self._ready: Optional[asyncio.Event] = None
+
+    def start(self):
+        """Первый обход и слежение (нужен запущенный event loop)"""
+        if self._task is None:
+            self._rescan_now = asyncio.Event()
+            self._ready = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def ready(self, timeout: float = 30):
+        """Ждём первый обход (поиск до него вернул бы пустоту)"""
+        self.start()
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self):
+        try:
+            self.inotify = Inotify()
+            asyncio.get_running_loop().add_reader(self.inotify.fd, self._on_events)
+        except (OSError, AttributeError) as e:
+            logger.warning(f"inotify unavailable, file index falls back to rescans: {e}")
+            self.inotify = None
+
+        while True:
+            try:
+                await self.rescan()
+            except Exception as e:
+                logger.error(f"File index scan failed: {e}")
+            self._ready.set()
+            self._rescan_now.clear()
+            interval = self.rescan_interval if self.watching else self.poll_interval
+            try:
+                await asyncio.wait_for(self._rescan_now.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self.inotify:
+            asyncio.get_running_loop().remove_reader(self.inotify.fd)
+            self.inotify.close()
+            self.inotify = None
+
+    # Обход
+
+    async def rescan(self):
+        """Полный обход; изменения, пришедшие за время обхода, накладываются после"""
+        started = time.monotonic()
+        self._dirty = set()
+        try:
+            entries, children, watching, truncated = await asyncio.to_thread(self._scan, self.roots)
+        except BaseException:
+            self._dirty = None
+            raise
+        self.entries = entries
+        self.children = children
+        self.watching = watching
+        self.truncated = truncated
+        dirty, self._dirty = self._dirty, None
+        for path in dirty:
+            self._refresh(path)
+
+        self.scanned = time.time()
+        FILE_INDEX_SCAN.observe(time.monotonic() - started)
+        FILE_INDEX_ENTRIES.set(len(self.entries))
+        if truncated:
+            logger.warning(f"File index truncated at {self.max_entries} entries")
+        logger.info(f"File index: {len(self.entries)} entries in {time.monotonic() - started:.1f}s "
+                    f"({'inotify' if watching else f'rescan every {self.poll_interval}s'})")
+
+    def _scan(self, roots: Iterable[str], limit: Optional[int] = None
+              ) -> Tuple[Dict[str, Entry], Dict[str, Set[str]], bool, bool]:
+        """Обход в потоке: (записи, содержимое каталогов, все каталоги под inotify, упёрлись в лимит)"""
+        limit = self.max_entries if limit is None else limit
+        entries: Dict[str, Entry] = {}
+        children: Dict[str, Set[str]] = {}
+        watching = self.inotify is not None
+        stack = [root for root in roots if os.path.isdir(root)]
+        for root in stack:
+            st = os.stat(root)
+            entries[root] = Entry(root, os.path.basename(root).lower(), 0, st.st_mtime, True)
+
+        while stack:
+            directory = stack.pop()
+            if watching:
+                # Watch до чтения каталога: файл, созданный между ними, не потеряется
+                try:
+                    self.inotify.add(directory)
+                except WatchLimit:
+                    logger.warning("inotify watch limit reached, the rest of the index is kept by rescans")
+                    watching = False
+            try:
+                with os.scandir(directory) as items:
+                    for item in items:
+                        if len(entries) >= limit:
+                            return entries, children, watching, True
+                        entry = self._entry(item.path, item)
+                        if entry is None:
+                            continue
+                        entries[entry.path] = entry
+                        children.setdefault(directory, set()).add(entry.path)
+                        if entry.is_dir:
+                            stack.append(entry.path)
+            except OSError:
+                continue
+        return entries, children, watching, False
+
+    def _entry(self, path: str, item: Optional[os.DirEntry] = None) -> Optional[Entry]:
+        """Запись для пути (None — исключён или уже не существует); по ссылкам на каталоги не ходим"""
+        name = os.path.basename(path)
+        try:
+            st = item.stat(follow_symlinks=False) if item is not None else os.lstat(path)
+        except OSError:
+            return None
+        is_dir = stat.S_ISDIR(st.st_mode)
+        if is_dir and name in self.exclude:
+            return None
+        if not is_dir and not stat.S_ISREG(st.st_mode) and not stat.S_ISLNK(st.st_mode):
+            return None
+        return Entry(path, name.lower(), 0 if is_dir else st.st_size, st.st_mtime, is_dir)
+
+    # События inotify
+
+    def _on_events(self):
+        for directory, mask, name in self.inotify.read():
+            FILE_INDEX_EVENTS.inc()
+            if mask & IN_Q_OVERFLOW or directory is None:
+                # Очередь событий переполнилась — что-то потеряно, обходим заново
+                if mask & IN_Q_OVERFLOW:
+                    logger.warning("inotify queue overflow, rescanning")
+                    self._rescan_now.set()
+                continue
+            path = os.path.join(directory, name) if name else directory
+            if self._dirty is not None:
+                self._dirty.add(path)
+            if mask & (IN_DELETE | IN_MOVED_FROM | IN_DELETE_SELF):
+                self._remove(path)
+            else:
+                self._refresh(path)
+        FILE_INDEX_ENTRIES.set(len(self.entries))
+
+    def _refresh(self, path: str):
+        """Путь создан или изменился (или исчез — тогда убираем)"""
+        entry = self._entry(path)
+        if entry is None:
+            self._remove(path)
+            return
+        if len(self.entries) >= self.max_entries and path not in self.entries:
+            self.truncated = True
+            return
+        known = self.entries.get(path)
+        if known is not None and known.is_dir and not entry.is_dir:
+            self._remove(path)  # Каталог заменили файлом — его содержимого больше нет
+        self.entries[path] = entry
+        self.children.setdefault(os.path.dirname(path), set()).add(path)
+        if entry.is_dir and (known is None or not known.is_dir):
+            # Новый каталог (mkdir -p, mv внутрь) — его содержимое событий не даст
+            asyncio.create_task(self._add_tree(path))
+
+    async def _add_tree(self, path: str):
+        room = self.max_entries - len(self.entries)
+        entries, children, watching, truncated = await asyncio.to_thread(self._scan, [path], max(room, 0))
+        if path not in self.entries:
+            return  # Пока обходили, каталог удалили
+        self.entries.update(entries)
+        for directory, paths in children.items():
+            self.children.setdefault(directory, set()).update(paths)
+        self.watching = self.watching and watching
+        self.truncated = self.truncated or truncated
+        FILE_INDEX_ENTRIES.set(len(self.entries))
+
+    def _remove(self, path: str):
+        """Путь исчез; у каталога — всё поддерево, за время, пропорциональное его размеру"""
+        entry = self.entries.pop(path, None)
+        siblings = self.children.get(os.path.dirname(path))
+        if siblings is not None:
+            siblings.discard(path)
+        if entry is None or not entry.is_dir:
+            return
+        stack = [path]
+        while stack:
+            for child in self.children.pop(stack.pop(), ()):
+                self.entries.pop(child, None)
+                stack.append(child)
+        if self.inotify:
+            self.inotify.remove_tree(path)
+
+    # Поиск
+
+    def snapshot(self) -> List[Entry]:
+        """Копия записей для поиска в потоке (индекс меняется в event loop)"""
+        return list(self.entries.values())
+
+    @staticmethod
+    def search_entries(entries: List[Entry], query: str, limit: int = 20) -> List[Entry]:
+        """
+        Нечёткий поиск: каждое слово запроса должно найтись в имени
+        (слово со «/» — в пути). Точное имя лучше начала имени, начало —
+        лучше подстроки, подстрока — лучше букв по порядку; дальше короче путь.
+        """
+        words = query.lower().split()
+        if not words:
+            return []
+        patterns = [fuzzy_pattern(word) for word in words]
+
+        def score(entry: Entry) -> Optional[int]:
+            total = 0
+            path = None
+            for word, pattern in zip(words, patterns):
+                if os.sep in word:
+                    path = path or entry.path.lower()
+                    target = path
+                else:
+                    target = entry.name
+                if target == word or target.endswith(os.sep + word):
+                    total += 0
+                elif target.startswith(word):
+                    total += 1
+                elif word in target:
+                    total += 2
+                elif pattern.search(target):
+                    total += 4
+                else:
+                    return None
+            return total
+
+        scored = []
+        for entry in entries:
+            value = score(entry)
+            if value is not None:
+                scored.append((value, entry.path.count(os.sep), len(entry.path), entry))
+        return [item[3] for item in heapq.nsmallest(limit, scored, key=lambda item: item[:3])]
+
+    async def search(self, query: str, limit: int = 20, roots: Optional[Iterable[str]] = None) -> List[Entry]:
+        """Поиск по всему индексу или только под roots"""
+        await self.ready()
+        entries = self.snapshot()
+
+        def find() -> List[Entry]:
+            found = entries if roots is None else [entry for entry in entries if within(entry.path, roots)]
+            return self.search_entries(found, query, limit)
+
+        return await asyncio.to_thread(find)
+
+    async def lookup(self, text: str) -> List[Entry]:
+        """Записи, чей путь кончается на text («/nginx.conf», «/sites-enabled/default»)"""
+        await self.ready()
+        suffix = text if text.startswith(os.sep) else os.sep + text
+        name = os.path.basename(suffix.rstrip(os.sep)).lower()
+
+        def find(entries: List[Entry]) -> List[Entry]:
+            return [entry for entry in entries if entry.name == name and entry.path.endswith(suffix.rstrip(os.sep))]
+
+        return await asyncio.to_thread(find, self.snapshot())
+
+    def resolve(self, path: str, roots: Optional[Iterable[str]] = None) -> Optional[str]:
+        """Настоящий путь, если он под одним из корней (по умолчанию — корней индекса), иначе None"""
+        real = os.path.realpath(path)
+        if within(real, self.roots if roots is None else roots):
+            return real if os.path.exists(real) else None
+        return None
+
+    def tree_size(self, path: str) -> Tuple[int, int]:
+        """(байт, файлов) под каталогом — по индексу, для оценки архива"""
+        size = files = 0
+        stack = [path.rstrip(os.sep)]
+        while stack:
+            for child in self.children.get(stack.pop(), ()):
+                entry = self.entries.get(child)
+                if entry is None:
+                    continue
+                if entry.is_dir:
+                    stack.append(child)
+                else:
+                    size += entry.size
+                    files += 1
+        return size, files
+
+
+# Один индекс на процесс
+file_index = FileIndex()
@@ -0,0 +1,224 @@
+"""
+История сообщений в SQLite (WAL) с полнотекстовым поиском FTS5
+Запись — пачками в отдельном потоке, event loop не ждёт диск.
+Чтение — постранично по курсору (id сообщения), без выгрузки всей истории.
+"""
+
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from config import HISTORY_DB, HISTORY_BATCH, HISTORY_FLUSH_INTERVAL
+from claude_runner import ClaudeResult
+from response_parser import Segment, plain_text
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    created REAL NOT NULL,
+    session TEXT NOT NULL,
+    client TEXT,
+    role TEXT NOT NULL,  -- user | assistant
+    content TEXT NOT NULL,  -- Промпт или текст ответа без блоков кода
+    code TEXT,  -- Блоки кода ответа (для поиска)
+    segments TEXT,  -- JSON сегментов ответа (для показа)
+    status TEXT,  -- ok | cached | timeout | truncated | cancelled | error
+    duration REAL,
+    claude_session_id TEXT,
+    output_id TEXT  -- Огромный ответ целиком лежит в outputs/
+);
+CREATE INDEX IF NOT EXISTS messages_session ON messages (session, id);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5 (
+    content, code, content='messages', content_rowid='id', tokenize='unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, content, code) VALUES (new.id, new.content, new.code);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, content, code) VALUES ('delete', old.id, old.content, old.code);
+END;
+"""
+
+COLUMNS = (
+    "created", "session", "client", "role", "content", "code",
+    "segments", "status", "duration", "claude_session_id", "output_id",
+)
+INSERT = f"INSERT INTO messages ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+FIELDS = ("id", "created", "session", "client", "role", "content", "segments", "status", "duration", "output_id")
+SELECT = f"SELECT {', '.join(FIELDS)} FROM messages"
+# Поиск идёт от индекса FTS: rowid < курсора и ORDER BY rowid DESC LIMIT выполняет сам FTS5,
+# страница стоит O(limit), а не O(всех совпадений) — даже для частых слов
+SEARCH = (
+    f"SELECT {', '.join('m.' + field for field in FIELDS)} FROM messages_fts "
+    "JOIN messages m ON m.id = messages_fts.rowid "
+    "WHERE messages_fts MATCH ? AND messages_fts.rowid < ? {session_filter} "
+    "ORDER BY messages_fts.rowid DESC LIMIT ?"
+)
+
+
+def fts_query(text: str) -> str:
+    """Запрос пользователя → запрос FTS5: каждое слово как фраза, синтаксис FTS не нужен"""
+    return " ".join('"' + word.replace('"', '""') + '"' for word in text.split())
+
+
+class HistoryStore:
+    """Хранилище истории; record() не блокирует, чтение — из потока (asyncio.to_thread)"""
+
+    def __init__(self, path: str = HISTORY_DB, batch: int = HISTORY_BATCH,
+                 flush_interval: float = HISTORY_FLUSH_INTERVAL):
+        self.path = path
+        self.batch = batch
+        self.flush_interval = flush_interval
+        self.fts = True
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._local = threading.local()
+        self._writer: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        db = self._connect()
+        db.executescript(SCHEMA)
+        try:
+            db.executescript(FTS_SCHEMA)
+        except sqlite3.OperationalError as e:
+            # SQLite без FTS5 — поиск будет медленным LIKE
+            logger.warning(f"FTS5 unavailable, history search falls back to LIKE: {e}")
+            self.fts = False
+
+    def _connect(self) -> sqlite3.Connection:
+        """Своё соединение на каждый поток"""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    # Запись
+
+    def record(self, session: str, client: Optional[str], role: str, content: str, *,
+               code: Optional[str] = None, segments: Optional[str] = None, status: Optional[str] = None,
+               duration: Optional[float] = None, claude_session_id: Optional[str] = None,
+               output_id: Optional[str] = None):
+        """Постановка сообщения в очередь записи"""
+        self._queue.put((
+            time.time(), session, client, role, content, code,
+            segments, status, duration, claude_session_id, output_id,
+        ))
+        with self._lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._write_loop, name="history-writer", daemon=True)
+                self._writer.start()
+
+    def record_prompt(self, session: str, client: str, prompt: str):
+        self.record(session, client, "user", prompt)
+
+    def record_response(self, session: str, client: str, result: Optional[ClaudeResult],
+                        segments: List[Segment], status: str = "ok"):
+        code = "\n\n".join(s.content for s in segments if s.kind == "code")
+        self.record(
+            session, client, "assistant", plain_text(segments),
+            code=code or None,
+            segments=json.dumps([s.to_dict() for s in segments], ensure_ascii=False),
+            status=status,
+            duration=result.duration if result else None,
+            claude_session_id=result.session_id if result else None,
+            output_id=result.output_id if result else None,
+        )
+
+    def _write_loop(self):
+        """Поток записи: одна транзакция на пачку"""
+        db = self._connect()
+        while True:
+            rows = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while rows[-1] is not None and len(rows) < self.batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    rows.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            stop = rows[-1] is None
+            rows = [row for row in rows if row is not None]
+            if rows:
+                try:
+                    with db:
+                        db.execute("BEGIN")
+                        db.executemany(INSERT, rows)
+                except sqlite3.Error as e:
+                    logger.error(f"History write failed ({len(rows)} rows): {e}")
+            for _ in range(len(rows) + stop):
+                self._queue.task_done()
+            if stop:
+                return
+
+    def flush(self):
+        """Дождаться записи всего, что уже в очереди (блокирующий вызов)"""
+        self._queue.join()
+
+    def close(self):
+        if self._writer is not None and self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+
+    # Чтение
+
+    def page(self, session: str, before: Optional[int] = None,
+             limit: int = 30) -> Tuple[List[dict], Optional[int]]:
+        """Сообщения беседы от новых к старым, до id before; (сообщения, курсор следующей страницы)"""
+        db = self._connect()
+        rows = db.execute(
+            f"{SELECT} WHERE session = ? AND id < ? ORDER BY id DESC LIMIT ?",
+            (session, before or 2 ** 62, limit + 1),
+        ).fetchall()
+        return self._result(rows, limit)
+
+    def search(self, text: str, session: Optional[str] = None, before: Optional[int] = None,
+               limit: int = 30) -> Tuple[List[dict], Optional[int]]:
+        """Поиск по промптам, ответам и коду, от новых к старым"""
+        db = self._connect()
+        before = before or 2 ** 62
+        session_filter = "AND session = ?" if session else ""
+        session_args = (session,) if session else ()
+
+        if self.fts:
+            rows = db.execute(
+                SEARCH.format(session_filter="AND m.session = ?" if session else ""),
+                (fts_query(text), before, *session_args, limit + 1),
+            ).fetchall()
+        else:
+            pattern = f"%{text}%"
+            rows = db.execute(
+                f"{SELECT} WHERE (content LIKE ? OR code LIKE ?) AND id < ? {session_filter} "
+                f"ORDER BY id DESC LIMIT ?",
+                (pattern, pattern, before, *session_args, limit + 1),
+            ).fetchall()
+        return self._result(rows, limit)
+
+    @staticmethod
+    def _result(rows: List[sqlite3.Row], limit: int) -> Tuple[List[dict], Optional[int]]:
+        messages = []
+        for row in rows[:limit]:
+            item = dict(row)
+            item["segments"] = json.loads(item["segments"]) if item["segments"] else None
+            messages.append(item)
+        next_before = messages[-1]["id"] if len(rows) > limit else None
+        return messages, next_before
+
+
+history = HistoryStore()
@@ -0,0 +1,354 @@
+"""
+Очередь запросов к Claude
+Ограниченная очередь + N воркеров, запросы одной сессии выполняются строго по порядку
+При JOB_STORE=1 очередь общая для всех процессов (см. job_store.py)
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from config import CLAUDE_WORKERS, CLAUDE_QUEUE_SIZE, JOB_STORE, JOB_LEASE, JOB_POLL_INTERVAL
+from metrics import QUEUE_WAIT, QUEUE_PENDING, QUEUE_RUNNING, QUEUE_REJECTED, QUEUE_CANCELLED
+
+logger = logging.getLogger(__name__)
+
+# Колбэк позиции в очереди: 1 — следующий на выполнение
+PositionCallback = Callable[[int], Awaitable[None]]
+
+
+class QueueFull(Exception):
+    """Очередь заполнена — запрос не принят"""
+
+
+class JobCancelled(Exception):
+    """Запрос отменён пользователем (/cancel в Telegram, кадр cancel в /ws)"""
+
+
+class Job:
+    """Один запрос в очереди"""
+
+    def __init__(self, session: str, func: Callable[[], Awaitable[Any]], on_position: Optional[PositionCallback],
+                 job_id: Optional[str] = None):
+        self.id = job_id or uuid.uuid4().hex[:12]
+        self.session = session
+        self.func = func
+        self.on_position = on_position
+        self.position = 0
+        self.created = time.monotonic()
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.task: Optional[asyncio.Task] = None
+        self.aborted = False  # Отменён пользователем: ожидающий получит JobCancelled
+
+    def settle(self):
+        """Итог выполнения task — в future"""
+        if self.future.done():
+            pass
+        elif self.task is None or self.task.cancelled():
+            self.cancel_future()
+        elif self.task.exception():
+            self.future.set_exception(self.task.exception())
+        else:
+            self.future.set_result(self.task.result())
+
+    def cancel_future(self):
+        if self.future.done():
+            return
+        if self.aborted:
+            self.future.set_exception(JobCancelled("Запрос отменён"))
+        else:
+            self.future.cancel()
+
+
+class JobScheduler:
+    """Пул воркеров Claude с FIFO внутри каждой сессии"""
+
+    def __init__(self, workers: int = CLAUDE_WORKERS, max_queue: int = CLAUDE_QUEUE_SIZE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.pending: List[Job] = []
+        self.running: Dict[str, Job] = {}  # Сессия -> выполняющийся запрос
+        self._cond = asyncio.Condition()
+        self._tasks: List[asyncio.Task] = []
+        self._idle = 0
+
+    async def _ensure_workers(self):
+        """Воркеры стартуют лениво — нужен запущенный event loop"""
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+            # Даём воркерам дойти до ожидания, чтобы первый запрос не считался очередью
+            await asyncio.sleep(0)
+
+    def _next_job(self) -> Optional[Job]:
+        """Первый запрос, чья сессия сейчас свободна"""
+        for job in self.pending:
+            if job.session not in self.running:
+                return job
+        return None
+
+    async def submit(self, session: str, func: Callable[[], Awaitable[Any]],
+                     on_position: Optional[PositionCallback] = None, job_id: Optional[str] = None) -> Job:
+        """Постановка в очередь, QueueFull если мест нет"""
+        if len(self.pending) >= self.max_queue:
+            QUEUE_REJECTED.inc()
+            raise QueueFull(f"В очереди уже {len(self.pending)} запросов")
+
+        # Место в очереди занимаем сразу, до первого await — так сохраняется порядок
+        job = Job(session, func, on_position, job_id)
+        self.pending.append(job)
+        QUEUE_PENDING.set(len(self.pending))
+        await self._ensure_workers()
+
+        async with self._cond:
+            starts_now = self._idle > 0 and self._next_job() is job
+            self._cond.notify_all()
+
+        logger.info(f"Job {job.id} queued (session={session}, pending={len(self.pending)})")
+        if not starts_now:
+            await self._report_positions()
+        return job
+
+    async def run(self, session: str, func: Callable[[], Awaitable[Any]],
+                  on_position: Optional[PositionCallback] = None, job_id: Optional[str] = None) -> Any:
+        """
+        Постановка в очередь и ожидание результата
+        JobCancelled — запрос отменили через cancel_jobs()
+        """
+        job = await self.submit(session, func, on_position, job_id)
+        try:
+            return await asyncio.shield(job.future)
+        except asyncio.CancelledError:
+            # Ожидающий отменён — запрос тоже не нужен
+            self.cancel(job)
+            raise
+
+    def cancel(self, job: Job):
+        """Отмена запроса: убираем из очереди или прерываем выполнение"""
+        if job in self.pending:
+            self.pending.remove(job)
+            QUEUE_PENDING.set(len(self.pending))
+            job.cancel_future()
+        elif job.task and not job.task.done():
+            job.task.cancel()
+
+    def find(self, session: str, job_id: Optional[str] = None) -> List[Job]:
+        """Выполняющийся и ожидающие запросы беседы (или один — по ID)"""
+        jobs = [job for job in [self.running.get(session), *self.pending] if job and job.session == session]
+        return [job for job in jobs if job_id is None or job.id == job_id]
+
+    def abort(self, job: Job):
+        """
+        Отмена по просьбе пользователя
+        Выполняющийся запрос прерывается сразу: отмена задачи завершает группу
+        процессов Claude (SIGTERM, затем SIGKILL), после чего место воркера свободно.
+        """
+        QUEUE_CANCELLED.inc(state="pending" if job in self.pending else "running")
+        job.aborted = True
+        logger.info(f"Job {job.id} cancelled by user")
+        self.cancel(job)
+
+    async def cancel_jobs(self, session: str, job_id: Optional[str] = None) -> int:
+        """Отмена запросов беседы (или одного по ID); возвращает, сколько отменено"""
+        jobs = self.find(session, job_id)
+        for job in jobs:
+            self.abort(job)
+        if jobs:
+            await self._report_positions()
+        return len(jobs)
+
+    async def _report_positions(self):
+        """Сообщаем ожидающим их новую позицию (только при изменении)"""
+        for position, job in enumerate(list(self.pending), 1):
+            if job.position != position and job.on_position:
+                job.position = position
+                try:
+                    await job.on_position(position)
+                except Exception as e:
+                    logger.error(f"Error reporting queue position: {e}")
+
+    async def _worker(self, number: int):
+        while True:
+            async with self._cond:
+                job = self._next_job()
+                while job is None:
+                    self._idle += 1
+                    try:
+                        await self._cond.wait()
+                    finally:
+                        self._idle -= 1
+                    job = self._next_job()
+
+                self.pending.remove(job)
+                self.running[job.session] = job
+                QUEUE_PENDING.set(len(self.pending))
+                QUEUE_RUNNING.set(len(self.running))
+                QUEUE_WAIT.observe(time.monotonic() - job.created)
+
+            await self._report_positions()
+
+            logger.info(f"Job {job.id} started on worker {number}")
+            # Отменён, пока сообщали позиции, — не запускаем
+            job.task = None if job.aborted else asyncio.create_task(job.func())
+            try:
+                if job.task:
+                    await asyncio.wait({job.task})
+                job.settle()
+            finally:
+                async with self._cond:
+                    self.running.pop(job.session, None)
+                    QUEUE_RUNNING.set(len(self.running))
+                    self._cond.notify_all()
+                logger.info(f"Job {job.id} finished")
+
+
+class SharedJobScheduler(JobScheduler):
+    """
+    Очередь в общем хранилище: лимит воркеров, FIFO и блокировка беседы — на все процессы
+
+    Запрос выполняет процесс, который его поставил (функция запроса живёт только
+    в нём), но начать его можно, только захватив в хранилище. Своих воркеров
+    нет: каждый запрос ждёт захвата сам — по сигналу, когда в этом процессе
+    освободилось место, или раз в poll_interval, если освободилось в чужом.
+    """
+
+    def __init__(self, store, workers: int = CLAUDE_WORKERS, max_queue: int = CLAUDE_QUEUE_SIZE,
+                 poll_interval: float = JOB_POLL_INTERVAL, lease: float = JOB_LEASE):
+        super().__init__(workers, max_queue)
+        self.store = store
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self._changed: Optional[asyncio.Event] = None
+        self._waiters: Dict[str, asyncio.Task] = {}
+        self._heartbeat: Optional[asyncio.Task] = None
+
+    def _notify(self):
+        """Будим все ожидающие запросы этого процесса"""
+        if self._changed is not None:
+            self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _ensure_heartbeat(self):
+        if self._heartbeat is None:
+            await asyncio.to_thread(self.store.heartbeat)
+            self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                await asyncio.to_thread(self.store.heartbeat)
+            except Exception as e:
+                logger.error(f"Job store heartbeat failed: {e}")
+
+    async def submit(self, session: str, func: Callable[[], Awaitable[Any]],
+                     on_position: Optional[PositionCallback] = None, job_id: Optional[str] = None) -> Job:
+        await self._ensure_heartbeat()
+        job = Job(session, func, on_position, job_id)
+        # Лимит проверяется в той же транзакции, что и вставка
+        row = await asyncio.to_thread(self.store.enqueue, job.id, session, self.max_queue)
+        if row is None:
+            QUEUE_REJECTED.inc()
+            raise QueueFull(f"В очереди уже {self.max_queue} запросов")
+
+        self.pending.append(job)
+        QUEUE_PENDING.set(len(self.pending))
+        self._waiters[job.id] = asyncio.create_task(self._execute(job, row))
+        logger.info(f"Job {job.id} queued in store (session={session}, seq={row[0]})")
+        return job
+
+    def cancel(self, job: Job):
+        if job in self.pending:
+            self.pending.remove(job)
+            QUEUE_PENDING.set(len(self.pending))
+            waiter = self._waiters.get(job.id)
+            if waiter:
+                waiter.cancel()
+            job.cancel_future()
+        elif job.task and not job.task.done():
+            job.task.cancel()
+
+    async def cancel_jobs(self, session: str, job_id: Optional[str] = None) -> int:
+        """Свои запросы отменяем сразу, запросы беседы в других процессах — пометкой в хранилище"""
+        cancelled = await super().cancel_jobs(session, job_id)
+        return cancelled + await asyncio.to_thread(self.store.cancel, session, job_id)
+
+    async def _report_positions(self):
+        """Позиции в общей очереди сообщает _claim()"""
+
+    async def _claim(self, job: Job, row: Tuple[int, float]):
+        """Ждём, пока хранилище отдаст запрос этому процессу; row — (seq, created) из enqueue()"""
+        while True:
+            if self._changed is None:
+                self._changed = asyncio.Event()
+            changed = self._changed
+            position = await asyncio.to_thread(self.store.claim, job.id, self.workers)
+            if position == 0:
+                return
+            if position == self.store.CANCELLED:
+                raise JobCancelled("Запрос отменён из другого процесса")
+            if position is None:
+                # Процесс сочли упавшим (долго не отмечался) — возвращаем запрос на его место в FIFO
+                logger.warning(f"Job {job.id} vanished from store, requeueing at seq={row[0]}")
+                await asyncio.to_thread(self.store.enqueue, job.id, job.session, seq=row[0], created=row[1])
+                continue
+            if job.position != position and job.on_position:
+                job.position = position
+                try:
+                    await job.on_position(position)
+                except Exception as e:
+                    logger.error(f"Error reporting queue position: {e}")
+            try:
+                await asyncio.wait_for(changed.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _execute(self, job: Job, row: Tuple[int, float]):
+        try:
+            await self._claim(job, row)
+        except JobCancelled:
+            self._waiters.pop(job.id, None)
+            if job in self.pending:
+                self.abort(job)
+            return
+        except BaseException:
+            self._waiters.pop(job.id, None)
+            await asyncio.shield(asyncio.to_thread(self.store.finish, job.id))
+            raise
+
+        self.pending.remove(job)
+        self.running[job.session] = job
+        QUEUE_PENDING.set(len(self.pending))
+        QUEUE_RUNNING.set(len(self.running))
+        QUEUE_WAIT.observe(time.monotonic() - job.created)
+
+        logger.info(f"Job {job.id} started")
+        job.task = asyncio.create_task(job.func())
+        try:
+            # Отмену из другого процесса замечаем опросом хранилища
+            while not job.task.done():
+                await asyncio.wait({job.task}, timeout=self.poll_interval)
+                if not job.task.done() and await asyncio.to_thread(self.store.is_cancelled, job.id):
+                    self.abort(job)
+                    await asyncio.wait({job.task})
+            job.settle()
+        finally:
+            await asyncio.shield(asyncio.to_thread(self.store.finish, job.id))
+            self.running.pop(job.session, None)
+            self._waiters.pop(job.id, None)
+            QUEUE_RUNNING.set(len(self.running))
+            self._notify()
+            logger.info(f"Job {job.id} finished")
+
+
+def create_scheduler() -> JobScheduler:
+    if JOB_STORE:
+        from job_store import store
+        return SharedJobScheduler(store)
+    return JobScheduler()
+
+
+# Одна очередь на процесс: в режиме webhook её делят бот и веб-интерфейс,
+# при JOB_STORE=1 — ещё и все процессы через хранилище
+scheduler = create_scheduler()
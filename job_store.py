@@ -0,0 +1,258 @@
+"""
+Общее хранилище очереди Claude и кадров ответов (SQLite, WAL)
+Нужно, когда процессов несколько: uvicorn --workers N, бот и API отдельно.
+Через один файл в DATA_DIR они делят лимит CLAUDE_WORKERS, очередь FIFO,
+блокировку беседы (в беседе выполняется не больше одного запроса на все
+процессы) и кадры ответов — браузер получит ответ, к какому бы процессу
+он ни подключился. Брокер не нужен: захват запроса — транзакция
+BEGIN IMMEDIATE, остальные процессы опрашивают таблицы раз в JOB_POLL_INTERVAL.
+"""
+
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import List, Optional, Set, Tuple
+
+from config import JOB_STORE_DB, JOB_LEASE, OUTBOX_TTL
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS workers (
+    id TEXT PRIMARY KEY,  -- host:pid:random
+    heartbeat REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,  -- Порядок FIFO
+    id TEXT NOT NULL UNIQUE,
+    session TEXT NOT NULL,
+    worker TEXT NOT NULL,  -- Процесс, который поставил запрос и выполнит его
+    status TEXT NOT NULL,  -- queued | running
+    cancelled INTEGER NOT NULL DEFAULT 0,  -- Отменён из другого процесса, владелец заметит
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, seq);
+CREATE INDEX IF NOT EXISTS jobs_session ON jobs (session, status);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,  -- Он же seq кадра у клиента
+    client TEXT NOT NULL,
+    job_id TEXT,
+    type TEXT,
+    frame TEXT NOT NULL,  -- JSON кадра без seq
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_client ON events (client, id);
+CREATE INDEX IF NOT EXISTS events_created ON events (created);
+"""
+
+# Первый запрос очереди, беседа которого свободна и в которой нет более ранних запросов
+NEXT_JOB = """
+SELECT id FROM jobs q
+WHERE status = 'queued' AND NOT EXISTS (
+    SELECT 1 FROM jobs r
+    WHERE r.session = q.session AND (r.status = 'running' OR r.seq < q.seq)
+)
+ORDER BY seq LIMIT 1
+"""
+
+
+class JobStore:
+    """Таблицы очереди и кадров; методы блокирующие — вызываются через asyncio.to_thread"""
+
+    CANCELLED = -1  # claim(): запрос отменён, выполнять не нужно
+
+    def __init__(self, path: str = JOB_STORE_DB, lease: float = JOB_LEASE, retention: float = OUTBOX_TTL):
+        self.path = path
+        self.lease = lease
+        self.retention = retention
+        self.worker = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._local = threading.local()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        db = self._connect()
+        db.executescript(SCHEMA)
+        # Эпоха хранилища общая для всех процессов: seq кадров сквозной
+        db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('epoch', ?)", (uuid.uuid4().hex[:8],))
+        self.epoch = db.execute("SELECT value FROM meta WHERE key = 'epoch'").fetchone()[0]
+
+    def _connect(self) -> sqlite3.Connection:
+        """Своё соединение на каждый поток"""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    # Процессы
+
+    def heartbeat(self):
+        """
+        Отметка «процесс жив» и уборка за мёртвыми
+
+        Запросы процесса, который не отмечался дольше lease, удаляются: он
+        упал, и его беседы иначе остались бы заблокированы навсегда.
+        """
+        now = time.time()
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute("INSERT OR REPLACE INTO workers (id, heartbeat) VALUES (?, ?)", (self.worker, now))
+            dead = [row[0] for row in db.execute(
+                "SELECT id FROM workers WHERE heartbeat < ?", (now - self.lease,)
+            )]
+            for worker in dead:
+                removed = db.execute("DELETE FROM jobs WHERE worker = ?", (worker,)).rowcount
+                db.execute("DELETE FROM workers WHERE id = ?", (worker,))
+                logger.warning(f"Worker {worker} is gone, dropped its {removed} jobs")
+            db.execute("DELETE FROM events WHERE created < ?", (now - self.retention,))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    # Очередь
+
+    def enqueue(self, job_id: str, session: str, max_queue: Optional[int] = None,
+                seq: Optional[int] = None, created: Optional[float] = None) -> Optional[Tuple[int, float]]:
+        """
+        Постановка в общую очередь: (seq, created) запроса или None, если
+        ожидающих уже max_queue. Подсчёт и вставка — одна транзакция
+        BEGIN IMMEDIATE: процессы, ставящие запросы одновременно, не превысят
+        лимит вместе. seq и created — вернуть убранный запрос на его прежнее
+        место в FIFO (номер свободен: AUTOINCREMENT не выдаёт его повторно).
+        """
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if max_queue is not None:
+                pending = db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+                if pending >= max_queue:
+                    db.execute("COMMIT")
+                    return None
+            created = time.time() if created is None else created
+            cursor = db.execute(
+                "INSERT INTO jobs (seq, id, session, worker, status, created) VALUES (?, ?, ?, ?, 'queued', ?)",
+                (seq, job_id, session, self.worker, created),
+            )
+            db.execute("COMMIT")
+            return cursor.lastrowid, created
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def claim(self, job_id: str, limit: int) -> Optional[int]:
+        """
+        Попытка начать запрос: 0 — захвачен, иначе позиция в общей очереди
+        None — запроса нет в хранилище (процесс сочли мёртвым и запрос убрали),
+        CANCELLED — запрос отменили (он удаляется)
+
+        Запрос начинается, только если он первый среди готовых к запуску и
+        выполняющихся во всех процессах меньше limit. BEGIN IMMEDIATE
+        сериализует захваты: двух запросов одной беседы сразу не будет.
+        """
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute("SELECT seq, status, cancelled FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                db.execute("COMMIT")
+                return None
+            seq, status, cancelled = row
+            if cancelled:
+                db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+                db.execute("COMMIT")
+                return self.CANCELLED
+            if status == "running":
+                db.execute("COMMIT")
+                return 0
+
+            running = db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'running'").fetchone()[0]
+            first = db.execute(NEXT_JOB).fetchone()
+            if running < limit and first is not None and first[0] == job_id:
+                db.execute("UPDATE jobs SET status = 'running' WHERE id = ?", (job_id,))
+                position = 0
+            else:
+                position = db.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND seq <= ?", (seq,)
+                ).fetchone()[0]
+            db.execute("COMMIT")
+            return position
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def finish(self, job_id: str):
+        """Запрос выполнен или отменён — беседа и место воркера свободны"""
+        self._connect().execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def cancel(self, session: str, job_id: Optional[str] = None) -> int:
+        """Пометка «отменить» для запросов беседы в других процессах; сколько помечено"""
+        return self._connect().execute(
+            "UPDATE jobs SET cancelled = 1 WHERE session = ? AND (? IS NULL OR id = ?) "
+            "AND worker != ? AND cancelled = 0",
+            (session, job_id, job_id, self.worker),
+        ).rowcount
+
+    def is_cancelled(self, job_id: str) -> bool:
+        row = self._connect().execute("SELECT cancelled FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def counts(self) -> Tuple[int, int]:
+        """(ожидают, выполняются) во всех процессах"""
+        rows = dict(self._connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return rows.get("queued", 0), rows.get("running", 0)
+
+    # Кадры ответов
+
+    def append_event(self, client: str, job_id: Optional[str], kind: Optional[str], frame: str) -> int:
+        """Кадр клиенту; возвращает его сквозной номер"""
+        cursor = self._connect().execute(
+            "INSERT INTO events (client, job_id, type, frame, created) VALUES (?, ?, ?, ?, ?)",
+            (client, job_id, kind, frame, time.time()),
+        )
+        return cursor.lastrowid
+
+    def last_event(self) -> int:
+        return self._connect().execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+
+    def events_after(self, after: int, limit: int = 1000) -> List[Tuple[int, str, str]]:
+        """Кадры всех клиентов с номером больше after: (номер, клиент, JSON)"""
+        return self._connect().execute(
+            "SELECT id, client, frame FROM events WHERE id > ? ORDER BY id LIMIT ?", (after, limit)
+        ).fetchall()
+
+    def client_events(self, client: str, after: int, until: int) -> List[Tuple[int, Optional[str], str]]:
+        """Кадры клиента с номерами (after, until]: (номер, ID запроса, JSON)"""
+        return self._connect().execute(
+            "SELECT id, job_id, frame FROM events WHERE client = ? AND id > ? AND id <= ? ORDER BY id",
+            (client, after, until),
+        ).fetchall()
+
+    def client_range(self, client: str) -> Tuple[Optional[int], int]:
+        """(самый старый, самый новый) номер кадра клиента"""
+        oldest, newest = self._connect().execute(
+            "SELECT MIN(id), COALESCE(MAX(id), 0) FROM events WHERE client = ?", (client,)
+        ).fetchone()
+        return oldest, newest
+
+    def open_jobs(self, client: str) -> Set[str]:
+        """Запросы клиента, по которым ещё не было кадра done"""
+        rows = self._connect().execute(
+            "SELECT job_id, MAX(type = 'done') FROM events WHERE client = ? AND job_id IS NOT NULL "
+            "GROUP BY job_id", (client,),
+        ).fetchall()
+        return {job_id for job_id, finished in rows if not finished}
+
+
+# Одно хранилище на процесс (создаётся только при JOB_STORE=1)
+store = JobStore()
@@ -0,0 +1,161 @@
+"""
+Живой ответ в Telegram: одно сообщение, которое дописывается по мере генерации
+Правки склеиваются, чтобы не упираться в лимиты Telegram на edit
+"""
+
+import asyncio
+import logging
+import time
+from typing import List, Optional
+
+from aiogram import types
+from aiogram.exceptions import TelegramBadRequest
+
+from config import OUTPUT_PREVIEW_CHARS, TELEGRAM_EDIT_INTERVAL, TELEGRAM_MESSAGE_LIMIT
+from response_parser import split_text
+
+logger = logging.getLogger(__name__)
+
+
+class LiveMessage:
+    """Ответ, растущий на месте через edit_text с переносом в новые сообщения"""
+
+    def __init__(
+        self,
+        message: types.Message,
+        min_interval: float = TELEGRAM_EDIT_INTERVAL,
+        limit: int = TELEGRAM_MESSAGE_LIMIT,
+        max_chars: int = OUTPUT_PREVIEW_CHARS,
+    ):
+        self.message = message  # Сообщение пользователя, на которое отвечаем
+        self.min_interval = min_interval
+        self.limit = limit
+        self.max_chars = max_chars  # Больше черновик не растёт — огромный ответ придёт файлом
+
+        self.sent: List[Optional[types.Message]] = []  # Отправленные части (None — ещё не отправлена)
+        self.text = ""  # Текст текущей (последней) части
+        self._shown: Optional[str] = ""  # Что сейчас видно в последней части
+        self._has_content = False  # Плейсхолдер ещё не заменён ответом
+        self._fed = 0  # Сколько символов черновика уже принято
+        self._last_edit = 0.0
+        self._flush_task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    async def start(self, placeholder: str):
+        """Сразу показываем плейсхолдер — дальше он будет заменён ответом"""
+        await self._show(placeholder)
+
+    async def status(self, text: str):
+        """Обновление плейсхолдера, пока ответа ещё нет"""
+        if not self._has_content:
+            await self._show(text)
+
+    async def feed(self, chunk: str):
+        """Новый кусок ответа"""
+        if not self._has_content:
+            self._has_content = True
+            self._shown = None  # Плейсхолдер нужно заменить в любом случае
+
+        if self._fed >= self.max_chars:
+            return
+        chunk = chunk[:self.max_chars - self._fed]
+        self._fed += len(chunk)
+        self.text += chunk
+
+        # Переполнение: закрываем текущую часть и начинаем новое сообщение
+        while len(self.text) > self.limit:
+            head = split_text(self.text, self.limit)[0]
+            self.text = self.text[len(head):].lstrip('\n')
+            await self._show(head)
+            self._new_part()
+
+        delay = self.min_interval - (time.monotonic() - self._last_edit)
+        if delay <= 0:
+            await self._flush()
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush(delay))
+
+    async def finish(self, final_text: str):
+        """Итоговый ответ: приводим отправленные части к final_text"""
+        await self.finish_parts(split_text(final_text or "Нет ответа", self.limit))
+
+    async def finish_parts(self, parts: List[str]):
+        """Итоговый ответ, уже разбитый на сообщения"""
+        async with self._lock:
+            # Отложенную правку отменяем под блокировкой: если она уже отправляла часть,
+            # мы дождались её конца и часть есть в self.sent, а не осталась лишним черновиком
+            if self._flush_task and not self._flush_task.done():
+                self._flush_task.cancel()
+
+            messages = list(self.sent)
+
+            for i, part in enumerate(parts):
+                if i < len(messages) and messages[i] is not None:
+                    await self._edit(messages[i], part, final=True)
+                elif i < len(messages):
+                    messages[i] = await self._answer(part, final=True)
+                else:
+                    messages.append(await self._answer(part, final=True))
+
+            # Лишние черновые части (итог короче черновика)
+            for extra in messages[len(parts):]:
+                if extra is None:
+                    continue
+                try:
+                    await extra.delete()
+                except TelegramBadRequest:
+                    pass
+
+            self.sent = messages[:len(parts)]
+
+    def _new_part(self):
+        self.sent.append(None)
+        self._shown = None
+
+    async def _delayed_flush(self, delay: float):
+        await asyncio.sleep(delay)
+        await self._flush()
+
+    async def _flush(self):
+        await self._show(self.text)
+
+    async def _show(self, text: str):
+        """Показ text в последней части (черновик — без Markdown)"""
+        async with self._lock:
+            if not text or text == self._shown:
+                return
+
+            if not self.sent or self.sent[-1] is None:
+                msg = await self._answer(text)
+                if self.sent:
+                    self.sent[-1] = msg
+                else:
+                    self.sent.append(msg)
+            else:
+                await self._edit(self.sent[-1], text)
+
+            self._shown = text
+            self._last_edit = time.monotonic()
+
+    async def _answer(self, text: str, final: bool = False) -> types.Message:
+        if final:
+            try:
+                return await self.message.answer(text)
+            except TelegramBadRequest:
+                # Markdown не разобрался — отправляем как есть
+                pass
+        return await self.message.answer(text, parse_mode=None)
+
+    async def _edit(self, msg: types.Message, text: str, final: bool = False):
+        try:
+            if final:
+                try:
+                    await msg.edit_text(text)
+                    return
+                except TelegramBadRequest as e:
+                    if "not modified" in str(e):
+                        return
+            await msg.edit_text(text, parse_mode=None)
+        except TelegramBadRequest as e:
+            if "not modified" not in str(e):
+                raise
@@ -0,0 +1,358 @@
+"""
+Метрики конвейера запросов к Claude
+Счётчики, гистограммы и текущие значения в формате Prometheus (GET /metrics
+в api.py) и краткая сводка для команды /stats бота. Метрики живут в памяти
+процесса: у бота и у API они свои.
+"""
+
+import asyncio
+import math
+import os
+import resource
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+# Секунды: от миллисекунд (отправка в WebSocket) до таймаута Claude
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# Символы ответа: от короткой реплики до ответов, которые уходят на диск
+SIZE_BUCKETS = (100, 1000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+# Опоздание event loop: обычно доли миллисекунды, заметно — от 10 мс
+LAG_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+LOOP_MONITOR_INTERVAL = 0.1  # Как часто проверять event loop, сек
+# Байт в секунду: от медленного мобильного до локальной сети
+THROUGHPUT_BUCKETS = (64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2, 256 * 1024 ** 2)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric(ABC):
+    """Общая часть: имя, описание, метки; значения по набору меток (строки значений — у наследников)"""
+
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()  # Наблюдения могут приходить и из потоков (asyncio.to_thread)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name}: labels {sorted(labels)} != {sorted(self.labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        """Строки значений в текстовом формате Prometheus"""
+
+
+class Counter(Metric):
+    """Только растёт: число событий или байт"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self.values: Dict[LabelValues, float] = {} if labels else {(): 0}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self.values.get(self._key(labels), 0)
+
+    def total(self) -> float:
+        return sum(self.values.values())
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+            for key, value in sorted(self.values.items())
+        ]
+
+
+class Gauge(Metric):
+    """Текущее значение: длина очереди, число соединений"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self.values: Dict[LabelValues, float] = {} if labels else {(): 0}
+
+    def set(self, value: float, **labels: str):
+        self.values[self._key(labels)] = value
+
+    def value(self, **labels: str) -> float:
+        return self.values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+            for key, value in sorted(self.values.items())
+        ]
+
+
+class HistogramData:
+    """Корзины, сумма и число наблюдений одного набора меток"""
+
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, size: int):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(Metric):
+    """Распределение значений по корзинам (как histogram в Prometheus)"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = TIME_BUCKETS, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.data: Dict[LabelValues, HistogramData] = {} if labels else {(): HistogramData(len(self.buckets))}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            data = self.data.get(key)
+            if data is None:
+                data = self.data[key] = HistogramData(len(self.buckets))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data.counts[i] += 1
+                    break
+            data.sum += value
+            data.count += 1
+
+    def count(self, **labels: str) -> int:
+        data = self.data.get(self._key(labels))
+        return data.count if data else 0
+
+    def merged(self) -> HistogramData:
+        """Все наборы меток вместе (для сводки)"""
+        total = HistogramData(len(self.buckets))
+        for data in self.data.values():
+            for i, count in enumerate(data.counts):
+                total.counts[i] += count
+            total.sum += data.sum
+            total.count += data.count
+        return total
+
+    def quantile(self, q: float, data: Optional[HistogramData] = None) -> Optional[float]:
+        """Оценка квантиля по корзинам (линейно внутри корзины, как histogram_quantile)"""
+        data = data or self.merged()
+        if not data.count:
+            return None
+        rank = q * data.count
+        seen = 0
+        for i, count in enumerate(data.counts):
+            if seen + count >= rank and count:
+                upper = self.buckets[i]
+                lower = self.buckets[i - 1] if i else 0.0
+                if math.isinf(upper):
+                    return lower
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-2]
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, data in sorted(self.data.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, data.counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(data.sum)}")
+            lines.append(f"{self.name}_count{labels} {data.count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Все метрики процесса"""
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def _add(self, metric: Metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float] = TIME_BUCKETS,
+                  labels: Sequence[str] = ()) -> Histogram:
+        return self._add(Histogram(name, help, buckets, labels))
+
+    def render(self) -> str:
+        """Текстовый формат Prometheus 0.0.4"""
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+# Очередь запросов
+QUEUE_WAIT = metrics.histogram("claude_queue_wait_seconds", "Time a request waited in the job queue")
+QUEUE_PENDING = metrics.gauge("claude_queue_pending", "Requests waiting in the job queue")
+QUEUE_RUNNING = metrics.gauge("claude_queue_running", "Requests being executed")
+QUEUE_REJECTED = metrics.counter("claude_queue_rejected_total", "Requests rejected because the queue was full")
+QUEUE_CANCELLED = metrics.counter("claude_queue_cancelled_total", "Requests cancelled by the user", labels=("state",))
+
+# Процессы Claude
+SPAWN = metrics.histogram("claude_spawn_seconds", "Time to start a Claude CLI process", labels=("mode",))
+FIRST_OUTPUT = metrics.histogram("claude_first_output_seconds", "Time from request start to the first output text")
+RUN = metrics.histogram("claude_run_seconds", "Total request run time", labels=("status",))
+OUTPUT_SIZE = metrics.histogram("claude_output_chars", "Response size in characters", SIZE_BUCKETS)
+TIMEOUTS = metrics.counter("claude_timeouts_total", "Requests that hit the timeout")
+KILLS = metrics.counter("claude_kills_total", "Signals sent to Claude process groups", labels=("signal",))
+
+# Загрузки через веб-интерфейс
+UPLOAD_BYTES = metrics.counter("upload_bytes_total", "Bytes received in upload chunks")
+UPLOAD_THROUGHPUT = metrics.histogram(
+    "upload_throughput_bytes_per_second", "Throughput of completed uploads", THROUGHPUT_BUCKETS,
+)
+
+# Кэш ответов
+CACHE_REQUESTS = metrics.counter("claude_cache_requests_total", "Prompt cache lookups", labels=("result",))
+CACHE_SAVED = metrics.counter("claude_cache_saved_seconds_total", "Claude run time saved by prompt cache hits")
+CACHE_EVICTED = metrics.counter("claude_cache_evicted_total", "Prompt cache entries removed", labels=("reason",))
+CACHE_ENTRIES = metrics.gauge("claude_cache_entries", "Responses in the prompt cache")
+CACHE_BYTES = metrics.gauge("claude_cache_bytes", "Size of responses in the prompt cache")
+
+# Индекс файлов и скачивание
+FILE_INDEX_ENTRIES = metrics.gauge("file_index_entries", "Paths in the file name index")
+FILE_INDEX_SCAN = metrics.histogram("file_index_scan_seconds", "Duration of a full file index scan")
+FILE_INDEX_EVENTS = metrics.counter("file_index_events_total", "inotify events applied to the file index")
+DOWNLOAD_BYTES = metrics.counter("download_bytes_total", "Bytes sent by the download endpoint", labels=("kind",))
+
+# WebSocket
+WS_CONNECTIONS = metrics.gauge("ws_connections", "Open WebSocket connections")
+WS_SEND = metrics.histogram("ws_send_seconds", "Time from queueing a frame to sending it")
+WS_COALESCED = metrics.counter("ws_coalesced_frames_total", "Frames merged or dropped for slow clients")
+WS_SLOW_CLOSED = metrics.counter("ws_slow_clients_closed_total", "Connections closed because the send queue overflowed")
+
+# Процесс
+LOOP_LAG = metrics.histogram("event_loop_lag_seconds", "How late the event loop woke a periodic timer", LAG_BUCKETS)
+MEMORY = metrics.gauge("process_resident_memory_bytes", "Resident memory size")
+
+
+def resident_memory(pid: str = "self") -> int:
+    """RSS процесса в байтах (вне Linux — пик RSS текущего процесса)"""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+async def monitor_event_loop(interval: float = LOOP_MONITOR_INTERVAL):
+    """Фоновая задача: опоздание таймера = сколько event loop был занят чем-то другим"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(0.0, loop.time() - started - interval))
+        MEMORY.set(resident_memory())
+
+
+def observe_run(result) -> None:
+    """Метрики завершённого запроса (ClaudeResult)"""
+    if result.timed_out:
+        status = "timeout"
+        TIMEOUTS.inc()
+    elif result.truncated:
+        status = "truncated"
+    elif result.returncode not in (0, None):
+        status = "error"
+    else:
+        status = "ok"
+    RUN.observe(result.duration, status=status)
+    OUTPUT_SIZE.observe(result.output_size)
+    if result.first_output is not None:
+        FIRST_OUTPUT.observe(result.first_output)
+
+
+def _seconds(value: Optional[float]) -> str:
+    if value is None:
+        return "—"
+    return f"{value * 1000:.0f} мс" if value < 1 else f"{value:.1f} с"
+
+
+def summary() -> str:
+    """Сводка для /stats: число, p50 и p95 по основным гистограммам"""
+    lines = []
+    for title, histogram in (
+        ("Ожидание в очереди", QUEUE_WAIT),
+        ("Запуск процесса", SPAWN),
+        ("До первого вывода", FIRST_OUTPUT),
+        ("Выполнение", RUN),
+        ("Отправка в WebSocket", WS_SEND),
+        ("Опоздание event loop", LOOP_LAG),
+    ):
+        data = histogram.merged()
+        lines.append(
+            f"{title}: {data.count} шт., p50 {_seconds(histogram.quantile(0.5, data))}, "
+            f"p95 {_seconds(histogram.quantile(0.95, data))}"
+        )
+
+    sizes = OUTPUT_SIZE.merged()
+    if sizes.count:
+        lines.append(f"Ответ: в среднем {sizes.sum / sizes.count:.0f} символов, "
+                     f"p95 {OUTPUT_SIZE.quantile(0.95, sizes):.0f}")
+    lines.append(
+        f"Статусы: ok {RUN.count(status='ok')}, timeout {RUN.count(status='timeout')}, "
+        f"error {RUN.count(status='error')}"
+    )
+    lines.append(
+        f"Убито процессов: SIGTERM {KILLS.value(signal='SIGTERM'):.0f}, SIGKILL {KILLS.value(signal='SIGKILL'):.0f}"
+    )
+    hits, misses = CACHE_REQUESTS.value(result="hit"), CACHE_REQUESTS.value(result="miss")
+    if hits or misses:
+        lines.append(
+            f"Кэш ответов: попаданий {hits:.0f}, промахов {misses:.0f} ({hits / (hits + misses):.0%}), "
+            f"мимо кэша {CACHE_REQUESTS.value(result='bypass') + CACHE_REQUESTS.value(result='follow_up'):.0f}, "
+            f"сэкономлено {_seconds(CACHE_SAVED.total())}, "
+            f"записей {CACHE_ENTRIES.value():.0f}"
+        )
+    lines.append(
+        f"Очередь сейчас: ждут {QUEUE_PENDING.value():.0f}, выполняются {QUEUE_RUNNING.value():.0f}, "
+        f"отказов {QUEUE_REJECTED.total():.0f}"
+    )
+    lines.append(f"Память: {resident_memory() / 1024 ** 2:.0f} МБ")
+    return "\n".join(lines)
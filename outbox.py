@@ -0,0 +1,240 @@
+"""
+Исходящие кадры WebSocket для каждого клиента (браузера)
+Кадры ответов нумеруются и хранятся в кольцевом буфере: после обрыва связи
+клиент присылает последний увиденный номер и получает всё пропущенное,
+включая дельты ещё идущих запросов. Результат долгого запроса не теряется,
+если вкладка переподключилась посреди работы.
+При JOB_STORE=1 кадры идут через общее хранилище: вкладка может быть
+подключена к любому процессу uvicorn (см. job_store.py).
+"""
+
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Set
+
+from fastapi import WebSocket
+
+from config import OUTBOX_SIZE, OUTBOX_TTL, JOB_STORE, JOB_POLL_INTERVAL
+from connections import Payload
+
+logger = logging.getLogger(__name__)
+
+SendCallback = Callable[..., Awaitable[None]]  # (websocket, кадр, wait)
+
+
+class Outbox:
+    """Кадры одного клиента: номер, кольцевой буфер, подключённые сокеты"""
+
+    def __init__(self, send: SendCallback, size: int = OUTBOX_SIZE):
+        self.send = send
+        self.seq = 0
+        self.frames: Deque[Payload] = deque(maxlen=size)  # Сериализуются один раз на все вкладки и досылки
+        self.sockets: Set[WebSocket] = set()
+        self.running: Set[str] = set()  # ID запросов, которые ещё выполняются
+        self.updated = time.monotonic()
+
+    async def publish(self, frame: dict):
+        """Кадр всем вкладкам клиента (и в буфер — для тех, кто сейчас отключён)"""
+        self.seq += 1
+        payload = Payload({**frame, "seq": self.seq})
+        self.frames.append(payload)
+        self.updated = time.monotonic()
+        for websocket in list(self.sockets):
+            await self.send(websocket, payload)
+
+    def begin(self, job_id: str):
+        self.running.add(job_id)
+
+    def end(self, job_id: str):
+        self.running.discard(job_id)
+
+    async def attach(self, websocket: WebSocket, epoch: Optional[str], last_seq: Optional[int], own_epoch: str):
+        """
+        Подключение сокета с досылкой пропущенного
+
+        Если номер из другой эпохи (сервер перезапускался) или уже вытеснен из
+        буфера, клиент получает resync и кадры только ещё идущих запросов —
+        завершённые он возьмёт из истории.
+        """
+        oldest = self.frames[0].frame["seq"] if self.frames else self.seq + 1
+        gap = epoch != own_epoch or last_seq is None or last_seq + 1 < oldest or last_seq > self.seq
+
+        if gap:
+            await self.send(websocket, {"type": "resync", "epoch": own_epoch, "seq": self.seq})
+            cursor = 0
+            jobs = set(self.running)
+        else:
+            cursor = last_seq
+            jobs = None
+        started_seq = self.seq
+
+        # Пока досылаем, могут прийти новые кадры — досылаем до тех пор, пока не догоним
+        while True:
+            pending = [
+                payload for payload in self.frames
+                if payload.frame["seq"] > cursor
+                and (jobs is None or payload.frame["seq"] > started_seq or payload.frame.get("id") in jobs)
+            ]
+            if not pending:
+                break
+            for payload in pending:
+                await self.send(websocket, payload, wait=True)
+            cursor = pending[-1].frame["seq"]
+
+        # Между последней проверкой и добавлением нет await — кадры не потеряются
+        self.sockets.add(websocket)
+        self.updated = time.monotonic()
+
+    def detach(self, websocket: WebSocket):
+        self.sockets.discard(websocket)
+        self.updated = time.monotonic()
+
+    @property
+    def idle(self) -> bool:
+        return not self.sockets and not self.running and time.monotonic() - self.updated > OUTBOX_TTL
+
+
+class OutboxRegistry:
+    """Outbox каждого клиента; эпоха меняется при перезапуске сервера"""
+
+    def __init__(self, send: SendCallback):
+        self.send = send
+        self.epoch = uuid.uuid4().hex[:8]
+        self.outboxes: Dict[str, Outbox] = {}
+
+    def get(self, client: str) -> Outbox:
+        outbox = self.outboxes.get(client)
+        if outbox is None:
+            self._cleanup()
+            outbox = self.outboxes[client] = Outbox(self.send)
+        return outbox
+
+    async def attach(self, client: str, websocket: WebSocket, epoch: Optional[str], last_seq: Optional[int]):
+        await self.get(client).attach(websocket, epoch, last_seq, self.epoch)
+
+    def detach(self, client: str, websocket: WebSocket):
+        outbox = self.outboxes.get(client)
+        if outbox:
+            outbox.detach(websocket)
+
+    def _cleanup(self):
+        """Забываем клиентов, которые давно ушли и ничего не ждут"""
+        for client, outbox in list(self.outboxes.items()):
+            if outbox.idle:
+                del self.outboxes[client]
+
+
+class SharedOutbox(Outbox):
+    """
+    Кадры клиента в общем хранилище
+
+    Номер кадра — его id в таблице events, сквозной для всех процессов.
+    Буфер в памяти не нужен: досылка читает хранилище, а раздачу новых
+    кадров сокетам этого процесса делает SharedOutboxRegistry.poll().
+    """
+
+    def __init__(self, client: str, registry: "SharedOutboxRegistry"):
+        super().__init__(registry.send, size=0)
+        self.client = client
+        self.registry = registry
+        self.store = registry.store
+
+    async def publish(self, frame: dict):
+        self.updated = time.monotonic()
+        await asyncio.to_thread(
+            self.store.append_event, self.client, frame.get("id"), frame.get("type"),
+            json.dumps(frame, ensure_ascii=False),
+        )
+        # Свой кадр — сразу, не дожидаясь опроса (вместе с чужими, пришедшими раньше)
+        await self.registry.poll()
+
+    async def deliver(self, payload: Payload):
+        self.seq = payload.frame["seq"]
+        self.updated = time.monotonic()
+        for websocket in list(self.sockets):
+            await self.send(websocket, payload)
+
+    async def attach(self, websocket: WebSocket, epoch: Optional[str], last_seq: Optional[int], own_epoch: str):
+        oldest, newest = await asyncio.to_thread(self.store.client_range, self.client)
+        if oldest is None:
+            oldest = newest + 1
+        gap = epoch != own_epoch or last_seq is None or last_seq + 1 < oldest or last_seq > newest
+
+        if gap:
+            await self.send(websocket, {"type": "resync", "epoch": own_epoch, "seq": newest})
+            cursor = 0
+            jobs = await asyncio.to_thread(self.store.open_jobs, self.client)
+        else:
+            cursor = last_seq
+            jobs = None
+
+        # Досылаем до номера, который registry уже раздал сокетам; если за время
+        # досылки он ушёл вперёд — досылаем и это
+        while True:
+            until = self.registry.cursor
+            rows = await asyncio.to_thread(self.store.client_events, self.client, cursor, until)
+            for seq, job_id, frame in rows:
+                if jobs is None or seq > newest or job_id in jobs:
+                    await self.send(websocket, Payload({**json.loads(frame), "seq": seq}), wait=True)
+            cursor = max(cursor, until)
+            if self.registry.cursor == until:
+                break
+
+        # Между последней проверкой и добавлением нет await — кадры не потеряются
+        self.sockets.add(websocket)
+        self.updated = time.monotonic()
+
+
+class SharedOutboxRegistry(OutboxRegistry):
+    """Outbox клиентов поверх общего хранилища; эпоха — эпоха хранилища"""
+
+    def __init__(self, send: SendCallback, store, poll_interval: float = JOB_POLL_INTERVAL):
+        super().__init__(send)
+        self.store = store
+        self.epoch = store.epoch
+        self.poll_interval = poll_interval
+        self.cursor = store.last_event()  # Кадры до запуска процесса раздавать некому
+        self._lock = asyncio.Lock()
+        self._poller: Optional[asyncio.Task] = None
+
+    def get(self, client: str) -> Outbox:
+        outbox = self.outboxes.get(client)
+        if outbox is None:
+            self._cleanup()
+            outbox = self.outboxes[client] = SharedOutbox(client, self)
+        if self._poller is None:
+            self._poller = asyncio.create_task(self._poll_loop())
+        return outbox
+
+    async def poll(self):
+        """Новые кадры из хранилища — сокетам этого процесса, строго по номерам"""
+        async with self._lock:
+            while True:
+                rows = await asyncio.to_thread(self.store.events_after, self.cursor)
+                for seq, client, frame in rows:
+                    # Курсор — до раздачи: attach() по нему понимает, что досылать
+                    self.cursor = seq
+                    outbox = self.outboxes.get(client)
+                    if outbox is not None and outbox.sockets:
+                        await outbox.deliver(Payload({**json.loads(frame), "seq": seq}))
+                if len(rows) < 1000:
+                    return
+
+    async def _poll_loop(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.poll()
+            except Exception as e:
+                logger.error(f"Outbox poll failed: {e}")
+
+
+def create_registry(send: SendCallback) -> OutboxRegistry:
+    if JOB_STORE:
+        from job_store import store
+        return SharedOutboxRegistry(send, store)
+    return OutboxRegistry(send)
@@ -0,0 +1,120 @@
+"""
+Накопитель вывода Claude: в памяти до порога, дальше — во временный файл
+Огромные ответы не держим в памяти целиком: пользователю уходит превью,
+а полный текст — файлом (Telegram) или постранично (веб-интерфейс).
+"""
+
+import logging
+import os
+import time
+import uuid
+from typing import List, Optional, TextIO, Tuple
+
+from config import OUTPUTS_DIR, OUTPUT_SPILL_THRESHOLD, OUTPUT_PREVIEW_CHARS, OUTPUT_RETENTION
+
+logger = logging.getLogger(__name__)
+
+
+def output_path(output_id: str) -> Optional[str]:
+    """Путь к сохранённому выводу по ID (None, если ID некорректный или файла нет)"""
+    try:
+        output_id = uuid.UUID(output_id).hex
+    except (TypeError, ValueError):
+        return None
+    path = os.path.join(OUTPUTS_DIR, f"{output_id}.txt")
+    return path if os.path.exists(path) else None
+
+
+def read_page(path: str, offset: int, limit: int) -> Tuple[str, int]:
+    """Кусок файла с байта offset не длиннее limit байт: (текст, смещение следующего куска)"""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read(limit)
+
+    # Не режем UTF-8 символ посередине: отступаем до границы символа
+    for cut in range(len(data), max(len(data) - 4, -1), -1):
+        try:
+            return data[:cut].decode("utf-8"), offset + cut
+        except UnicodeDecodeError:
+            continue
+    return data.decode("utf-8", errors="replace"), offset + len(data)
+
+
+def cleanup_outputs():
+    """Удаление старых сохранённых выводов"""
+    now = time.time()
+    for name in os.listdir(OUTPUTS_DIR):
+        path = os.path.join(OUTPUTS_DIR, name)
+        try:
+            if now - os.path.getmtime(path) > OUTPUT_RETENTION:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+class OutputSpool:
+    """Текст, который сбрасывается на диск, как только превысит порог"""
+
+    def __init__(self, threshold: int = OUTPUT_SPILL_THRESHOLD, preview: int = OUTPUT_PREVIEW_CHARS):
+        self.threshold = threshold
+        self.preview_chars = preview
+        self.size = 0  # Символов записано
+        self.first_write: Optional[float] = None  # Когда пришёл первый текст (time.monotonic)
+        self.id: Optional[str] = None
+        self.path: Optional[str] = None
+        self._parts: List[str] = []
+        self._preview = ""
+        self._file: Optional[TextIO] = None
+
+    @property
+    def spilled(self) -> bool:
+        return self.path is not None
+
+    def write(self, text: str):
+        if not text:
+            return
+        if self.first_write is None:
+            self.first_write = time.monotonic()
+        self.size += len(text)
+
+        if self._file is not None:
+            self._file.write(text)
+            return
+
+        self._parts.append(text)
+        if self.size > self.threshold:
+            self._spill()
+
+    def _spill(self):
+        os.makedirs(OUTPUTS_DIR, exist_ok=True)
+        cleanup_outputs()
+
+        self.id = uuid.uuid4().hex
+        self.path = os.path.join(OUTPUTS_DIR, f"{self.id}.txt")
+        self._file = open(self.path, "w", encoding="utf-8")
+
+        text = "".join(self._parts)
+        self._parts = []
+        self._preview = text[:self.preview_chars]
+        self._file.write(text)
+        logger.info(f"Output spilled to disk: {self.path}")
+
+    def reset(self):
+        """Начать заново (например, пришёл итоговый ответ вместо дельт)"""
+        self.close()
+        if self.path:
+            os.remove(self.path)
+        first_write = self.first_write
+        self.__init__(self.threshold, self.preview_chars)
+        self.first_write = first_write
+
+    def text(self) -> str:
+        """Весь текст, а если он на диске — только превью"""
+        if self.spilled:
+            return self._preview
+        return "".join(self._parts)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,264 @@
+"""
+Кэш ответов Claude на повторяющиеся вопросы (PROMPT_CACHE=1)
+«Что занимает диск», «покажи ошибки nginx» спрашивают по многу раз в день.
+Ответ на такой же вопрос в той же рабочей директории той же моделью, пока
+он свежее PROMPT_CACHE_TTL, отдаётся из кэша — без запуска CLI.
+Ключ: вопрос без лишних пробелов и регистра + модель + директория + размер и
+время изменения путей, которые упомянуты в вопросе (файл изменился — ответ
+устарел). Беседа в ключ не входит: вопрос о состоянии сервера в чате, где уже
+о чём-то говорили, получит тот же ответ, что и в новой беседе. Короткие
+реплики в идущей беседе («продолжай», «а подробнее?») — уточнения к её
+контексту, их мимо кэша. Ответ из кэша запоминается в беседе (Session.cached)
+и передаётся Claude со следующим ходом — беседа не теряет этот обмен.
+Ответ, ради которого Claude вызывал инструменты (команды, правки файлов),
+не сохраняется — такой вопрос был не только на чтение.
+Хранится в SQLite в DATA_DIR: кэш переживает перезапуск и общий у
+бота и всех процессов API. Лишнее вытесняется по давности использования.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from config import (
+    CLAUDE_MODEL, PROMPT_CACHE, PROMPT_CACHE_DB, PROMPT_CACHE_TTL, PROMPT_CACHE_ENTRIES,
+    PROMPT_CACHE_BYTES, PROMPT_CACHE_PATHS, PROMPT_CACHE_MIN_WORDS,
+)
+from claude_runner import ClaudeResult
+from metrics import CACHE_REQUESTS, CACHE_SAVED, CACHE_EVICTED, CACHE_ENTRIES, CACHE_BYTES
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,  -- sha256 вопроса, модели, директории и отпечатков путей
+    prompt TEXT NOT NULL,  -- Нормализованный вопрос (для отладки)
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,  -- Байт ответа в UTF-8
+    duration REAL NOT NULL,  -- Сколько шёл исходный запрос
+    created REAL NOT NULL,
+    used REAL NOT NULL,  -- Последнее попадание: по нему вытесняем
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS responses_used ON responses (used);
+CREATE INDEX IF NOT EXISTS responses_created ON responses (created);
+"""
+
+PUNCTUATION = "\"'`«»“”()[]{}<>,;:!?"
+EXTENSION_RE = re.compile(r"^[\w.-]+\.[A-Za-z0-9]{1,10}$")  # error.log, nginx.conf
+# С этих слов начинаются реплики, которые без контекста беседы не имеют смысла
+FOLLOW_UP_WORDS = {"а", "и", "но", "ещё", "еще", "теперь", "тогда", "продолжай", "дальше", "подробнее",
+                   "and", "but", "also", "now", "then", "continue", "more"}
+
+
+def normalize(prompt: str) -> str:
+    """«  Что занимает   диск? » и «что занимает диск» — один вопрос"""
+    return " ".join(prompt.split()).casefold().rstrip(".?! ")
+
+
+def standalone(prompt: str, min_words: int = PROMPT_CACHE_MIN_WORDS) -> bool:
+    """Вопрос понятен без контекста беседы: не короче min_words слов и не начинается с «а», «теперь»…"""
+    words = normalize(prompt).split()
+    return len(words) >= min_words and words[0] not in FOLLOW_UP_WORDS
+
+
+def mentioned_paths(prompt: str, cwd: str, limit: int = PROMPT_CACHE_PATHS) -> List[str]:
+    """Существующие пути, упомянутые в вопросе: /var/log/nginx/error.log, ~/app, ./config.py, error.log"""
+    paths = []
+    for word in prompt.split():
+        word = word.strip(PUNCTUATION).rstrip(".")
+        if not word or not ("/" in word or word.startswith("~") or EXTENSION_RE.match(word)):
+            continue
+        path = os.path.normpath(os.path.join(cwd, os.path.expanduser(word)))
+        if path not in paths and os.path.exists(path):
+            paths.append(path)
+            if len(paths) >= limit:
+                break
+    return paths
+
+
+def fingerprint(path: str) -> Tuple[str, int, int]:
+    """Путь, размер и время изменения (у каталога меняется, когда в нём создают и удаляют)"""
+    try:
+        st = os.stat(path)
+        return path, st.st_size, st.st_mtime_ns
+    except OSError:
+        return path, -1, 0
+
+
+def cached_note(age: float) -> str:
+    """Пометка под ответом из кэша"""
+    when = f"{age / 60:.0f} мин" if age >= 60 else f"{age:.0f} с"
+    return f"Ответ из кэша ({when} назад), свежий — с `--no-cache` в начале сообщения"
+
+
+def cache_key(prompt: str, cwd: str, model: str) -> str:
+    """Ключ вопроса: один для всех бесед — ответ на самостоятельный вопрос от беседы не зависит"""
+    cwd = os.path.realpath(cwd)
+    paths = [fingerprint(path) for path in sorted(mentioned_paths(prompt, cwd))]
+    return hashlib.sha256(json.dumps([normalize(prompt), model, cwd, paths]).encode()).hexdigest()
+
+
+class PromptCache:
+    """Ответы по ключу с TTL и вытеснением давно не нужных; методы get/put — асинхронные"""
+
+    def __init__(self, path: str = PROMPT_CACHE_DB, enabled: bool = PROMPT_CACHE, ttl: float = PROMPT_CACHE_TTL,
+                 max_entries: int = PROMPT_CACHE_ENTRIES, max_bytes: int = PROMPT_CACHE_BYTES):
+        self.path = path
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._ready = False
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Своё соединение на каждый поток; база создаётся при первом обращении"""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            with self._lock:
+                if not self._ready:
+                    db.executescript(SCHEMA)
+                    self._ready = True
+            self._local.db = db
+        return db
+
+    # Асинхронный интерфейс для bot.py и api.py
+
+    async def get(self, prompt: str, cwd: str, fresh: bool, model: str = CLAUDE_MODEL,
+                  bypass: bool = False) -> Tuple[Optional[str], Optional[ClaudeResult]]:
+        """
+        (ключ, ответ из кэша или None); ключ нужен put() после запроса
+        Вызывается в задаче очереди беседы: fresh (Session.fresh) должен
+        описывать ход, который сейчас пойдёт в CLI, а не тот, что был в момент
+        постановки в очередь. Кэш выключен или в идущей беседе короткая
+        реплика-уточнение (см. standalone) — (None, None), ответ не сохранится.
+        bypass (--no-cache) — ответ не ищется, но свежий ответ Claude сохранится.
+        """
+        if not self.enabled:
+            return None, None
+        if not fresh and not standalone(prompt):
+            CACHE_REQUESTS.inc(result="follow_up")
+            return None, None
+        started = time.monotonic()
+        key = await asyncio.to_thread(cache_key, prompt, cwd, model)
+        if bypass:
+            CACHE_REQUESTS.inc(result="bypass")
+            return key, None
+        try:
+            row = await asyncio.to_thread(self._get, key)
+        except sqlite3.Error as e:
+            # Кэш — только ускорение: без него запрос просто идёт к Claude
+            logger.error(f"Prompt cache lookup failed: {e}")
+            row = None
+        if row is None:
+            CACHE_REQUESTS.inc(result="miss")
+            return key, None
+
+        response, duration, created = row
+        CACHE_REQUESTS.inc(result="hit")
+        CACHE_SAVED.inc(duration)
+        return key, ClaudeResult(
+            response, "", 0, False, time.monotonic() - started, cached=time.time() - created,
+        )
+
+    async def put(self, key: Optional[str], prompt: str, cwd: str, result: ClaudeResult, model: str = CLAUDE_MODEL):
+        """Сохраняем полный успешный ответ без инструментов, если пути из вопроса за время запроса не изменились"""
+        if key is None or not self.cacheable(result):
+            return
+        # Упомянутый файл поменялся (в том числе не Claude) — ответ уже устарел
+        if await asyncio.to_thread(cache_key, prompt, cwd, model) != key:
+            return
+        try:
+            await asyncio.to_thread(self._put, key, normalize(prompt), result.stdout, result.duration)
+        except sqlite3.Error as e:
+            logger.error(f"Prompt cache store failed: {e}")
+
+    @staticmethod
+    def cacheable(result: ClaudeResult) -> bool:
+        # returncode None без таймаута — ответ постоянного процесса (CLAUDE_PERSISTENT), он жив
+        finished = result.returncode == 0 or (result.returncode is None and not result.timed_out)
+        # tool_use None — вывод текстом (CLAUDE_STREAM=0), о командах Claude ничего не известно
+        return (finished and not result.timed_out and not result.truncated and not result.spilled
+                and result.tool_use is False and result.cached is None and bool(result.stdout.strip()))
+
+    # Работа с базой (в потоке)
+
+    def _get(self, key: str) -> Optional[Tuple[str, float, float]]:
+        db = self._connect()
+        now = time.time()
+        row = db.execute("SELECT response, duration, created FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if row[2] < now - self.ttl:
+            db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            CACHE_EVICTED.inc(reason="ttl")
+            return None
+        db.execute("UPDATE responses SET used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+        return row
+
+    def _put(self, key: str, prompt: str, response: str, duration: float):
+        size = len(response.encode())
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute(
+                "INSERT OR REPLACE INTO responses (key, prompt, response, size, duration, created, used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, prompt, response, size, duration, now, now),
+            )
+            expired = db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,)).rowcount
+            if expired:
+                CACHE_EVICTED.inc(expired, reason="ttl")
+            entries, total = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            if entries > self.max_entries or total > self.max_bytes:
+                # Давно не нужные — первыми, пока не уложимся в оба лимита
+                evicted = 0
+                for old_key, old_size in db.execute("SELECT key, size FROM responses ORDER BY used").fetchall():
+                    if entries <= self.max_entries and total <= self.max_bytes:
+                        break
+                    db.execute("DELETE FROM responses WHERE key = ?", (old_key,))
+                    entries -= 1
+                    total -= old_size
+                    evicted += 1
+                CACHE_EVICTED.inc(evicted, reason="lru")
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        CACHE_ENTRIES.set(entries)
+        CACHE_BYTES.set(total)
+
+    def clear(self) -> int:
+        """Очистить кэш; сколько ответов удалено"""
+        removed = self._connect().execute("DELETE FROM responses").rowcount
+        CACHE_ENTRIES.set(0)
+        CACHE_BYTES.set(0)
+        return removed
+
+    def stats(self) -> Tuple[int, int]:
+        """(ответов, байт) в кэше сейчас"""
+        entries, total = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        CACHE_ENTRIES.set(entries)
+        CACHE_BYTES.set(total)
+        return entries, total
+
+
+# Один кэш на процесс (база общая для всех процессов)
+prompt_cache = PromptCache()
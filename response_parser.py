@@ -0,0 +1,175 @@
+"""
+Разбор ответа Claude за один проход
+Убирает служебные строки CLI, выделяет все блоки кода с языком и отдаёт
+сегменты, из которых bot.py и api.py собирают ответ. Текст можно подавать
+кусками по мере генерации.
+"""
+
+import re
+from dataclasses import dataclass, asdict
+from functools import lru_cache
+from typing import List, Optional, Pattern
+
+from config import TELEGRAM_MESSAGE_LIMIT
+
+# Строки, которые разбираются отдельно: забор блока кода или служебная строка CLI
+SPECIAL_LINE_RE = re.compile(
+    r"^(?:[ \t]*(?P<fence>`{3,}|~{3,})(?P<info>.*)|\[.*|Using model.*)$", re.MULTILINE
+)
+
+
+@lru_cache(maxsize=None)
+def _closing_fence(char: str, length: int) -> Pattern:
+    """Закрывающий забор: те же символы, не короче открывающего, без текста после"""
+    return re.compile(rf"^[ \t]*{re.escape(char)}{{{length},}}[ \t]*$", re.MULTILINE)
+
+
+@dataclass
+class Segment:
+    """Кусок ответа: обычный текст или блок кода"""
+    kind: str  # "text" | "code"
+    content: str
+    language: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class ResponseParser:
+    """Потоковый разбор: feed() по кускам, close() в конце"""
+
+    def __init__(self):
+        self.segments: List[Segment] = []
+        self._tail = ""  # Незаконченная строка из прошлого куска
+        self._parts: List[str] = []  # Текст текущего сегмента (куски со своими переводами строк)
+        self._fence: Optional[Pattern] = None  # Закрывающий забор текущего блока кода
+        self._language: Optional[str] = None
+        self._noise: List[str] = []  # Отброшенные строки — на случай, если кроме них ничего нет
+
+    def feed(self, chunk: str) -> List[Segment]:
+        """Новый кусок ответа, возвращает завершённые им сегменты"""
+        done = len(self.segments)
+        text = self._tail + chunk
+        cut = text.rfind("\n") + 1
+        self._tail = text[cut:]
+        if cut:
+            self._scan(text[:cut])
+        return self.segments[done:]
+
+    def close(self) -> List[Segment]:
+        """Конец ответа: дописываем хвост, незакрытый блок кода считаем закрытым"""
+        if self._tail:
+            self._scan(self._tail)
+            self._tail = ""
+        self._flush()
+
+        if not self.segments and self._noise:
+            # Ответ целиком из "служебных" строк — показываем как есть
+            self.segments.append(Segment("text", "\n".join(self._noise).strip()))
+        return self.segments
+
+    def _scan(self, text: str):
+        """Разбор целых строк: обычный текст копируется срезами, построчно — только особые строки"""
+        parts = self._parts
+        special = SPECIAL_LINE_RE.search
+        pos = 0
+        end = len(text)
+        while pos < end:
+            if self._fence is not None:
+                match = self._fence.search(text, pos)
+                if match is None:
+                    parts.append(text[pos:])
+                    return
+                parts.append(text[pos:match.start()])
+                self._flush()
+                self._fence = None
+                self._language = None
+            else:
+                match = special(text, pos)
+                if match is None:
+                    parts.append(text[pos:])
+                    return
+                parts.append(text[pos:match.start()])
+                fence = match.group("fence")
+                if fence:
+                    self._flush()
+                    self._fence = _closing_fence(fence[0], len(fence))
+                    self._language = match.group("info").strip().split(" ")[0] or None
+                else:
+                    self._noise.append(match.group(0))
+            pos = match.end() + 1  # Вместе с переводом строки
+
+    def _flush(self):
+        """Закрытие текущего сегмента"""
+        content = "".join(self._parts)
+        self._parts.clear()
+        if self._fence is not None:
+            content = content[:-1] if content.endswith("\n") else content
+            if content.strip():
+                self.segments.append(Segment("code", content, self._language))
+        else:
+            content = content.strip()
+            if content:
+                self.segments.append(Segment("text", content))
+
+
+def parse_response(text: str) -> List[Segment]:
+    """Разбор готового ответа целиком"""
+    parser = ResponseParser()
+    parser.feed(text)
+    return parser.close()
+
+
+def plain_text(segments: List[Segment]) -> str:
+    """Ответ без блоков кода"""
+    return "\n\n".join(s.content for s in segments if s.kind == "text")
+
+
+def _fenced(content: str, language: Optional[str]) -> str:
+    return f"```{language or ''}\n{content}\n```"
+
+
+def split_text(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """Части не длиннее limit, по возможности по строкам"""
+    # Идём по смещениям, а не срезаем остаток: иначе на огромном тексте квадратичное время
+    parts = []
+    start = 0
+    while len(text) - start > limit:
+        cut = text.rfind("\n", start, start + limit)
+        if cut <= start:
+            cut = start + limit
+        parts.append(text[start:cut])
+        start = cut
+        while start < len(text) and text[start] == "\n":
+            start += 1
+    parts.append(text[start:])
+    return parts
+
+
+def render_markdown(segments: List[Segment], limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """
+    Сообщения Telegram не длиннее limit
+
+    Режем только между сегментами или по строкам внутри них; блок кода,
+    не влезающий в сообщение, делится на несколько блоков со своими заборами.
+    """
+    pieces = []
+    for segment in segments:
+        if segment.kind == "code":
+            overhead = len(_fenced("", segment.language))
+            for part in split_text(segment.content, limit - overhead):
+                pieces.append(_fenced(part, segment.language))
+        else:
+            pieces.extend(split_text(segment.content, limit))
+
+    messages: List[str] = []
+    current = ""
+    for piece in pieces:
+        if current and len(current) + 2 + len(piece) <= limit:
+            current += "\n\n" + piece
+        else:
+            if current:
+                messages.append(current)
+            current = piece
+    messages.append(current)
+    return messages
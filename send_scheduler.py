@@ -0,0 +1,170 @@
+"""
+Планировщик исходящих запросов бота к Telegram
+Все отправки, правки и удаления идут через middleware сессии бота:
+токен-бакеты на чат и общий, повтор после 429 (retry_after) и
+схлопывание правок одного сообщения, которые устарели, не дождавшись очереди.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import EditMessageText, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+from config import (
+    TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST, TELEGRAM_GROUP_RATE,
+    TELEGRAM_GLOBAL_RATE, TELEGRAM_RETRY_ATTEMPTS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """rate токенов в секунду, не больше burst в запасе"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0  # Telegram попросил подождать (retry_after)
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Сколько ждать до свободного токена"""
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def take(self):
+        self.tokens -= 1
+
+    def refund(self):
+        self.tokens = min(self.burst, self.tokens + 1)
+
+    def block(self, seconds: float):
+        """После паузы начинаем с пустого бакета, без залпа накопленных токенов"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+        self.updated = self.blocked_until
+
+    @property
+    def idle(self) -> bool:
+        return self.delay(time.monotonic()) == 0 and self.tokens >= self.burst
+
+
+class ChatState:
+    """Очередь запросов одного чата (Lock в asyncio отдаёт очередь по порядку)"""
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+
+class SendScheduler(BaseRequestMiddleware):
+    """Middleware для bot.session: темп отправки в рамках лимитов Telegram"""
+
+    def __init__(
+        self,
+        chat_rate: float = TELEGRAM_CHAT_RATE,
+        chat_burst: float = TELEGRAM_CHAT_BURST,
+        group_rate: float = TELEGRAM_GROUP_RATE,
+        global_rate: float = TELEGRAM_GLOBAL_RATE,
+        attempts: int = TELEGRAM_RETRY_ATTEMPTS,
+    ):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.attempts = attempts
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chats: Dict[int, ChatState] = {}
+        self.edits: Dict[Tuple[int, int], EditMessageText] = {}  # Последняя правка каждого сообщения
+        self.merged = 0  # Правок пропущено, потому что пришла более свежая
+        self.retried = 0  # Повторов после 429
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> TelegramType:
+        chat_id = getattr(method, "chat_id", None)
+        if not isinstance(chat_id, int):
+            # getUpdates, getFile и т.п. не ограничиваем
+            return await make_request(bot, method)
+
+        edit_key = self._edit_key(method)
+        if edit_key:
+            self.edits[edit_key] = method
+
+        state = self._chat(chat_id)
+        state.users += 1
+        try:
+            async with state.lock:
+                return await self._send(make_request, bot, method, state, edit_key)
+        finally:
+            state.users -= 1
+            if edit_key and self.edits.get(edit_key) is method:
+                del self.edits[edit_key]
+            if state.users == 0 and state.bucket.idle:
+                self.chats.pop(chat_id, None)
+
+    async def _send(self, make_request, bot: Bot, method: TelegramMethod, state: ChatState,
+                    edit_key: Optional[Tuple[int, int]]):
+        for attempt in range(self.attempts + 1):
+            await self._wait(state.bucket)
+
+            if edit_key and self.edits.get(edit_key) is not method:
+                # Пока ждали, пришла более свежая правка этого сообщения — эта уже не нужна
+                self.global_bucket.refund()
+                state.bucket.refund()
+                self.merged += 1
+                return True
+
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == self.attempts:
+                    raise
+                self.retried += 1
+                logger.warning(f"Telegram flood control: chat {method.chat_id}, retry after {e.retry_after}s")
+                state.bucket.block(e.retry_after)
+
+    async def _wait(self, bucket: Optional[TokenBucket]):
+        """Ждём токен и в бакете чата, и в общем"""
+        while True:
+            now = time.monotonic()
+            wait = self.global_bucket.delay(now)
+            if bucket is not None:
+                wait = max(wait, bucket.delay(now))
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+
+        self.global_bucket.take()
+        if bucket is not None:
+            bucket.take()
+
+    def _chat(self, chat_id: int) -> ChatState:
+        state = self.chats.get(chat_id)
+        if state is None:
+            # Отрицательный ID — группа или канал: там лимит строже
+            rate = self.group_rate if chat_id < 0 else self.chat_rate
+            state = self.chats[chat_id] = ChatState(TokenBucket(rate, self.chat_burst))
+        return state
+
+    @staticmethod
+    def _edit_key(method: TelegramMethod) -> Optional[Tuple[int, int]]:
+        if isinstance(method, EditMessageText) and method.message_id is not None:
+            return method.chat_id, method.message_id
+        return None
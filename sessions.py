@@ -0,0 +1,237 @@
+"""
+Реестр бесед Claude
+У каждого чата Telegram и каждого браузера своя беседа, плюс именованные беседы.
+Беседа передаётся в CLI через --session-id / --resume, реестр хранится на диске.
+Ответы из кэша (prompt_cache) CLI не видел: беседа хранит их и передаёт
+Claude в начале следующего хода, чтобы «а что из этого можно удалить?»
+после ответа из кэша понималось правильно.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict, field
+from typing import Dict, List, Optional
+
+from config import SESSIONS_FILE, SESSION_CACHED_TURNS, SESSION_CACHED_CHARS
+from claude_runner import ClaudeResult, run_claude
+
+logger = logging.getLogger(__name__)
+
+# Допустимые имена именованных бесед
+SESSION_NAME_RE = re.compile(r"^[\w.-]{1,40}$")
+
+
+@dataclass
+class Session:
+    """Одна беседа Claude"""
+    name: str
+    id: str  # UUID беседы в Claude CLI
+    created: float
+    started: bool = False  # Беседа уже существует в CLI (было хотя бы одно сообщение)
+    parent: Optional[str] = None  # ID беседы-источника для форка
+    cached: List[Dict[str, str]] = field(default_factory=list)  # Ответы из кэша, которых CLI ещё не видел
+
+    @property
+    def fresh(self) -> bool:
+        """Следующий ход — первый в новой беседе, без чужого контекста"""
+        return not self.started and not self.parent and not self.cached
+
+    def cli_args(self) -> List[str]:
+        """Аргументы CLI для продолжения этой беседы"""
+        if self.started:
+            return ["--resume", self.id]
+        if self.parent:
+            return ["--resume", self.parent, "--fork-session", "--session-id", self.id]
+        return ["--session-id", self.id]
+
+
+def with_cached_turns(prompt: str, turns: List[Dict[str, str]]) -> str:
+    """Промпт для CLI: сначала ответы из кэша, которые были в беседе после прошлого хода"""
+    lines = ["Ранее в этой беседе были ответы из кэша (ты их не видел):"]
+    for turn in turns:
+        lines += ["", f"Вопрос: {turn['prompt']}", f"Ответ: {turn['response']}"]
+    lines += ["", "Новый вопрос:", prompt]
+    return "\n".join(lines)
+
+
+class SessionRegistry:
+    """Беседы и активная беседа каждого клиента (tg:<chat_id>, ws:<client_id>)"""
+
+    def __init__(self, path: str = SESSIONS_FILE):
+        self.path = path
+        self.sessions: Dict[str, Session] = {}
+        self.clients: Dict[str, str] = {}  # Клиент -> имя активной беседы
+        self._stamp = None  # (mtime_ns, inode) прочитанного файла
+        self._lock_depth = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._load()
+
+    def _load(self):
+        """Перечитываем файл, если его изменил другой процесс (бот или API)"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        # Запись идёт через rename — новый файл виден по inode, даже если mtime совпал
+        stamp = (stat.st_mtime_ns, stat.st_ino)
+        if stamp == self._stamp:
+            return
+
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Error loading sessions: {e}")
+            return
+
+        self.sessions = {name: Session(**item) for name, item in data.get("sessions", {}).items()}
+        self.clients = data.get("clients", {})
+        self._stamp = stamp
+
+    @contextmanager
+    def _locked(self):
+        """
+        Чтение-изменение-запись под блокировкой файла
+        Реестр меняют бот и все процессы API — без неё одна запись затёрла бы другую
+        """
+        if self._lock_depth:
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+            return
+        with open(f"{self.path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self._lock_depth = 1
+            try:
+                self._load()
+                yield
+            finally:
+                self._lock_depth = 0
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def save(self):
+        """Атомарная запись: временный файл + rename"""
+        data = {
+            "sessions": {name: asdict(session) for name, session in self.sessions.items()},
+            "clients": self.clients,
+        }
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+        stat = os.stat(self.path)
+        self._stamp = (stat.st_mtime_ns, stat.st_ino)
+
+    def _new(self, name: str, parent: Optional[str] = None) -> Session:
+        session = Session(name=name, id=str(uuid.uuid4()), created=time.time(), parent=parent)
+        self.sessions[name] = session
+        return session
+
+    def active(self, client: str) -> Session:
+        """Активная беседа клиента (по умолчанию — личная беседа с именем клиента)"""
+        self._load()
+        name = self.clients.get(client, client)
+        session = self.sessions.get(name)
+        if session is None:
+            with self._locked():
+                name = self.clients.get(client, client)
+                session = self.sessions.get(name)
+                if session is None:
+                    session = self._new(name)
+                    self.clients[client] = name
+                    self.save()
+        return session
+
+    def get(self, name: str) -> Optional[Session]:
+        self._load()
+        return self.sessions.get(name)
+
+    def list(self) -> List[Session]:
+        self._load()
+        return sorted(self.sessions.values(), key=lambda s: s.created)
+
+    def switch(self, client: str, name: str) -> Session:
+        """Переключение на беседу name (создаётся, если её нет)"""
+        with self._locked():
+            session = self.sessions.get(name) or self._new(name)
+            self.clients[client] = name
+            self.save()
+        return session
+
+    def create(self, client: str, name: str) -> Session:
+        """Новая пустая беседа; ValueError, если имя занято"""
+        with self._locked():
+            if name in self.sessions:
+                raise ValueError(f"Беседа {name} уже существует")
+            session = self._new(name)
+            self.clients[client] = name
+            self.save()
+        return session
+
+    def fork(self, client: str, name: str) -> Session:
+        """Копия активной беседы клиента под новым именем"""
+        with self._locked():
+            if name in self.sessions:
+                raise ValueError(f"Беседа {name} уже существует")
+            source = self.active(client)
+            # Пустую беседу копировать нечего — просто новая
+            session = self._new(name, parent=source.id if source.started else None)
+            session.cached = list(source.cached)
+            self.clients[client] = name
+            self.save()
+        return session
+
+    def mark_started(self, session: Session, session_id: Optional[str] = None, delivered: int = 0):
+        """
+        После первого ответа беседа существует в CLI (CLI мог выдать свой ID)
+        delivered — сколько ответов из кэша ушло в CLI с этим ходом.
+        """
+        with self._locked():
+            current = self.sessions.get(session.name)
+            if current is None or current.id != session.id:
+                return
+            current.started = True
+            current.parent = None
+            if session_id:
+                current.id = session_id
+            del current.cached[:delivered]
+            self.save()
+
+    def remember_cached(self, name: str, prompt: str, response: str):
+        """Ответ из кэша — в беседу, чтобы Claude узнал о нём со следующим ходом"""
+        with self._locked():
+            session = self.sessions.get(name) or self._new(name)
+            session.cached.append({"prompt": prompt, "response": response[:SESSION_CACHED_CHARS]})
+            del session.cached[:-SESSION_CACHED_TURNS]
+            self.save()
+
+    async def ask(self, name: str, prompt: str, **kwargs) -> ClaudeResult:
+        """Запрос к Claude в беседе name (состояние беседы берётся на момент запуска)"""
+        session = self.get(name)
+        if session is None:
+            with self._locked():
+                session = self.sessions.get(name) or self._new(name)
+                self.save()
+
+        turns = list(session.cached)
+        if turns:
+            prompt = with_cached_turns(prompt, turns)
+        result = await run_claude(prompt, session=session.name, session_args=session.cli_args(), **kwargs)
+
+        # Беседа создана в CLI, если он вернул её ID или отработал без ошибки
+        finished = result.returncode == 0 or (result.returncode is None and not result.timed_out)
+        if result.session_id or finished:
+            self.mark_started(session, result.session_id, delivered=len(turns))
+        return result
+
+
+# Беседы: у каждого клиента своя, плюс именованные
+registry = SessionRegistry()
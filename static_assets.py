@@ -0,0 +1,159 @@
+"""
+Статика веб-интерфейса: сжатие при старте, ETag, хешированные URL
+Файлы webapp/ читаются один раз при запуске api.py и держатся в памяти
+вместе с brotli- и gzip-версиями. Стили и скрипт отдаются по адресам с хешем
+содержимого (/static/app.3f2a9c1b.css) и кэшируются браузером навсегда;
+страница и service worker — с проверкой по ETag (304, если не изменились).
+Изменения в webapp/ видны после перезапуска api.py.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:  # Без пакета Brotli — только gzip
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+PAGE = "index.html"  # Оболочка интерфейса, отдаётся на /
+SERVICE_WORKER = "sw.js"  # Отдаётся на /sw.js: область действия — весь сайт
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"  # Кэшировать можно, но перед показом — проверка по ETag
+MIN_COMPRESS = 512  # Мелкие файлы сжимать незачем
+TEXT_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+
+class Asset:
+    """Файл в памяти: исходник и сжатые версии, у каждой свой ETag"""
+
+    def __init__(self, body: bytes, media_type: str, cache_control: str):
+        self.digest = hashlib.sha256(body).hexdigest()
+        self.media_type = media_type
+        self.cache_control = cache_control
+        self.variants: Dict[str, bytes] = {"identity": body}
+        if len(body) >= MIN_COMPRESS and media_type.startswith(TEXT_TYPES):
+            if brotli is not None:
+                self.variants["br"] = brotli.compress(body, quality=11, mode=brotli.MODE_TEXT)
+            self.variants["gzip"] = gzip.compress(body, compresslevel=9, mtime=0)
+            # Сжатие, которое не помогло, не отдаём
+            for encoding in ("br", "gzip"):
+                if encoding in self.variants and len(self.variants[encoding]) >= len(body):
+                    del self.variants[encoding]
+
+    def etag(self, encoding: str) -> str:
+        # Строгий ETag различается у сжатых версий: это разные байты
+        suffix = "" if encoding == "identity" else f"-{encoding}"
+        return f'"{self.digest[:16]}{suffix}"'
+
+    def select(self, accept_encoding: Optional[str]) -> Tuple[str, bytes]:
+        """Лучшая версия из принимаемых клиентом: brotli, потом gzip, потом исходник"""
+        accepted = parse_accept_encoding(accept_encoding)
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and encoding in accepted:
+                return encoding, self.variants[encoding]
+        return "identity", self.variants["identity"]
+
+
+def parse_accept_encoding(header: Optional[str]) -> List[str]:
+    """Кодировки из Accept-Encoding, кроме запрещённых через q=0"""
+    accepted = []
+    for item in (header or "").split(","):
+        name, _, params = item.strip().partition(";")
+        quality = params.strip()
+        if quality.startswith("q="):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if name:
+            accepted.append(name.strip().lower())
+    return accepted
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match (список или *) совпадает с ETag; сравнение слабое, как велит RFC 9110"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def media_type(name: str) -> str:
+    """Тип для Content-Type (charset к text/* добавит Starlette)"""
+    if name.endswith(".js"):
+        return "text/javascript"
+    return mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+
+def hashed_name(name: str, digest: str) -> str:
+    """app.js → app.3f2a9c1b.js"""
+    root, ext = os.path.splitext(name)
+    return f"{root}.{digest[:8]}{ext}"
+
+
+class StaticAssets:
+    """Сборка webapp/ при старте и поиск файла по URL"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.assets: Dict[str, Asset] = {}  # URL -> файл
+        self.version: Optional[str] = None
+
+    def build(self):
+        """Читаем, хешируем и сжимаем; адреса файлов подставляем в страницу и service worker"""
+        sources: Dict[str, bytes] = {}
+        for directory, dirs, files in os.walk(self.directory):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for filename in files:
+                if filename.startswith("."):
+                    continue
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, self.directory).replace(os.sep, "/")
+                with open(path, "rb") as f:
+                    sources[name] = f.read()
+
+        assets: Dict[str, Asset] = {}
+        urls: Dict[str, str] = {}  # /static/app.js -> /static/app.3f2a9c1b.js
+        for name, body in sources.items():
+            if name in (PAGE, SERVICE_WORKER):
+                continue
+            asset = Asset(body, media_type(name), IMMUTABLE)
+            hashed = f"/static/{hashed_name(name, asset.digest)}"
+            urls[f"/static/{name}"] = hashed
+            assets[hashed] = asset
+            # По старому адресу тоже отдаём, но с проверкой
+            assets[f"/static/{name}"] = Asset(body, asset.media_type, REVALIDATE)
+
+        if PAGE in sources:
+            page = sources[PAGE].decode()
+            for url, hashed in urls.items():
+                page = page.replace(f'"{url}"', f'"{hashed}"')
+            assets["/"] = Asset(page.encode(), media_type(PAGE), REVALIDATE)
+
+        # Версия — от содержимого всего интерфейса: поменялся файл — service worker обновит кэш
+        digests = sorted(asset.digest for asset in assets.values())
+        self.version = hashlib.sha256("".join(digests).encode()).hexdigest()[:12]
+        if SERVICE_WORKER in sources:
+            shell = (["/"] if "/" in assets else []) + sorted(urls.values())
+            worker = sources[SERVICE_WORKER].decode()
+            worker = worker.replace("__VERSION__", self.version).replace("__SHELL__", json.dumps(shell))
+            assets["/sw.js"] = Asset(worker.encode(), media_type(SERVICE_WORKER), REVALIDATE)
+
+        self.assets = assets
+        original = sum(len(body) for body in sources.values())
+        compressed = sum(min(len(body) for body in asset.variants.values())
+                         for url, asset in assets.items() if url not in urls)
+        logger.info(f"Static assets {self.version}: {len(sources)} files, {original // 1024} KB → "
+                    f"{compressed // 1024} KB compressed{'' if brotli else ' (gzip only, no brotli)'}")
+
+    def get(self, url: str) -> Optional[Asset]:
+        return self.assets.get(url)
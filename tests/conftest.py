@@ -0,0 +1,29 @@
+"""
+Общая настройка тестов: каталоги бота — во временной директории
+
+Модули создают хранилища при импорте (history, blob_store, job_store),
+поэтому переменные окружения задаются до первого импорта кода бота.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASE = tempfile.mkdtemp(prefix="claude-tests-")
+
+os.environ["CLAUDE_DATA_DIR"] = os.path.join(BASE, "data")
+os.environ["CLAUDE_FILES_DIR"] = os.path.join(BASE, "files")
+os.environ["CLAUDE_WORK_DIR"] = os.path.join(BASE, "work")
+os.environ.setdefault("CLAUDE_BOT_TOKEN", "1:test")
+for name in ("data", "files", "work"):
+    os.makedirs(os.path.join(BASE, name), exist_ok=True)
+
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def run(coro):
+    """Корутина в новом event loop (тесты без pytest-asyncio)"""
+    return asyncio.run(coro)
@@ -0,0 +1,110 @@
+"""Range: разбор заголовка и ответы /files/download (206, 416, If-Range, 304)"""
+
+import os
+import tempfile
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+import api
+from archives import parse_range
+from conftest import run
+
+DATA = bytes(range(256)) * 4  # 1024 байта
+
+
+def test_parse_range():
+    assert parse_range(None, 100) is None
+    assert parse_range("bytes=0-9", 100) == (0, 10)
+    assert parse_range("bytes=90-", 100) == (90, 100)
+    assert parse_range("bytes=90-500", 100) == (90, 100)
+    assert parse_range("bytes=-30", 100) == (70, 100)
+    assert parse_range("bytes=-500", 100) == (0, 100)
+    # Несколько диапазонов и мусор — отдаём файл целиком
+    assert parse_range("bytes=0-1,5-6", 100) is None
+    assert parse_range("bytes=-", 100) is None
+    assert parse_range("items=0-1", 100) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=100-200", "bytes=5-4", "bytes=-0"])
+def test_parse_range_outside_file(header):
+    with pytest.raises(ValueError):
+        parse_range(header, 100)
+
+
+@pytest.fixture
+def public_file():
+    directory = tempfile.mkdtemp(dir=os.environ["CLAUDE_FILES_DIR"])
+    path = os.path.join(directory, "backup.bin")
+    with open(path, "wb") as f:
+        f.write(DATA)
+    return path
+
+
+def make_request(**headers) -> Request:
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "path": "/files/download",
+        "query_string": b"",
+        "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()],
+    })
+
+
+async def download(path: str, **headers):
+    response = await api.download_file(make_request(**headers), path)
+    body = b""
+    if hasattr(response, "body_iterator"):
+        async for chunk in response.body_iterator:
+            body += chunk
+    return response, body
+
+
+def test_full_file(public_file):
+    response, body = run(download(public_file))
+    assert response.status_code == 200
+    assert body == DATA
+    assert response.headers["content-length"] == str(len(DATA))
+    assert response.headers["accept-ranges"] == "bytes"
+
+
+def test_range(public_file):
+    response, body = run(download(public_file, range="bytes=100-199"))
+    assert response.status_code == 206
+    assert body == DATA[100:200]
+    assert response.headers["content-range"] == f"bytes 100-199/{len(DATA)}"
+    assert response.headers["content-length"] == "100"
+
+
+def test_range_outside_file(public_file):
+    response, _ = run(download(public_file, range=f"bytes={len(DATA)}-"))
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(DATA)}"
+
+
+def test_if_range_and_if_none_match(public_file):
+    etag = run(download(public_file))[0].headers["etag"]
+
+    response, body = run(download(public_file, range="bytes=0-9", if_range=etag))
+    assert (response.status_code, body) == (206, DATA[:10])
+
+    # Файл изменился с прошлой докачки — весь файл
+    response, body = run(download(public_file, range="bytes=0-9", if_range='"old"'))
+    assert (response.status_code, body) == (200, DATA)
+
+    response, _ = run(download(public_file, if_none_match=etag))
+    assert response.status_code == 304
+
+
+def test_paths_outside_files_dir_are_not_served(public_file):
+    outside = os.path.join(tempfile.mkdtemp(dir=os.environ["CLAUDE_WORK_DIR"]), "secret.txt")
+    with open(outside, "w") as f:
+        f.write("secret")
+    link = os.path.join(os.path.dirname(public_file), "link.txt")
+    os.symlink(outside, link)
+
+    for path in (outside, link, os.path.join(os.path.dirname(public_file), "..", "..", "work")):
+        with pytest.raises(HTTPException) as error:
+            run(download(path))
+        assert error.value.status_code == 404
@@ -0,0 +1,86 @@
+"""BlobStore: одна копия содержимого, проверка хеша по размеру и времени, правка на месте"""
+
+import hashlib
+import os
+import tempfile
+
+import pytest
+
+import blob_store
+from blob_store import BlobStore
+
+DATA = b"server { listen 80; }\n" * 100
+SHA256 = hashlib.sha256(DATA).hexdigest()
+
+
+@pytest.fixture
+def store():
+    return BlobStore(tempfile.mkdtemp(dir=os.environ["CLAUDE_FILES_DIR"]))
+
+
+@pytest.fixture
+def hashed(monkeypatch):
+    """Пути, для которых считался хеш"""
+    paths = []
+    original = blob_store.file_sha256
+
+    def counting(path):
+        paths.append(path)
+        return original(path)
+
+    monkeypatch.setattr(blob_store, "file_sha256", counting)
+    return paths
+
+
+def upload(store: BlobStore, name: str, data: bytes = DATA):
+    path = store.temp_path(name)
+    with open(path, "wb") as f:
+        f.write(data)
+    return store.put_file(path, name)
+
+
+def test_same_content_is_stored_once(store):
+    first, sha256, existed = upload(store, "nginx.conf")
+    second, _, existed_again = upload(store, "nginx-copy.conf")
+    assert (sha256, existed, existed_again) == (SHA256, False, True)
+
+    with open(second, "rb") as f:
+        assert f.read() == DATA
+    if not store.reflink:
+        # ФС без reflink: имена — жёсткие ссылки на блоб, не копии
+        blob = os.stat(store.blob_path(sha256))
+        assert os.stat(first).st_ino == os.stat(second).st_ino == blob.st_ino
+        assert blob.st_nlink == 3
+
+
+def test_verified_does_not_rehash_unchanged_blob(store, hashed):
+    upload(store, "nginx.conf")
+    hashed.clear()
+    assert store.verified(SHA256)
+    assert BlobStore(store.directory).verified(SHA256)  # Другой процесс — отметка из манифеста
+    assert hashed == []
+
+
+def test_blob_edited_in_place_is_detached(store):
+    path, _, _ = upload(store, "nginx.conf")
+    with open(store.blob_path(SHA256), "r+b") as f:
+        f.write(b"#")  # Правка на месте: через жёсткую ссылку или сам блоб
+
+    assert not store.verified(SHA256)
+    assert not os.path.exists(store.blob_path(SHA256))
+    with open(path, "rb") as f:
+        edited = f.read()
+    assert edited == (b"#" + DATA[1:] if not store.reflink else DATA)
+
+    # Исходное содержимое загружают снова — блоб создаётся заново, правленый файл не тронут
+    again, _, existed = upload(store, "nginx.conf")
+    assert not existed and again != path
+    with open(store.blob_path(SHA256), "rb") as f:
+        assert f.read() == DATA
+
+
+def test_same_name_other_content_gets_a_number(store):
+    first, _, _ = upload(store, "report.log")
+    second, _, _ = upload(store, "report.log", b"other")
+    assert os.path.basename(second) == "report (1).log"
+    assert upload(store, "report.log")[0] == first  # То же содержимое под тем же именем — уже на месте
@@ -0,0 +1,105 @@
+"""StreamJsonParser и чтение stream-json: дельты, итог result, огромные события, инструменты"""
+
+import asyncio
+import json
+
+import claude_runner
+from claude_runner import StreamJsonParser, _read_events, parse_limits
+from conftest import run
+from output_spool import OutputSpool
+
+
+def delta(text):
+    return {"type": "stream_event", "event": {"type": "content_block_delta",
+                                              "delta": {"type": "text_delta", "text": text}}}
+
+
+def line(event):
+    return (json.dumps(event, ensure_ascii=False) + "\n").encode()
+
+
+async def read(lines, limit=2 ** 16):
+    stream = asyncio.StreamReader(limit=limit)
+    for data in lines:
+        stream.feed_data(data)
+    stream.feed_eof()
+    parser = StreamJsonParser()
+    texts = []
+
+    async def on_delta(text):
+        texts.append(text)
+
+    await _read_events(stream, parser, on_delta)
+    parser.output.close()
+    return parser, texts
+
+
+def test_result_does_not_replace_streamed_deltas():
+    parser, texts = run(read([
+        line({"type": "system", "session_id": "sid"}),
+        line(delta("При")),
+        line(delta("вет")),
+        line({"type": "result", "is_error": False, "result": "Другой текст"}),
+    ]))
+    assert texts == ["При", "вет"]
+    assert parser.output.text() == "Привет"
+    assert parser.finished and not parser.is_error
+    assert parser.session_id == "sid"
+
+
+def test_result_is_used_without_deltas():
+    parser, _ = run(read([
+        line({"type": "assistant", "message": {"content": [{"type": "text", "text": "черновик"}]}}),
+        line({"type": "result", "is_error": True, "result": "итог"}),
+    ]))
+    assert parser.output.text() == "итог"
+    assert parser.is_error
+
+
+def test_spilled_deltas_survive_result(monkeypatch):
+    monkeypatch.setattr(claude_runner, "OutputSpool", lambda: OutputSpool(threshold=10, preview=4))
+    parser, _ = run(read([line(delta("0123456789")), line(delta("abcdef")),
+                          line({"type": "result", "result": "0123456789abcdef"})]))
+    assert parser.output.spilled
+    with open(parser.output.path, encoding="utf-8") as f:
+        assert f.read() == "0123456789abcdef"
+
+
+def test_oversized_event_is_skipped_not_fatal(monkeypatch):
+    monkeypatch.setattr(claude_runner, "STREAM_LINE_LIMIT", 1000)
+    parser, texts = run(read([
+        line(delta("начало")),
+        line({"type": "assistant", "message": {"content": [{"type": "text", "text": "x" * 5000}]}}),
+        line(delta(" конец")),
+        line({"type": "result", "is_error": False, "result": "y" * 5000}),
+    ], limit=1000))
+    assert texts == ["начало", " конец"]
+    assert parser.output.text() == "начало конец"
+    assert parser.finished
+
+
+def test_oversized_result_without_deltas_reports_it(monkeypatch):
+    monkeypatch.setattr(claude_runner, "STREAM_LINE_LIMIT", 1000)
+    parser, _ = run(read([line({"type": "result", "is_error": False, "result": "y" * 5000})], limit=1000))
+    assert parser.finished
+    assert "не прочитан" in parser.output.text()
+
+
+def test_tool_use_is_recorded():
+    parser = StreamJsonParser()
+    parser.feed(line(delta("Смотрю")))
+    assert not parser.tool_use
+    parser.feed(line({"type": "stream_event", "event": {"type": "content_block_start",
+                                                        "content_block": {"type": "tool_use", "name": "Bash"}}}))
+    assert parser.tool_use
+
+    parser = StreamJsonParser()
+    parser.feed(line({"type": "assistant", "message": {"content": [{"type": "tool_use", "name": "Edit"}]}}))
+    assert parser.tool_use
+
+
+def test_parse_limits():
+    limits, text = parse_limits("--timeout=5m --no-cache --max-output=50k вопрос")
+    assert (limits.timeout, limits.max_output, limits.cache, text) == (300.0, 50000, False, "вопрос")
+    limits, text = parse_limits("--timeout=5x вопрос")
+    assert text == "--timeout=5x вопрос"
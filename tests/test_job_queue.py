@@ -0,0 +1,108 @@
+"""JobScheduler: FIFO внутри беседы, параллельность бесед, переполнение и отмена"""
+
+import asyncio
+
+import pytest
+
+from conftest import run
+from job_queue import JobCancelled, JobScheduler, QueueFull
+
+
+def test_session_jobs_run_in_order_one_at_a_time():
+    async def scenario():
+        scheduler = JobScheduler(workers=3, max_queue=10)
+        log = []
+
+        def job(name):
+            async def func():
+                log.append(f"start {name}")
+                await asyncio.sleep(0.01)
+                log.append(f"end {name}")
+                return name
+            return func
+
+        results = await asyncio.gather(*[scheduler.run("s", job(i)) for i in range(3)])
+        return results, log
+
+    results, log = run(scenario())
+    assert results == [0, 1, 2]
+    assert log == ["start 0", "end 0", "start 1", "end 1", "start 2", "end 2"]
+
+
+def test_different_sessions_run_in_parallel():
+    async def scenario():
+        scheduler = JobScheduler(workers=2, max_queue=10)
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def blocker():
+            started.set()
+            await release.wait()
+            return "a"
+
+        async def other():
+            release.set()
+            return "b"
+
+        first = asyncio.create_task(scheduler.run("a", blocker))
+        await started.wait()
+        # Беседа a занята, но b не ждёт её — иначе blocker не дождался бы release
+        return await asyncio.wait_for(asyncio.gather(first, scheduler.run("b", other)), 1)
+
+    assert run(scenario()) == ["a", "b"]
+
+
+def test_queue_full_rejects_and_reports_positions():
+    async def scenario():
+        scheduler = JobScheduler(workers=1, max_queue=2)
+        release = asyncio.Event()
+        positions = []
+
+        async def wait():
+            await release.wait()
+
+        async def report(position):
+            positions.append(position)
+
+        running = asyncio.create_task(scheduler.run("s", wait))
+        await asyncio.sleep(0)
+        queued = [asyncio.create_task(scheduler.run("s", wait, on_position=report)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        with pytest.raises(QueueFull):
+            await scheduler.submit("s", wait)
+        release.set()
+        await asyncio.gather(running, *queued)
+        return positions
+
+    assert run(scenario())[:2] == [1, 2]
+
+
+def test_cancel_pending_and_running_jobs():
+    async def scenario():
+        scheduler = JobScheduler(workers=1, max_queue=10)
+        started = asyncio.Event()
+        ran = []
+
+        async def slow():
+            started.set()
+            await asyncio.sleep(10)
+
+        async def never():
+            ran.append("never")
+
+        running = asyncio.create_task(scheduler.run("s", slow, job_id="run"))
+        await started.wait()
+        pending = asyncio.create_task(scheduler.run("s", never, job_id="wait"))
+        await asyncio.sleep(0)
+
+        assert await scheduler.cancel_jobs("s", "wait") == 1
+        with pytest.raises(JobCancelled):
+            await pending
+        assert await scheduler.cancel_jobs("s") == 1
+        with pytest.raises(JobCancelled):
+            await running
+        await asyncio.sleep(0.01)
+        return ran, scheduler.running, scheduler.pending
+
+    ran, running, pending = run(scenario())
+    assert ran == [] and running == {} and pending == []
@@ -0,0 +1,207 @@
+"""JobStore и SharedJobScheduler: общая очередь нескольких процессов, перехват после падения"""
+
+import asyncio
+import os
+import tempfile
+import threading
+
+import pytest
+
+import job_store
+from conftest import run
+from job_queue import JobCancelled, QueueFull, SharedJobScheduler
+from job_store import JobStore
+
+
+class Clock:
+    """Подменённое time.time хранилища"""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def db_path():
+    return os.path.join(tempfile.mkdtemp(dir=os.environ["CLAUDE_DATA_DIR"]), "jobs.db")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(job_store.time, "time", clock)
+    return clock
+
+
+def test_claim_is_fifo_per_session_and_limited(db_path, clock):
+    a, b = JobStore(db_path, lease=30), JobStore(db_path, lease=30)
+    a.enqueue("a1", "s")
+    b.enqueue("b1", "s")
+    b.enqueue("b2", "t")
+
+    assert b.claim("b1", limit=2) == 2  # Раньше в беседе s стоит a1
+    assert a.claim("a1", limit=2) == 0
+    assert b.claim("b1", limit=2) == 1  # Беседа занята
+    assert b.claim("b2", limit=1) == 2  # Лимит воркеров на все процессы
+    assert b.claim("b2", limit=2) == 0
+    assert b.counts() == (1, 2)
+
+    a.finish("a1")
+    assert b.claim("b1", limit=3) == 0
+
+
+def test_dead_worker_jobs_are_taken_over(db_path, clock):
+    a, b = JobStore(db_path, lease=30), JobStore(db_path, lease=30)
+    a.heartbeat()
+    b.heartbeat()
+    a.enqueue("a1", "s")
+    assert a.claim("a1", limit=1) == 0
+    b.enqueue("b1", "s")
+    assert b.claim("b1", limit=1) == 1
+
+    # a жив — его запрос держит беседу
+    clock.now += 20
+    b.heartbeat()
+    assert b.claim("b1", limit=1) == 1
+
+    # a не отмечался дольше lease — его запросы убраны, беседа свободна
+    clock.now += 20
+    b.heartbeat()
+    assert b.claim("b1", limit=1) == 0
+    assert a.claim("a1", limit=1) is None
+
+
+def test_cancel_from_other_process(db_path, clock):
+    a, b = JobStore(db_path), JobStore(db_path)
+    a.enqueue("a1", "s")
+    assert b.cancel("s") == 1
+    assert b.cancel("s") == 0  # Уже помечен
+    assert a.is_cancelled("a1")
+    assert a.claim("a1", limit=1) == JobStore.CANCELLED
+    assert a.counts() == (0, 0)
+
+
+def test_enqueue_limit_holds_across_processes(db_path):
+    stores = [JobStore(db_path) for _ in range(8)]
+    accepted = []
+    start = threading.Barrier(len(stores))
+
+    def submit(number, store):
+        start.wait()
+        for attempt in range(5):
+            if store.enqueue(f"{number}-{attempt}", f"s{number}", max_queue=10) is not None:
+                accepted.append(number)
+
+    threads = [threading.Thread(target=submit, args=item) for item in enumerate(stores)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(accepted) == 10
+    assert stores[0].counts() == (10, 0)
+
+
+def test_requeued_job_keeps_its_place(db_path, clock):
+    a, b = JobStore(db_path), JobStore(db_path)
+    seq, created = a.enqueue("a1", "s")
+    b.enqueue("b1", "s")
+    a.finish("a1")  # Уборка сочла процесс a мёртвым и убрала его запрос
+
+    # a жив и возвращает запрос на прежнее место — впереди b1, а не за ним
+    assert a.enqueue("a1", "s", seq=seq, created=created) == (seq, created)
+    assert b.claim("b1", limit=2) == 2
+    assert a.claim("a1", limit=2) == 0
+    assert b.claim("b1", limit=2) == 1
+
+def test_scheduler_waits_for_other_process_and_takes_over_after_lease(db_path):
+    async def scenario():
+        other = JobStore(db_path, lease=0.3)
+        await asyncio.to_thread(other.heartbeat)
+        other.enqueue("other", "s")
+        assert other.claim("other", limit=1) == 0
+
+        own = JobStore(db_path, lease=0.3)
+        scheduler = SharedJobScheduler(own, workers=1, poll_interval=0.01, lease=0.3)
+        positions = []
+
+        async def report(position):
+            positions.append(position)
+
+        async def job():
+            return "done"
+
+        # other больше не отмечается: через lease его запрос снимет heartbeat этого процесса
+        result = await asyncio.wait_for(scheduler.run("s", job, on_position=report), 5)
+        await asyncio.sleep(0.05)  # Результат отдаётся до того, как запрос убран из хранилища
+        scheduler._heartbeat.cancel()
+        return result, positions, own.counts()
+
+    result, positions, counts = run(scenario())
+    assert result == "done"
+    assert positions == [1]
+    assert counts == (0, 0)
+
+
+def test_scheduler_requeues_job_dropped_from_store(db_path):
+    async def scenario():
+        store = JobStore(db_path)
+        scheduler = SharedJobScheduler(store, workers=1, poll_interval=0.01)
+        blocker = JobStore(db_path)
+        blocker.enqueue("blocker", "s")
+        blocker.claim("blocker", limit=1)
+
+        async def job():
+            return "done"
+
+        task = asyncio.create_task(scheduler.run("s", job, job_id="mine"))
+        await asyncio.sleep(0.05)
+        # Хранилище сочло этот процесс мёртвым и убрало его запрос
+        store.finish("mine")
+        blocker.finish("blocker")
+        result = await asyncio.wait_for(task, 5)
+        await asyncio.sleep(0.05)
+        scheduler._heartbeat.cancel()
+        return result, store.counts()
+
+    assert run(scenario()) == ("done", (0, 0))
+
+
+def test_scheduler_cancel_from_other_process(db_path):
+    async def scenario():
+        store = JobStore(db_path)
+        scheduler = SharedJobScheduler(store, workers=1, poll_interval=0.01)
+        started = asyncio.Event()
+
+        async def slow():
+            started.set()
+            await asyncio.sleep(10)
+
+        task = asyncio.create_task(scheduler.run("s", slow))
+        await started.wait()
+        assert JobStore(db_path).cancel("s") == 1
+        try:
+            await asyncio.wait_for(task, 5)
+        finally:
+            scheduler._heartbeat.cancel()
+
+    with pytest.raises(JobCancelled):
+        run(scenario())
+
+
+def test_shared_scheduler_counts_other_processes_queue(db_path):
+    async def scenario():
+        JobStore(db_path).enqueue("other", "t")  # Ждёт в другом процессе
+        scheduler = SharedJobScheduler(JobStore(db_path), workers=1, max_queue=1, poll_interval=0.01)
+
+        async def job():
+            return "done"
+
+        try:
+            await scheduler.run("s", job)
+        finally:
+            scheduler._heartbeat.cancel()
+
+    with pytest.raises(QueueFull):
+        run(scenario())
@@ -0,0 +1,56 @@
+"""Метрики: текстовый формат Prometheus и квантили гистограмм для /stats"""
+
+import pytest
+
+from metrics import Counter, Histogram, Metric, MetricsRegistry
+
+
+def test_metric_is_abstract():
+    with pytest.raises(TypeError):
+        Metric("claude_test", "test")
+
+
+def test_render_prometheus_text():
+    registry = MetricsRegistry()
+    requests = registry.counter("claude_test_total", "Requests", labels=("result",))
+    queue = registry.gauge("claude_test_pending", "Pending")
+    wait = registry.histogram("claude_test_seconds", "Wait", buckets=(1, 5))
+    requests.inc(result='say "hi"')
+    requests.inc(2, result="ok")
+    queue.set(3)
+    wait.observe(0.5)
+    wait.observe(7)
+
+    assert registry.render().splitlines() == [
+        "# HELP claude_test_total Requests",
+        "# TYPE claude_test_total counter",
+        'claude_test_total{result="ok"} 2',
+        'claude_test_total{result="say \\"hi\\""} 1',
+        "# HELP claude_test_pending Pending",
+        "# TYPE claude_test_pending gauge",
+        "claude_test_pending 3",
+        "# HELP claude_test_seconds Wait",
+        "# TYPE claude_test_seconds histogram",
+        'claude_test_seconds_bucket{le="1"} 1',
+        'claude_test_seconds_bucket{le="5"} 1',
+        'claude_test_seconds_bucket{le="+Inf"} 2',
+        "claude_test_seconds_sum 7.5",
+        "claude_test_seconds_count 2",
+    ]
+    with pytest.raises(ValueError):
+        registry.counter("claude_test_total", "Again")
+
+
+def test_labels_must_match():
+    counter = Counter("claude_test_total", "Requests", labels=("result",))
+    with pytest.raises(ValueError):
+        counter.inc(status="ok")
+
+
+def test_histogram_quantile():
+    histogram = Histogram("claude_test_seconds", "Wait", buckets=(1, 2, 4))
+    assert histogram.quantile(0.5) is None
+    for value in (0.5, 1.5, 1.5, 3):
+        histogram.observe(value)
+    assert histogram.quantile(0.5) == pytest.approx(1.5)
+    assert histogram.quantile(1.0) == pytest.approx(4)
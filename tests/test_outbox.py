@@ -0,0 +1,121 @@
+"""Outbox: досылка пропущенных кадров по seq и resync при смене эпохи"""
+
+import asyncio
+import os
+import tempfile
+
+from conftest import run
+from job_store import JobStore
+from outbox import Outbox, SharedOutboxRegistry
+
+EPOCH = "e1"
+
+
+class Recorder:
+    """send() для Outbox: запоминает кадры, отправленные каждому сокету"""
+
+    def __init__(self):
+        self.sent = {}
+
+    async def __call__(self, websocket, payload, wait=False):
+        frame = payload if isinstance(payload, dict) else payload.frame
+        self.sent.setdefault(websocket, []).append(frame)
+
+    def seqs(self, websocket):
+        return [frame.get("seq") for frame in self.sent.get(websocket, []) if frame["type"] != "resync"]
+
+    def types(self, websocket):
+        return [frame["type"] for frame in self.sent.get(websocket, [])]
+
+
+async def publish_jobs(outbox):
+    """Кадры: запрос a завершён (seq 1-2), запрос b ещё идёт (seq 3-4)"""
+    outbox.begin("a")
+    await outbox.publish({"id": "a", "type": "delta"})
+    await outbox.publish({"id": "a", "type": "done"})
+    outbox.end("a")
+    outbox.begin("b")
+    await outbox.publish({"id": "b", "type": "delta"})
+    await outbox.publish({"id": "b", "type": "delta"})
+
+
+def test_replay_after_last_seq():
+    async def scenario():
+        send = Recorder()
+        outbox = Outbox(send)
+        await publish_jobs(outbox)
+        await outbox.attach("ws", EPOCH, 2, EPOCH)
+        await outbox.publish({"id": "b", "type": "done"})
+        return send
+
+    send = run(scenario())
+    assert send.types("ws")[0] != "resync"
+    assert send.seqs("ws") == [3, 4, 5]
+
+
+def test_up_to_date_client_gets_only_new_frames():
+    async def scenario():
+        send = Recorder()
+        outbox = Outbox(send)
+        await publish_jobs(outbox)
+        await outbox.attach("ws", EPOCH, 4, EPOCH)
+        return send
+
+    assert run(scenario()).sent.get("ws") is None
+
+
+def test_other_epoch_resyncs_with_running_jobs_only():
+    async def scenario():
+        send = Recorder()
+        outbox = Outbox(send)
+        await publish_jobs(outbox)
+        await outbox.attach("ws", "old", 4, EPOCH)
+        return send
+
+    send = run(scenario())
+    assert send.sent["ws"][0] == {"type": "resync", "epoch": EPOCH, "seq": 4}
+    assert send.seqs("ws") == [3, 4]
+
+
+def test_evicted_or_future_seq_resyncs():
+    async def scenario():
+        send = Recorder()
+        outbox = Outbox(send, size=2)
+        await publish_jobs(outbox)
+        await outbox.attach("evicted", EPOCH, 1, EPOCH)  # Кадр 2 уже вытеснен из буфера
+        await outbox.attach("future", EPOCH, 10, EPOCH)  # Номер из будущего — сервер перезапускался
+        return send
+
+    send = run(scenario())
+    for websocket in ("evicted", "future"):
+        assert send.types(websocket)[0] == "resync"
+        assert send.seqs(websocket) == [3, 4]
+
+
+def test_shared_outbox_replays_from_store():
+    async def scenario():
+        path = os.path.join(tempfile.mkdtemp(dir=os.environ["CLAUDE_DATA_DIR"]), "jobs.db")
+        store = JobStore(path)
+        send = Recorder()
+        # Два процесса: кадры публикует один, браузер переподключается к другому
+        publisher = SharedOutboxRegistry(send, store, poll_interval=0.01)
+        receiver = SharedOutboxRegistry(send, JobStore(path), poll_interval=0.01)
+        assert publisher.epoch == receiver.epoch
+
+        outbox = publisher.get("client")
+        await outbox.publish({"id": "a", "type": "delta"})
+        first = (await asyncio.to_thread(store.client_range, "client"))[1]
+        await outbox.publish({"id": "a", "type": "done"})
+        await outbox.publish({"id": "b", "type": "delta"})
+
+        await receiver.poll()
+        await receiver.attach("client", "ws", receiver.epoch, first)
+        await receiver.attach("client", "stale", "old", first)
+        publisher._poller.cancel()
+        receiver._poller.cancel()
+        return send, first
+
+    send, first = run(scenario())
+    assert send.seqs("ws") == [first + 1, first + 2]
+    assert send.types("stale")[0] == "resync"
+    assert [frame["id"] for frame in send.sent["stale"][1:]] == ["b"]  # Только незавершённый запрос
@@ -0,0 +1,57 @@
+"""OutputSpool: память до порога, дальше файл; reset и постраничное чтение"""
+
+import os
+
+from output_spool import OutputSpool, output_path, read_page
+
+
+def test_small_output_stays_in_memory():
+    spool = OutputSpool(threshold=100, preview=10)
+    spool.write("hello ")
+    spool.write("world")
+    spool.close()
+    assert not spool.spilled
+    assert spool.text() == "hello world"
+    assert spool.size == 11
+
+
+def test_spill_keeps_everything_on_disk_and_preview_in_memory():
+    spool = OutputSpool(threshold=10, preview=4)
+    for part in ("абв", "где", "ёжз", "ийк"):
+        spool.write(part)
+    spool.write("лмн")
+    spool.close()
+
+    assert spool.spilled
+    assert spool.size == 15
+    assert spool.text() == "абвг"
+    with open(spool.path, encoding="utf-8") as f:
+        assert f.read() == "абвгдеёжзийклмн"
+    assert output_path(spool.id) == spool.path
+
+
+def test_reset_removes_spilled_file_and_keeps_first_write():
+    spool = OutputSpool(threshold=5, preview=2)
+    spool.write("0123456789")
+    path, first_write = spool.path, spool.first_write
+    spool.reset()
+    assert not os.path.exists(path)
+    assert not spool.spilled and spool.size == 0
+    assert spool.first_write == first_write
+    spool.write("ok")
+    assert spool.text() == "ok"
+
+
+def test_output_path_rejects_bad_ids():
+    assert output_path("../../etc/passwd") is None
+    assert output_path("0" * 32) is None  # Корректный ID, но файла нет
+
+
+def test_read_page_does_not_split_utf8():
+    spool = OutputSpool(threshold=1, preview=1)
+    spool.write("яяя")  # 6 байт
+    spool.close()
+    text, next_offset = read_page(spool.path, 0, 3)
+    assert (text, next_offset) == ("я", 2)
+    text, next_offset = read_page(spool.path, next_offset, 100)
+    assert (text, next_offset) == ("яя", 6)
@@ -0,0 +1,209 @@
+"""PromptCache: TTL, вытеснение LRU, ключ по путям из вопроса, что в кэш не попадает, кэш в идущей беседе"""
+
+import os
+import tempfile
+
+import pytest
+
+import prompt_cache
+import sessions
+from claude_runner import ClaudeResult
+from conftest import run
+from prompt_cache import PromptCache, cache_key, mentioned_paths, normalize, standalone
+from sessions import SessionRegistry
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(prompt_cache.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def workdir():
+    return tempfile.mkdtemp(dir=os.environ["CLAUDE_WORK_DIR"])
+
+
+def make_cache(**kwargs) -> PromptCache:
+    path = os.path.join(tempfile.mkdtemp(dir=os.environ["CLAUDE_DATA_DIR"]), "cache.db")
+    return PromptCache(path, enabled=True, **kwargs)
+
+
+def answer(text: str = "ответ", **kwargs) -> ClaudeResult:
+    return ClaudeResult(text, "", 0, False, 2.0, **{"tool_use": False, **kwargs})
+
+
+async def ask(cache: PromptCache, prompt: str, cwd: str, result=None, fresh: bool = True):
+    """get, а на промахе — put ответа result; возвращает ответ из кэша или None"""
+    key, cached = await cache.get(prompt, cwd, fresh)
+    if cached is None and result is not None:
+        await cache.put(key, prompt, cwd, result)
+    return cached
+
+
+def test_normalize():
+    assert normalize("  Что   занимает ДИСК?! ") == normalize("что занимает диск")
+
+
+def test_hit_and_ttl(clock, workdir):
+    async def scenario():
+        cache = make_cache(ttl=60)
+        assert await ask(cache, "что занимает диск", workdir, answer()) is None
+        clock.now += 30
+        hit = await ask(cache, "Что занимает  диск?", workdir)
+        clock.now += 31
+        expired = await ask(cache, "что занимает диск", workdir)
+        return hit, expired, cache.stats()
+
+    hit, expired, stats = run(scenario())
+    assert hit.stdout == "ответ" and hit.cached == pytest.approx(30)
+    assert expired is None
+    assert stats[0] == 0
+
+
+def test_lru_eviction_by_entries_and_bytes(clock, workdir):
+    async def scenario():
+        cache = make_cache(max_entries=2, max_bytes=10 ** 6)
+        await ask(cache, "a", workdir, answer("A"))
+        clock.now += 1
+        await ask(cache, "b", workdir, answer("B"))
+        clock.now += 1
+        await ask(cache, "a", workdir)  # a использован позже b
+        clock.now += 1
+        await ask(cache, "c", workdir, answer("C"))
+        entries = [await ask(cache, q, workdir) is not None for q in "abc"]
+
+        small = make_cache(max_entries=10, max_bytes=5)
+        await ask(small, "x", workdir, answer("xxx"))
+        clock.now += 1
+        await ask(small, "y", workdir, answer("yyy"))
+        await ask(small, "z", workdir, answer("z" * 6))  # Больше лимита — не сохраняется вовсе
+        sized = [await ask(small, q, workdir) is not None for q in "xyz"]
+        return entries, sized
+
+    entries, sized = run(scenario())
+    assert entries == [True, False, True]
+    assert sized == [False, True, False]
+
+
+def test_key_changes_with_mentioned_file(workdir):
+    path = os.path.join(workdir, "error.log")
+    with open(path, "w") as f:
+        f.write("one\n")
+    before = cache_key("покажи error.log", workdir, "haiku")
+    assert cache_key("покажи error.log", workdir, "haiku") == before
+    assert cache_key("покажи error.log", workdir, "sonnet") != before
+
+    with open(path, "a") as f:
+        f.write("two\n")
+    assert cache_key("покажи error.log", workdir, "haiku") != before
+    assert mentioned_paths(f"покажи {path}, ./error.log и нет.log", workdir) == [path]
+
+
+def test_answer_is_not_stored_if_file_changed_during_request(workdir):
+    async def scenario():
+        cache = make_cache()
+        path = os.path.join(workdir, "nginx.conf")
+        with open(path, "w") as f:
+            f.write("a")
+        key, _ = await cache.get("проверь nginx.conf", workdir, True)
+        with open(path, "w") as f:
+            f.write("bb")
+        await cache.put(key, "проверь nginx.conf", workdir, answer())
+        return cache.stats()[0]
+
+    assert run(scenario()) == 0
+
+
+def test_standalone():
+    assert standalone("что занимает диск")
+    assert not standalone("продолжай")
+    assert not standalone("а подробнее про логи?")
+    assert not standalone("покажи ещё")
+
+
+def test_only_tool_free_complete_answers_are_cached(workdir):
+    async def scenario():
+        cache = make_cache()
+        # Уточнение в идущей беседе — кэш не смотрится и не пополняется
+        assert await cache.get("продолжай", workdir, False) == (None, None)
+
+        rejected = [
+            answer(tool_use=True),  # Claude выполнял команды: «перезапусти nginx»
+            answer(tool_use=None),  # Вывод текстом — неизвестно, были ли команды
+            answer(truncated=True),
+            ClaudeResult("", "ошибка", 1, False, 1.0, tool_use=False),
+            ClaudeResult("часть", "", None, True, 1.0, tool_use=False),
+        ]
+        for number, result in enumerate(rejected):
+            await ask(cache, f"вопрос {number}", workdir, result)
+        stored = cache.stats()[0]
+
+        # --no-cache: ответ не ищется, но свежий сохраняется
+        await ask(cache, "вопрос", workdir, answer("старый"))
+        key, cached = await cache.get("вопрос", workdir, True, bypass=True)
+        await cache.put(key, "вопрос", workdir, answer("новый"))
+        return stored, cached, (await ask(cache, "вопрос", workdir)).stdout
+
+    stored, bypassed, latest = run(scenario())
+    assert stored == 0
+    assert bypassed is None
+    assert latest == "новый"
+
+
+def test_disabled_cache_does_nothing(workdir):
+    cache = PromptCache(os.path.join(workdir, "never.db"), enabled=False)
+    assert run(cache.get("вопрос", workdir, True)) == (None, None)
+    assert not os.path.exists(os.path.join(workdir, "never.db"))
+
+
+def test_repeated_question_in_started_session(workdir, monkeypatch):
+    prompts = []
+
+    async def fake_run_claude(prompt, **kwargs):
+        prompts.append(prompt)
+        return answer(f"ответ {len(prompts)}")
+
+    monkeypatch.setattr(sessions, "run_claude", fake_run_claude)
+    registry = SessionRegistry(os.path.join(tempfile.mkdtemp(dir=os.environ["CLAUDE_DATA_DIR"]), "sessions.json"))
+    session = registry.active("tg:1")
+    registry.mark_started(session)  # В чате уже о чём-то говорили
+
+    async def turn(cache, text):
+        """То же, что job() в bot.py: кэш, иначе Claude в беседе"""
+        fresh = registry.get(session.name).fresh
+        key, result = await cache.get(text, workdir, fresh)
+        if result is not None:
+            registry.remember_cached(session.name, text, result.stdout)
+            return result
+        result = await registry.ask(session.name, text)
+        await cache.put(key, text, workdir, result)
+        return result
+
+    async def scenario():
+        cache = make_cache()
+        first = await turn(cache, "что занимает диск")
+        second = await turn(cache, "Что занимает диск?")
+        pending = list(registry.get(session.name).cached)
+        follow_up = await turn(cache, "а подробнее?")
+        return first, second, pending, follow_up
+
+    first, second, pending, follow_up = run(scenario())
+    assert first.cached is None and second.cached is not None
+    assert second.stdout == first.stdout == "ответ 1"
+    assert pending == [{"prompt": "Что занимает диск?", "response": "ответ 1"}]
+
+    # Уточнение ушло к Claude вместе с ответом из кэша, которого CLI не видел
+    assert follow_up.cached is None
+    assert len(prompts) == 2
+    assert "Вопрос: Что занимает диск?" in prompts[1] and prompts[1].endswith("а подробнее?")
+    assert registry.get(session.name).cached == []
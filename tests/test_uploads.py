@@ -0,0 +1,76 @@
+"""Загрузка кусками: init → chunk → commit и ответы api на некорректные кадры"""
+
+import hashlib
+import os
+import tempfile
+
+import pytest
+
+import api
+from blob_store import BlobStore
+from conftest import run
+from uploads import HEADER, NO_DIGEST, UploadManager
+
+UPLOAD_ID = "ab" * 16
+DATA = os.urandom(3000)
+
+
+@pytest.fixture
+def manager():
+    return UploadManager(BlobStore(tempfile.mkdtemp(dir=os.environ["CLAUDE_FILES_DIR"])))
+
+
+def frame(offset: int, data: bytes, digest: bool = True) -> bytes:
+    return HEADER.pack(bytes.fromhex(UPLOAD_ID), offset, hashlib.sha256(data).digest() if digest else NO_DIGEST) + data
+
+
+def test_chunked_upload_and_resume(manager):
+    upload = manager.init(UPLOAD_ID, "dump.bin", len(DATA))
+    assert manager.chunk(frame(0, DATA[:1000]))[2]
+    assert not manager.chunk(frame(5000, DATA[1000:2000]))[2]  # Не то смещение
+    upload.close()
+
+    # Переподключение после рестарта: загрузка дочитывает .part и продолжает
+    resumed = UploadManager(manager.store, manager.directory)
+    upload = resumed.init(UPLOAD_ID, "dump.bin", len(DATA))
+    assert upload.received == 1000
+    assert resumed.chunk(frame(1000, DATA[1000:], digest=False))[2]
+    path, size, sha256 = resumed.commit(UPLOAD_ID, hashlib.sha256(DATA).hexdigest())
+    with open(path, "rb") as f:
+        assert (f.read(), size) == (DATA, len(DATA))
+
+
+class Recorder:
+    def __init__(self):
+        self.sent = []
+
+    async def __call__(self, websocket, message, wait=False):
+        self.sent.append(message)
+
+
+@pytest.mark.parametrize("data", [
+    {"upload_id": UPLOAD_ID, "filename": "a.txt", "size": None},
+    {"upload_id": UPLOAD_ID, "filename": "a.txt", "size": {"bytes": 1}},
+    {"upload_id": UPLOAD_ID, "filename": "a.txt", "size": "много"},
+    {"upload_id": UPLOAD_ID, "filename": 5, "size": 1},
+])
+def test_malformed_upload_init_gets_upload_error(monkeypatch, data):
+    send = Recorder()
+    monkeypatch.setattr(api.manager, "send_message", send)
+    run(api.handle_upload_init(data, websocket=None))
+    assert [message["type"] for message in send.sent] == ["upload_error"]
+
+
+def test_malformed_hash_only_skips_dedupe(monkeypatch):
+    send = Recorder()
+    monkeypatch.setattr(api.manager, "send_message", send)
+    run(api.handle_upload_init({"upload_id": "cd" * 16, "filename": "a.txt", "size": 1, "sha256": ["x"]},
+                               websocket=None))
+    assert [message["type"] for message in send.sent] == ["upload_ready"]
+
+
+def test_malformed_upload_commit_gets_upload_error(monkeypatch):
+    send = Recorder()
+    monkeypatch.setattr(api.manager, "send_message", send)
+    run(api.handle_upload_commit({"upload_id": {"id": 1}, "sha256": 5}, websocket=None))
+    assert [message["type"] for message in send.sent] == ["upload_error"]
@@ -0,0 +1,215 @@
+"""
+Загрузка файлов через WebSocket кусками (бинарные кадры)
+init → chunk... → commit, куски пишутся сразу во временный файл в FILES_DIR,
+SHA-256 считается на лету, после переподключения загрузка продолжается с места обрыва.
+Готовый файл уходит в BlobStore; если клиент заранее прислал хеш уже
+известного содержимого, загрузка не нужна вовсе.
+
+Формат бинарного кадра:
+    [0:16]  upload_id (16 байт)
+    [16:24] смещение куска в файле (uint64, big-endian)
+    [24:56] SHA-256 куска или 32 нулевых байта (если клиент не считает хеш)
+    [56:]   данные
+"""
+
+import hashlib
+import logging
+import os
+import struct
+import time
+from typing import BinaryIO, Dict, Optional, Tuple
+
+from config import FILES_DIR, UPLOAD_MAX_SIZE, UPLOAD_STALE_AFTER
+from blob_store import BlobStore
+from metrics import UPLOAD_BYTES, UPLOAD_THROUGHPUT
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct(">16sQ32s")
+NO_DIGEST = b"\0" * 32
+
+
+class UploadError(Exception):
+    """Ошибка загрузки, о которой нужно сообщить клиенту"""
+
+
+class ChunkedUpload:
+    """Одна незавершённая загрузка"""
+
+    def __init__(self, upload_id: str, filename: str, size: int, kind: str, part_path: str):
+        self.id = upload_id
+        self.filename = filename
+        self.size = size
+        self.kind = kind
+        self.part_path = part_path
+        self.received = 0
+        self.hasher = hashlib.sha256()
+        self.updated = time.time()
+        self.started = time.monotonic()
+        self.resumed_at = 0  # Сколько байт уже было на диске, когда загрузку (пере)открыли
+        self._file: Optional[BinaryIO] = None
+
+    def open(self):
+        """Открытие временного файла; уже записанное (после рестарта) дочитываем в хеш"""
+        if self._file is not None:
+            return
+
+        if os.path.exists(self.part_path):
+            with open(self.part_path, "rb") as f:
+                while True:
+                    block = f.read(1024 * 1024)
+                    if not block:
+                        break
+                    self.hasher.update(block)
+                    self.received += len(block)
+
+        self.started = time.monotonic()
+        self.resumed_at = self.received
+        self._file = open(self.part_path, "ab")
+
+    def write(self, data: bytes):
+        self._file.write(data)
+        self.hasher.update(data)
+        self.received += len(data)
+        self.updated = time.time()
+        UPLOAD_BYTES.inc(len(data))
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class UploadManager:
+    """Все незавершённые загрузки (не привязаны к соединению — переживают реконнект)"""
+
+    def __init__(self, store: BlobStore, directory: str = FILES_DIR):
+        self.store = store
+        self.directory = directory
+        self.tmp_dir = os.path.join(directory, ".uploads")
+        self.uploads: Dict[str, ChunkedUpload] = {}
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self._cleanup_stale()
+
+    def _cleanup_stale(self):
+        """Удаляем брошенные временные файлы"""
+        now = time.time()
+        for name in os.listdir(self.tmp_dir):
+            path = os.path.join(self.tmp_dir, name)
+            try:
+                if now - os.path.getmtime(path) > UPLOAD_STALE_AFTER:
+                    os.remove(path)
+            except OSError:
+                pass
+
+        for upload_id, upload in list(self.uploads.items()):
+            if now - upload.updated > UPLOAD_STALE_AFTER:
+                upload.close()
+                del self.uploads[upload_id]
+
+    @staticmethod
+    def _clean_filename(filename: str) -> str:
+        # Только имя файла — никаких путей от клиента
+        if not isinstance(filename, str):
+            raise UploadError("Некорректное имя файла")
+        filename = os.path.basename(filename)
+        if not filename or filename.startswith("."):
+            raise UploadError("Некорректное имя файла")
+        return filename
+
+    def dedupe(self, filename: str, sha256: Optional[str]) -> Optional[str]:
+        """
+        Содержимое с таким хешем уже есть — сразу даём ему имя, путь или None
+        Хешу клиента не верим на слово: блоб перечитывается (блокирующее — через to_thread).
+        """
+        filename = self._clean_filename(filename)
+        if not isinstance(sha256, str) or not self.store.verified(sha256):
+            return None
+        return self.store.link(sha256, filename)
+
+    def init(self, upload_id: str, filename: str, size: int, kind: str = "file") -> ChunkedUpload:
+        """Начало или продолжение загрузки, возвращает загрузку с текущим смещением"""
+        try:
+            raw_id = bytes.fromhex(upload_id)
+        except (TypeError, ValueError):
+            raw_id = b""
+        if len(raw_id) != 16:
+            raise UploadError("Некорректный upload_id")
+
+        filename = self._clean_filename(filename)
+        if size < 0 or size > UPLOAD_MAX_SIZE:
+            raise UploadError(f"Слишком большой файл: {size / 1024 / 1024:.1f} МБ")
+
+        upload = self.uploads.get(upload_id)
+        if upload is None or upload.filename != filename or upload.size != size:
+            if upload is not None:
+                # Тот же ID, другой файл — начинаем заново
+                upload.close()
+                os.remove(upload.part_path)
+            self._cleanup_stale()
+            upload = ChunkedUpload(upload_id, filename, size, kind, os.path.join(self.tmp_dir, f"{upload_id}.part"))
+            self.uploads[upload_id] = upload
+
+        upload.open()
+        if upload.received > upload.size:
+            # Временный файл длиннее заявленного — не наш, начинаем заново
+            upload.close()
+            os.remove(upload.part_path)
+            upload.received = 0
+            upload.hasher = hashlib.sha256()
+            upload.open()
+
+        return upload
+
+    def chunk(self, frame: bytes) -> Tuple[ChunkedUpload, int, bool]:
+        """
+        Приём бинарного кадра: (загрузка, смещение куска, принят ли кусок)
+
+        Не принятый кусок с offset >= received — повод прислать клиенту
+        актуальное смещение; offset < received — повтор, его просто пропускаем.
+        """
+        if len(frame) < HEADER.size:
+            raise UploadError("Короткий кадр")
+
+        raw_id, offset, digest = HEADER.unpack_from(frame)
+        data = memoryview(frame)[HEADER.size:]
+
+        upload = self.uploads.get(raw_id.hex())
+        if upload is None:
+            raise UploadError("Неизвестная загрузка")
+
+        if offset != upload.received:
+            return upload, offset, False
+        if upload.received + len(data) > upload.size:
+            raise UploadError("Данных больше, чем заявлено")
+        if digest != NO_DIGEST and hashlib.sha256(data).digest() != digest:
+            logger.warning(f"Upload {upload.id}: chunk digest mismatch at {offset}")
+            return upload, offset, False
+
+        upload.write(data)
+        return upload, offset, True
+
+    def commit(self, upload_id: str, sha256: Optional[str] = None) -> Tuple[str, int, str]:
+        """Завершение: проверка размера и хеша, перенос в хранилище. (путь, размер, sha256)"""
+        upload = self.uploads.get(upload_id) if isinstance(upload_id, str) else None
+        if upload is None:
+            raise UploadError("Неизвестная загрузка")
+        if upload.received != upload.size:
+            raise UploadError(f"Получено {upload.received} из {upload.size} байт")
+
+        digest = upload.hasher.hexdigest()
+        if sha256 and (not isinstance(sha256, str) or sha256.lower() != digest):
+            upload.close()
+            os.remove(upload.part_path)
+            del self.uploads[upload_id]
+            raise UploadError("Контрольная сумма файла не совпала, загрузи заново")
+
+        upload.close()
+        elapsed = time.monotonic() - upload.started
+        if elapsed > 0 and upload.size > upload.resumed_at:
+            UPLOAD_THROUGHPUT.observe((upload.size - upload.resumed_at) / elapsed)
+        file_path, _, _ = self.store.put_file(upload.part_path, upload.filename, digest)
+        del self.uploads[upload_id]
+
+        logger.info(f"Upload {upload_id} committed: {file_path} ({upload.size} bytes)")
+        return file_path, upload.size, digest
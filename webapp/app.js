@@ -0,0 +1,768 @@
+let ws = null;
+let reconnectTimer = null;
+let sessionCommandPending = false;
+
+// Досылка после переподключения: эпоха сервера и последний увиденный номер кадра
+let outboxEpoch = null;
+let lastSeq = 0;
+
+// Постоянный ID браузера: по нему сервер находит нашу беседу
+let clientId = localStorage.getItem('claude_client_id');
+if (!clientId) {
+    clientId = Math.random().toString(36).slice(2, 14);
+    localStorage.setItem('claude_client_id', clientId);
+}
+
+const chatArea = document.getElementById('chat-area');
+const messageInput = document.getElementById('message-input');
+const sendBtn = document.getElementById('send-btn');
+const fileBtn = document.getElementById('file-btn');
+const imgBtn = document.getElementById('img-btn');
+const statusDot = document.getElementById('status-dot');
+const statusText = document.getElementById('status-text');
+const fileInput = document.getElementById('file-input');
+const imgInput = document.getElementById('img-input');
+const sessionName = document.getElementById('session-name');
+
+// Бинарный кадр: [тип][seq uint32 BE][id 6 байт][UTF-8 текст]
+const textDecoder = new TextDecoder();
+function decodeBinaryFrame(buffer) {
+    const view = new DataView(buffer);
+    if (view.getUint8(0) !== 1) return null;
+    const id = Array.from(new Uint8Array(buffer, 5, 6), b => b.toString(16).padStart(2, '0')).join('');
+    return {
+        type: 'delta',
+        seq: view.getUint32(1),
+        id,
+        content: textDecoder.decode(new Uint8Array(buffer, 11)),
+    };
+}
+
+// WebSocket подключение
+function connect() {
+    const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+    // Дельты — компактными бинарными кадрами
+    const params = new URLSearchParams({ client: clientId, encoding: 'binary' });
+    if (outboxEpoch) {
+        params.set('epoch', outboxEpoch);
+        params.set('last_seq', lastSeq);
+    }
+    const wsUrl = `${protocol}//${window.location.host}/ws?${params}`;
+
+    ws = new WebSocket(wsUrl);
+    ws.binaryType = 'arraybuffer';
+
+    ws.onopen = () => {
+        console.log('WebSocket connected');
+        statusDot.classList.remove('offline');
+        statusText.textContent = 'SYSTEM ONLINE';
+        messageInput.disabled = false;
+        messageInput.placeholder = 'Введите команду...';
+        sendBtn.disabled = false;
+        fileBtn.disabled = false;
+        imgBtn.disabled = false;
+
+        // Чат не очищаем: после переподключения остаётся всё, что уже на экране
+        addSystemMessage('Связь установлена. Жду указаний, оператор.');
+        resumeUploads();
+    };
+
+    ws.onmessage = (event) => {
+        const data = event.data instanceof ArrayBuffer ? decodeBinaryFrame(event.data) : JSON.parse(event.data);
+        if (data) handleBotMessage(data);
+    };
+
+    ws.onclose = () => {
+        console.log('WebSocket disconnected');
+        statusDot.classList.add('offline');
+        statusText.textContent = 'OFFLINE';
+        messageInput.disabled = true;
+        messageInput.placeholder = 'Соединение потеряно...';
+        sendBtn.disabled = true;
+        fileBtn.disabled = true;
+        imgBtn.disabled = true;
+
+        addSystemMessage('Соединение потеряно. Переподключение через 3 сек...');
+
+        // Автоматическое переподключение через 3 секунды
+        reconnectTimer = setTimeout(connect, 3000);
+    };
+
+    ws.onerror = (error) => {
+        console.error('WebSocket error:', error);
+    };
+}
+
+// Отправка текстового сообщения
+function sendMessage() {
+    const text = messageInput.value.trim();
+    if (text === '' || !ws || ws.readyState !== WebSocket.OPEN) return;
+
+    // Рендер сообщения пользователя
+    appendMessage(text, 'user');
+    messageInput.value = '';
+
+    const search = text.match(/^\/search\s+(.+)$/);
+    if (search) {
+        searchHistory(search[1]);
+        return;
+    }
+
+    const find = text.match(/^\/find\s+(.+)$/);
+    if (find) {
+        findFiles(find[1]);
+        return;
+    }
+
+    // Остановка запросов текущей беседы
+    if (text === '/cancel') {
+        ws.send(JSON.stringify({ type: 'cancel' }));
+        return;
+    }
+
+    // Команды бесед: /sessions, /session имя, /new имя, /fork имя
+    const command = text.match(/^\/(sessions|session|new|fork)(?:\s+(\S+))?$/);
+    if (command) {
+        const actions = { sessions: 'list', session: 'switch', new: 'new', fork: 'fork' };
+        // Без имени любая из команд просто показывает список
+        const action = command[2] ? actions[command[1]] : 'list';
+        sessionCommandPending = true;
+        ws.send(JSON.stringify({ type: 'session', action, name: command[2] || '' }));
+        return;
+    }
+
+    // Отправка через WebSocket
+    ws.send(JSON.stringify({
+        type: 'text',
+        content: text
+    }));
+}
+
+// Добавление сообщения в DOM
+function appendMessage(text, sender, hasImage = false, imageUrl = null) {
+    const msgDiv = document.createElement('div');
+    msgDiv.classList.add('message', sender);
+
+    const contentDiv = document.createElement('div');
+    contentDiv.classList.add('text');
+    contentDiv.textContent = text;
+
+    msgDiv.appendChild(contentDiv);
+
+    // Если есть изображение
+    if (hasImage && imageUrl) {
+        const img = document.createElement('img');
+        img.src = imageUrl;
+        img.classList.add('image-preview');
+        msgDiv.appendChild(img);
+    }
+
+    const timeSpan = document.createElement('span');
+    timeSpan.classList.add('message-time');
+    const now = new Date();
+    timeSpan.textContent = formatTime(now);
+
+    msgDiv.appendChild(timeSpan);
+    chatArea.appendChild(msgDiv);
+    chatArea.scrollTop = chatArea.scrollHeight;
+}
+
+// Системное сообщение
+function addSystemMessage(text) {
+    const msgDiv = document.createElement('div');
+    msgDiv.classList.add('message', 'system');
+
+    const contentDiv = document.createElement('div');
+    contentDiv.classList.add('text');
+    contentDiv.textContent = text;
+
+    msgDiv.appendChild(contentDiv);
+    chatArea.appendChild(msgDiv);
+    chatArea.scrollTop = chatArea.scrollHeight;
+}
+
+// Потоковые ответы: id запроса -> {msgDiv, textDiv, seq}
+const streams = {};
+
+function getStream(id) {
+    let stream = streams[id];
+    if (!stream) {
+        const msgDiv = document.createElement('div');
+        msgDiv.classList.add('message', 'bot', 'streaming');
+
+        const textDiv = document.createElement('div');
+        textDiv.classList.add('text');
+        msgDiv.appendChild(textDiv);
+        chatArea.appendChild(msgDiv);
+
+        stream = streams[id] = { msgDiv, textDiv, seq: 0, queued: false };
+    }
+    return stream;
+}
+
+// Позиция в очереди: показываем в черновике, пока нет ответа
+function showQueued(data) {
+    const stream = getStream(data.id);
+    if (data.seq <= stream.seq) return;
+    stream.seq = data.seq;
+
+    stream.queued = true;
+    stream.textDiv.textContent = `🕐 В очереди: ${data.position}`;
+    chatArea.scrollTop = chatArea.scrollHeight;
+}
+
+// Кусок ответа: дописываем в сообщение по мере генерации
+function appendDelta(data) {
+    const stream = getStream(data.id);
+
+    // Повторы и кадры не по порядку пропускаем
+    if (data.seq <= stream.seq) return;
+    stream.seq = data.seq;
+
+    if (stream.queued) {
+        stream.queued = false;
+        stream.textDiv.textContent = '';
+    }
+    stream.textDiv.textContent += data.content;
+    chatArea.scrollTop = chatArea.scrollHeight;
+}
+
+// Финальный кадр: заменяем черновик полным ответом
+function finishStream(data) {
+    const stream = streams[data.id];
+    if (stream) {
+        if (data.seq <= stream.seq) return;
+        stream.msgDiv.remove();
+        delete streams[data.id];
+    }
+    renderResponse(data);
+}
+
+function renderResponse(data) {
+    if (data.segments) {
+        appendSegments(data.segments, data.output);
+    } else if (data.has_code && data.code_snippet) {
+        appendBotResponse(data.content, data.code_snippet);
+    } else {
+        appendMessage(data.content, 'bot');
+    }
+}
+
+// История беседы: грузится страницами с конца, старые — при прокрутке вверх
+let historySession = null;
+let historyCursor = null;  // id, до которого грузить следующую страницу (null — больше нет)
+let historyLoading = false;
+
+function historyMessage(item) {
+    const date = new Date(item.created * 1000);
+    if (item.role === 'assistant' && item.segments) {
+        return segmentsMessage(item.segments, item.output_id ? { id: item.output_id } : null, date);
+    }
+
+    const msgDiv = document.createElement('div');
+    msgDiv.classList.add('message', item.role === 'user' ? 'user' : 'bot');
+
+    const contentDiv = document.createElement('div');
+    contentDiv.classList.add('text');
+    contentDiv.textContent = item.content;
+
+    const timeSpan = document.createElement('span');
+    timeSpan.classList.add('message-time');
+    timeSpan.textContent = formatTime(date);
+
+    msgDiv.append(contentDiv, timeSpan);
+    return msgDiv;
+}
+
+async function loadHistory() {
+    if (historyLoading || !historySession) return;
+    historyLoading = true;
+    const session = historySession;
+
+    try {
+        const params = new URLSearchParams({ session });
+        if (historyCursor) params.set('before', historyCursor);
+        const response = await fetch(`/history?${params}`);
+        if (!response.ok) throw new Error(`HTTP ${response.status}`);
+        const page = await response.json();
+        if (session !== historySession) return;  // Пока грузили, переключили беседу
+
+        // Страница от новых к старым: вставляем в начало, сохраняя позицию прокрутки
+        const firstPage = !historyCursor;
+        const bottomOffset = chatArea.scrollHeight - chatArea.scrollTop;
+        for (const item of page.messages) {
+            chatArea.prepend(historyMessage(item));
+        }
+        historyCursor = page.next_before;
+        chatArea.scrollTop = firstPage ? chatArea.scrollHeight : chatArea.scrollHeight - bottomOffset;
+    } catch (e) {
+        console.error('History load error:', e);
+        historyCursor = null;
+    } finally {
+        historyLoading = false;
+    }
+
+    // Экран ещё не заполнен — догружаем, пока не появится прокрутка
+    if (historyCursor && chatArea.scrollHeight <= chatArea.clientHeight) {
+        loadHistory();
+    }
+}
+
+chatArea.addEventListener('scroll', () => {
+    if (chatArea.scrollTop < 100 && historyCursor) {
+        loadHistory();
+    }
+});
+
+// Поиск по истории всех бесед: /search текст
+async function searchHistory(query) {
+    try {
+        const response = await fetch(`/history/search?${new URLSearchParams({ q: query, limit: 20 })}`);
+        if (!response.ok) throw new Error(`HTTP ${response.status}`);
+        const result = await response.json();
+        if (!result.messages.length) {
+            addSystemMessage(`🔍 Ничего не найдено: ${query}`);
+            return;
+        }
+        const lines = result.messages.map(m => {
+            const when = new Date(m.created * 1000).toLocaleString();
+            const who = m.role === 'user' ? '👤' : '🤖';
+            return `${when} [${m.session}] ${who} ${m.content.slice(0, 200)}`;
+        });
+        addSystemMessage(`🔍 ${query}:\n${lines.join('\n')}`);
+    } catch (e) {
+        addSystemMessage(`❌ Поиск: ${e.message}`);
+    }
+}
+
+// Поиск файлов по имени: /find запрос; каталог скачивается архивом
+async function findFiles(query) {
+    try {
+        const response = await fetch(`/files/search?${new URLSearchParams({ q: query, limit: 20 })}`);
+        if (!response.ok) throw new Error(`HTTP ${response.status}`);
+        const result = await response.json();
+        if (!result.files.length) {
+            addSystemMessage(`🔎 Ничего не найдено: ${query}`);
+            return;
+        }
+        const msgDiv = document.createElement('div');
+        msgDiv.classList.add('message', 'system');
+        const contentDiv = document.createElement('div');
+        contentDiv.classList.add('text');
+        contentDiv.textContent = `🔎 ${query}:`;
+        for (const file of result.files) {
+            const link = document.createElement('a');
+            link.href = `/files/download?${new URLSearchParams({ path: file.path })}`;
+            link.textContent = file.dir
+                ? `📁 ${file.path} (zip)`
+                : `📄 ${file.path} (${Math.max(1, Math.round(file.size / 1024))} КБ)`;
+            contentDiv.append(document.createElement('br'), link);
+        }
+        msgDiv.appendChild(contentDiv);
+        chatArea.appendChild(msgDiv);
+        chatArea.scrollTop = chatArea.scrollHeight;
+    } catch (e) {
+        addSystemMessage(`❌ Поиск файлов: ${e.message}`);
+    }
+}
+
+// Список бесед и текущая беседа
+function showSessions(data) {
+    sessionName.textContent = `[${data.active}]`;
+
+    if (data.active !== historySession) {
+        // Другая беседа (или первое подключение) — показываем её историю
+        historySession = data.active;
+        historyCursor = null;
+        chatArea.innerHTML = '';
+        addSystemMessage(`Беседа ${data.active}`);
+        loadHistory();
+    }
+
+    if (data.error) {
+        addSystemMessage(`❌ ${data.error}`);
+    } else if (sessionCommandPending) {
+        const lines = data.sessions.map(s =>
+            `${s.name === data.active ? '▶' : '•'} ${s.name}${s.started ? '' : ' (пустая)'}`);
+        addSystemMessage(`Беседы:\n${lines.join('\n')}`);
+    }
+    sessionCommandPending = false;
+}
+
+// Сервер не может дослать пропущенное (перезапуск или буфер переполнен)
+function handleResync(data) {
+    const hadState = outboxEpoch !== null && lastSeq > 0;
+    outboxEpoch = data.epoch;
+    lastSeq = 0;
+
+    if (hadState && historySession) {
+        // Что-то потеряно — перечитываем беседу из истории, идущие запросы дошлёт сервер
+        for (const id of Object.keys(streams)) delete streams[id];
+        historyCursor = null;
+        chatArea.innerHTML = '';
+        addSystemMessage(`Беседа ${historySession}`);
+        loadHistory();
+    }
+}
+
+// Обработка сообщения от бота
+function handleBotMessage(data) {
+    if (data.type === 'resync') {
+        handleResync(data);
+        return;
+    }
+
+    // Кадры из outbox нумеруются: повторы после досылки пропускаем
+    if (data.seq !== undefined) {
+        if (data.seq <= lastSeq) return;
+        lastSeq = data.seq;
+    }
+
+    if (data.type.startsWith('upload_')) {
+        handleUploadMessage(data);
+    } else if (data.type === 'delta') {
+        appendDelta(data);
+    } else if (data.type === 'queued') {
+        showQueued(data);
+    } else if (data.type === 'done') {
+        finishStream(data);
+    } else if (data.type === 'sessions') {
+        showSessions(data);
+    } else if (data.type === 'status') {
+        // Обновление статуса (например, "Обрабатываю... 30с")
+        addSystemMessage(data.content);
+    } else if (data.type === 'response') {
+        // Обычный текстовый ответ
+        renderResponse(data);
+    }
+}
+
+// Сегменты ответа: текст и блоки кода (каждый со своей кнопкой копирования)
+function renderSegments(container, segments) {
+    for (const segment of segments) {
+        if (segment.kind === 'code') {
+            const block = document.createElement('div');
+            block.classList.add('code-block');
+
+            if (segment.language) {
+                const lang = document.createElement('span');
+                lang.classList.add('code-lang');
+                lang.textContent = segment.language;
+                block.appendChild(lang);
+            }
+
+            const code = document.createElement('code');
+            code.textContent = segment.content;
+
+            const copyBtn = document.createElement('button');
+            copyBtn.classList.add('copy-btn');
+            copyBtn.textContent = 'COPY';
+            copyBtn.onclick = () => copyCode(copyBtn, segment.content);
+
+            block.append(code, copyBtn);
+            container.appendChild(block);
+        } else {
+            const textDiv = document.createElement('div');
+            textDiv.classList.add('text');
+            textDiv.textContent = segment.content;
+            container.appendChild(textDiv);
+        }
+    }
+}
+
+// Сообщение бота из сегментов; огромный ответ — с постраничной догрузкой
+function segmentsMessage(segments, output = null, date = new Date()) {
+    const msgDiv = document.createElement('div');
+    msgDiv.classList.add('message', 'bot');
+
+    const textDiv = document.createElement('div');
+    renderSegments(textDiv, segments);
+    msgDiv.appendChild(textDiv);
+
+    if (output) {
+        appendOutputPager(msgDiv, textDiv, output);
+    }
+
+    const timeSpan = document.createElement('span');
+    timeSpan.classList.add('message-time');
+    timeSpan.textContent = formatTime(date);
+    msgDiv.appendChild(timeSpan);
+    return msgDiv;
+}
+
+function appendSegments(segments, output = null) {
+    chatArea.appendChild(segmentsMessage(segments, output));
+    chatArea.scrollTop = chatArea.scrollHeight;
+}
+
+// Огромный ответ: сначала начало, остальное подгружается страницами по запросу
+function appendOutputPager(msgDiv, textDiv, output) {
+    const fullDiv = document.createElement('div');
+    fullDiv.classList.add('text', 'output-full');
+    fullDiv.hidden = true;
+
+    const actions = document.createElement('div');
+    actions.classList.add('output-actions');
+
+    const info = document.createElement('span');
+    info.textContent = output.bytes
+        ? `✂️ Показано начало (${Math.round(output.bytes / 1024)} КБ всего)`
+        : '✂️ Показано начало';
+
+    const moreBtn = document.createElement('button');
+    moreBtn.textContent = 'Читать полностью';
+
+    const download = document.createElement('a');
+    download.href = `/outputs/${output.id}/download`;
+    download.textContent = 'Скачать';
+
+    let offset = 0;
+    moreBtn.onclick = async () => {
+        moreBtn.disabled = true;
+        try {
+            const response = await fetch(`/outputs/${output.id}?offset=${offset}`);
+            if (!response.ok) throw new Error(`HTTP ${response.status}`);
+            const page = await response.json();
+
+            // Первая страница заменяет превью полным текстом
+            textDiv.hidden = true;
+            fullDiv.hidden = false;
+            fullDiv.appendChild(document.createTextNode(page.content));
+
+            offset = page.next_offset;
+            info.textContent = `${Math.round(offset / 1024)} из ${Math.round(page.size / 1024)} КБ`;
+            moreBtn.textContent = 'Ещё';
+            moreBtn.hidden = page.eof;
+        } catch (e) {
+            info.textContent = `❌ ${e.message}`;
+        }
+        moreBtn.disabled = false;
+    };
+
+    actions.append(info, moreBtn, download);
+    msgDiv.append(fullDiv, actions);
+}
+
+// Ответ бота с блоком кода
+function appendBotResponse(text, command) {
+    const msgDiv = document.createElement('div');
+    msgDiv.classList.add('message', 'bot');
+
+    let htmlContent = `<div class="text">${escapeHtml(text)}</div>`;
+
+    // Если есть команда, добавляем блок кода
+    if (command) {
+        const escapedCommand = escapeHtml(command);
+        const safeCommand = command.replace(/`/g, '\\`').replace(/\$/g, '\\$');
+        htmlContent += `
+            <div class="code-block">
+                <code>${escapedCommand}</code>
+                <button class="copy-btn" onclick="copyCode(this, \`${safeCommand}\`)">COPY</button>
+            </div>
+        `;
+    }
+
+    const now = new Date();
+    htmlContent += `<span class="message-time">${formatTime(now)}</span>`;
+
+    msgDiv.innerHTML = htmlContent;
+    chatArea.appendChild(msgDiv);
+    chatArea.scrollTop = chatArea.scrollHeight;
+}
+
+// Копирование кода
+function copyCode(btn, code) {
+    navigator.clipboard.writeText(code).then(() => {
+        const originalText = btn.innerText;
+        btn.innerText = "COPIED!";
+        btn.style.background = "var(--terminal-green)";
+        setTimeout(() => {
+            btn.innerText = originalText;
+            btn.style.background = "var(--neon-cyan)";
+        }, 2000);
+    });
+}
+
+// Форматирование времени
+function formatTime(date) {
+    const h = date.getHours();
+    const m = date.getMinutes();
+    return `${h}:${m < 10 ? '0' : ''}${m}`;
+}
+
+// Экранирование HTML
+function escapeHtml(text) {
+    const div = document.createElement('div');
+    div.textContent = text;
+    return div.innerHTML;
+}
+
+// Загрузка файлов кусками: upload_init → бинарные кадры → upload_commit
+// Кадр: 16 байт upload_id, 8 байт смещение, 32 байта SHA-256 куска, данные
+const UPLOAD_WINDOW = 4;  // Кусков в полёте без подтверждения
+const HASH_FIRST_MAX_SIZE = 256 * 1024 * 1024;  // Больше — не читаем файл целиком ради хеша
+const uploads = {};
+
+function randomHex(bytes) {
+    const buf = crypto.getRandomValues(new Uint8Array(bytes));
+    return Array.from(buf, b => b.toString(16).padStart(2, '0')).join('');
+}
+
+function hexToBytes(hex) {
+    return new Uint8Array(hex.match(/../g).map(h => parseInt(h, 16)));
+}
+
+function startUpload(file, kind) {
+    const id = randomHex(16);
+    const label = kind === 'image' ? '📷' : '📄';
+    const imageUrl = kind === 'image' ? URL.createObjectURL(file) : null;
+
+    appendMessage(`${label} ${file.name}`, 'user', kind === 'image', imageUrl);
+    addSystemMessage(`⬆️ ${file.name}: 0%`);
+
+    uploads[id] = {
+        id, file, kind,
+        sha256: null,
+        chunkSize: 256 * 1024,
+        sent: 0,
+        acked: 0,
+        progressDiv: chatArea.lastChild.querySelector('.text')
+    };
+
+    // Хеш заранее: если такой файл уже есть на сервере, загрузка не нужна
+    fileSha256(file).then(sha256 => {
+        uploads[id].sha256 = sha256;
+        sendUploadInit(uploads[id]);
+    });
+}
+
+// SHA-256 всего файла (только https/localhost и не слишком большие файлы)
+async function fileSha256(file) {
+    if (!window.crypto || !crypto.subtle || file.size > HASH_FIRST_MAX_SIZE) return null;
+    const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+    return Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+}
+
+function sendUploadInit(upload) {
+    ws.send(JSON.stringify({
+        type: 'upload_init',
+        upload_id: upload.id,
+        filename: upload.file.name,
+        size: upload.file.size,
+        kind: upload.kind,
+        sha256: upload.sha256
+    }));
+}
+
+async function sendChunk(upload, offset) {
+    const end = Math.min(offset + upload.chunkSize, upload.file.size);
+    const data = new Uint8Array(await upload.file.slice(offset, end).arrayBuffer());
+
+    const frame = new Uint8Array(56 + data.length);
+    frame.set(hexToBytes(upload.id), 0);
+    new DataView(frame.buffer).setBigUint64(16, BigInt(offset));
+    // crypto.subtle есть только на https/localhost — без него хеш куска не шлём
+    if (window.crypto && crypto.subtle) {
+        frame.set(new Uint8Array(await crypto.subtle.digest('SHA-256', data)), 24);
+    }
+    frame.set(data, 56);
+
+    if (ws && ws.readyState === WebSocket.OPEN) ws.send(frame);
+}
+
+async function pumpUpload(upload) {
+    if (upload.pumping) return;
+    upload.pumping = true;
+    try {
+        while (upload.sent < upload.file.size &&
+               upload.sent - upload.acked < UPLOAD_WINDOW * upload.chunkSize) {
+            const offset = upload.sent;
+            upload.sent = Math.min(offset + upload.chunkSize, upload.file.size);
+            await sendChunk(upload, offset);
+        }
+        if (upload.acked === upload.file.size && !upload.committing) {
+            upload.committing = true;
+            ws.send(JSON.stringify({ type: 'upload_commit', upload_id: upload.id, sha256: upload.sha256 }));
+        }
+    } finally {
+        upload.pumping = false;
+    }
+}
+
+function handleUploadMessage(data) {
+    const upload = uploads[data.upload_id];
+
+    if (data.type === 'upload_error') {
+        addSystemMessage(`❌ ${data.error}`);
+        if (upload) delete uploads[upload.id];
+        return;
+    }
+    if (!upload) return;
+
+    if (data.type === 'upload_ready') {
+        // Старт или продолжение с места, где остановился сервер
+        upload.chunkSize = data.chunk_size || upload.chunkSize;
+        upload.sent = upload.acked = data.offset;
+        upload.committing = false;
+    } else if (data.type === 'upload_progress') {
+        upload.acked = Math.max(upload.acked, data.offset);
+    } else if (data.type === 'upload_done') {
+        upload.progressDiv.textContent = `⬆️ ${upload.file.name}: 100%`;
+        delete uploads[upload.id];
+        renderResponse(data);
+        return;
+    }
+
+    const percent = upload.file.size ? Math.floor(upload.acked * 100 / upload.file.size) : 100;
+    upload.progressDiv.textContent = `⬆️ ${upload.file.name}: ${percent}%`;
+    pumpUpload(upload);
+}
+
+// После переподключения продолжаем незавершённые загрузки
+function resumeUploads() {
+    Object.values(uploads).forEach(upload => {
+        addSystemMessage(`⬆️ ${upload.file.name}: продолжаю...`);
+        upload.progressDiv = chatArea.lastChild.querySelector('.text');
+        sendUploadInit(upload);
+    });
+}
+
+fileInput.addEventListener('change', (e) => {
+    const file = e.target.files[0];
+    if (!file) return;
+    startUpload(file, 'file');
+    fileInput.value = '';
+});
+
+imgInput.addEventListener('change', (e) => {
+    const file = e.target.files[0];
+    if (!file) return;
+    startUpload(file, 'image');
+    imgInput.value = '';
+});
+
+// Event listeners
+sendBtn.addEventListener('click', sendMessage);
+messageInput.addEventListener('keypress', (e) => {
+    if (e.key === 'Enter') sendMessage();
+});
+
+// Сеть вернулась или вкладку снова открыли — переподключаемся, не дожидаясь таймера
+function reconnectNow() {
+    if (ws && ws.readyState !== WebSocket.CLOSED) return;
+    clearTimeout(reconnectTimer);
+    connect();
+}
+window.addEventListener('online', reconnectNow);
+document.addEventListener('visibilitychange', () => {
+    if (!document.hidden) reconnectNow();
+});
+
+// Оболочка интерфейса из кэша service worker: страница открывается сразу,
+// а соединение с сервером устанавливается в фоне
+if ('serviceWorker' in navigator) {
+    navigator.serviceWorker.register('/sw.js').catch(e => console.warn('Service worker:', e));
+}
+
+// Инициализация подключения
+connect();
@@ -0,0 +1,53 @@
+// Service worker веб-интерфейса: оболочка (страница, стили, скрипт) берётся
+// из кэша сразу, свежая страница подтягивается в фоне. VERSION и SHELL
+// подставляет static_assets.py при старте api.py.
+const VERSION = '__VERSION__';
+const SHELL = __SHELL__;
+const CACHE = `shell-${VERSION}`;
+
+self.addEventListener('install', event => {
+    event.waitUntil(
+        caches.open(CACHE)
+            .then(cache => cache.addAll(SHELL))
+            .then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', event => {
+    // Кэши прошлых версий больше не нужны
+    event.waitUntil(
+        caches.keys()
+            .then(keys => Promise.all(
+                keys.filter(key => key.startsWith('shell-') && key !== CACHE).map(key => caches.delete(key))
+            ))
+            .then(() => self.clients.claim())
+    );
+});
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    if (request.method !== 'GET') return;
+    const url = new URL(request.url);
+    if (url.origin !== self.location.origin) return;
+
+    if (request.mode === 'navigate' && url.pathname === '/') {
+        // Страница — из кэша без ожидания сети, обновление кэша в фоне
+        event.respondWith(caches.open(CACHE).then(async cache => {
+            const cached = await cache.match('/');
+            const fresh = fetch(request).then(response => {
+                if (response.ok) cache.put('/', response.clone());
+                return response;
+            });
+            if (!cached) return fresh;
+            event.waitUntil(fresh.catch(() => {}));
+            return cached;
+        }));
+        return;
+    }
+
+    if (SHELL.includes(url.pathname)) {
+        // Хешированные URL не меняются: кэш без обращения к серверу
+        event.respondWith(caches.match(request).then(cached => cached || fetch(request)));
+    }
+    // API, WebSocket, загрузки и скачивания — мимо кэша
+});